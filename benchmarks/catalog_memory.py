@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Measure the memory used by a fully loaded installable package storage.
+
+A synthetic catalog of the given number of packages, each with one remote
+file and a shared install definition, is loaded and every package is built.
+The memory allocated by the storage is then reported with tracemalloc.
+
+Usage: python3 benchmarks/catalog_memory.py [NB_PKGS]
+
+"""
+
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+from xivo_fetchfw import storage
+
+_VENDORS = ['aastra', 'cisco', 'digium', 'polycom', 'snom', 'yealink']
+
+
+def _pkg_id(i):
+    return f'{_VENDORS[i % len(_VENDORS)]}-fw-{i}'
+
+
+def _write_catalog(db_dir, nb_pkgs):
+    with open(os.path.join(db_dir, 'bench.db'), 'w') as fobj:
+        fobj.write('[install_fw]\na-b: unzip $FILE1\nb-c: cp * $ARG1\n\n')
+        for i in range(nb_pkgs):
+            vendor = _VENDORS[i % len(_VENDORS)]
+            # each package depends on the previous one, by groups of 10
+            depends = f'depends: {_pkg_id(i - 1)}\n' if i % 10 else ''
+            fobj.write(
+                f'[pkg_{vendor}-fw-{i}]\n'
+                f'description: Firmware {i} for {vendor} phones\n'
+                f'version: 1.{i % 10}\n'
+                f'files: {vendor}-fw-{i}\n'
+                f'install: fw var/lib/{vendor}\n'
+                f'{depends}\n'
+                f'[file_{vendor}-fw-{i}]\n'
+                f'url: http://example.org/{vendor}/fw-{i}.zip\n'
+                f'size: {1000 + i}\n'
+                f'sha1sum: {i:040x}\n\n'
+            )
+
+
+def main():
+    nb_pkgs = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        db_dir = os.path.join(tmp_dir, 'installable')
+        os.mkdir(db_dir)
+        _write_catalog(db_dir, nb_pkgs)
+        # load once to write the catalog snapshot, like a warm start would
+        storage.new_installable_pkg_storage(db_dir, tmp_dir, {'default': None}, {})
+
+        gc.collect()
+        tracemalloc.start()
+        pkg_sto = storage.new_installable_pkg_storage(
+            db_dir, tmp_dir, {'default': None}, {'KFW_ROOT': 'lib/firmware'}
+        )
+        for pkg_id in pkg_sto:
+            pkg_sto[pkg_id]
+        gc.collect()
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print(f'packages: {nb_pkgs}')
+    print(f'memory: {size / 2**20:.1f} MiB ({size // nb_pkgs} bytes per package)')
+    print(f'peak: {peak / 2**20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Compare the time taken to parse a catalog file by catalog.parse_catalog
+and by a RawConfigParser.
+
+A synthetic catalog file with the given number of sections, half pkg
+sections and half file sections, is written and parsed by both parsers,
+which are checked to return the same sections.
+
+Usage: python3 benchmarks/catalog_parse.py [NB_SECTIONS]
+
+"""
+
+import configparser
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from xivo_fetchfw import catalog
+
+
+def _write_catalog(filename, nb_sections):
+    with open(filename, 'w') as fobj:
+        fobj.write(
+            '# synthetic catalog\n[install_fw]\na-b: unzip $FILE1\nb-c: cp * $ARG1\n\n'
+        )
+        for i in range(nb_sections // 2):
+            fobj.write(
+                f'[pkg_fw-{i}]\n'
+                f'description: Firmware {i}\n'
+                f'description_fr: Micrologiciel {i}\n'
+                f'version: 1.{i % 10}\n'
+                f'files: fw-{i}\n'
+                f'install: fw var/lib/fw\n\n'
+                f'[file_fw-{i}]\n'
+                f'url: http://example.org/fw-{i}.zip\n'
+                f'    http://mirror.example.org/fw-{i}.zip\n'
+                f'size: {1000 + i}\n'
+                f'sha1sum: {i:040x}\n\n'
+            )
+
+
+def _parse_with_config_parser(filename):
+    config = configparser.RawConfigParser()
+    with open(filename) as fobj:
+        config.read_file(fobj)
+    return [(section, dict(config.items(section))) for section in config.sections()]
+
+
+def _parse_with_catalog_parser(filename):
+    with open(filename) as fobj:
+        return catalog.parse_catalog(fobj, filename)
+
+
+def _best_time(fun, filename, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fun(filename)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def main():
+    nb_sections = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp_dir, 'bench.db')
+        _write_catalog(filename, nb_sections)
+        old_time, old_result = _best_time(_parse_with_config_parser, filename)
+        new_time, new_result = _best_time(_parse_with_catalog_parser, filename)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if old_result != new_result:
+        print('error: parsers returned different sections')
+        sys.exit(1)
+    print(f'sections: {len(new_result)}')
+    print(f'RawConfigParser: {old_time * 1000:.0f} ms')
+    print(f'parse_catalog: {new_time * 1000:.0f} ms ({old_time / new_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
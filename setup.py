@@ -13,6 +13,9 @@ setup(
     license='GPLv3',
     packages=find_packages(),
     entry_points={
-        'console_scripts': ['xivo-fetchfw = xivo_fetchfw.main:main'],
+        'console_scripts': [
+            'xivo-fetchfw = xivo_fetchfw.main:main',
+            'xivo-fetchfwd = xivo_fetchfw.main:daemon_main',
+        ],
     },
 )
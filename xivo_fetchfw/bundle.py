@@ -0,0 +1,269 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Offline bundles of packages, for sites without internet access.
+
+A bundle is an uncompressed tar archive containing:
+- catalog/<name> -- a catalog file with the sections of the bundled packages
+- cache/<filename> -- the remote files of the bundled packages
+- MANIFEST.json -- the size and sha1sum of every other member
+
+Each imported catalog file is named after its sha1sum, so that importing a
+bundle never replaces the catalog of another one. Sections that are already
+defined in the catalog of the site are left out of the imported catalog.
+
+"""
+
+import concurrent.futures
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from binascii import b2a_hex
+from configparser import RawConfigParser
+
+from xivo_fetchfw import catalog
+from xivo_fetchfw.util import FetchfwError
+
+logger = logging.getLogger(__name__)
+
+
+class BundleError(FetchfwError):
+    pass
+
+
+_FORMAT_VERSION = 1
+_MANIFEST_NAME = 'MANIFEST.json'
+_CATALOG_PREFIX = 'catalog/'
+_CACHE_PREFIX = 'cache/'
+_BLOCK_SIZE = 65536
+_IMPORTED_CATALOG_NAME = 'bundle-{}.db'
+
+
+class _HashingReader:
+    # File-like object computing the sha1 sum of what is read through it
+    def __init__(self, fobj):
+        self._fobj = fobj
+        self.hash = hashlib.sha1()
+
+    def read(self, size=-1):
+        data = self._fobj.read(size)
+        self.hash.update(data)
+        return data
+
+
+def _sha1_file(filename):
+    hash = hashlib.sha1()
+    with open(filename, 'rb') as fobj:
+        for data in iter(lambda: fobj.read(_BLOCK_SIZE), b''):
+            hash.update(data)
+    return b2a_hex(hash.digest()).decode('ascii')
+
+
+def _add_member(tf, name, fobj, size, manifest):
+    tarinfo = tarfile.TarInfo(name)
+    tarinfo.size = size
+    tarinfo.mtime = int(time.time())
+    tarinfo.mode = 0o644
+    reader = _HashingReader(fobj)
+    tf.addfile(tarinfo, reader)
+    sha1sum = b2a_hex(reader.hash.digest()).decode('ascii')
+    manifest[name] = {'size': size, 'sha1sum': sha1sum}
+    return sha1sum
+
+
+def _render_catalog(sections):
+    config = RawConfigParser()
+    config.read_dict(sections)
+    output = io.StringIO()
+    config.write(output)
+    return output.getvalue().encode('utf-8')
+
+
+def _remote_file_filename(file_section):
+    if 'filename' in file_section:
+        return file_section['filename']
+    return os.path.basename(file_section['url'].split()[0])
+
+
+def export_bundle(
+    filename, pkg_ids, installable_pkg_sto, cache_dir, catalog_name='bundle.db'
+):
+    """Write a bundle of the given packages and their dependencies to filename.
+
+    Every remote file of the bundled packages must be present in the cache
+    directory and have the size and sha1sum from its file definition.
+
+    Return the list of bundled package IDs.
+
+    """
+    bundled_pkg_ids = list(pkg_ids)
+    dependencies = installable_pkg_sto.get_dependencies_many(bundled_pkg_ids)
+    bundled_pkg_ids.extend(sorted(dependencies.difference(bundled_pkg_ids)))
+    sections = installable_pkg_sto.get_pkg_sections(bundled_pkg_ids)
+
+    manifest = {}
+    tmp_filename = filename + '.tmp'
+    try:
+        with tarfile.open(tmp_filename, 'w|') as tf:
+            catalog_data = _render_catalog(sections)
+            _add_member(
+                tf,
+                _CATALOG_PREFIX + catalog_name,
+                io.BytesIO(catalog_data),
+                len(catalog_data),
+                manifest,
+            )
+            for section_name, section in sections.items():
+                if not section_name.startswith('file_'):
+                    continue
+                remote_filename = _remote_file_filename(section)
+                path = os.path.join(cache_dir, remote_filename)
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    raise BundleError(f"file '{remote_filename}' is not in the cache")
+                if size != int(section['size']):
+                    raise BundleError(f"file '{remote_filename}' has an invalid size")
+                logger.debug("Adding '%s' to bundle", path)
+                with open(path, 'rb') as fobj:
+                    sha1sum = _add_member(
+                        tf, _CACHE_PREFIX + remote_filename, fobj, size, manifest
+                    )
+                if sha1sum != section['sha1sum'].lower():
+                    raise BundleError(f"file '{remote_filename}' is corrupted")
+            manifest_data = json.dumps(
+                {
+                    'version': _FORMAT_VERSION,
+                    'packages': bundled_pkg_ids,
+                    'files': manifest,
+                },
+                indent=4,
+            ).encode('utf-8')
+            _add_member(
+                tf, _MANIFEST_NAME, io.BytesIO(manifest_data), len(manifest_data), {}
+            )
+        os.rename(tmp_filename, filename)
+    except Exception:
+        try:
+            raise
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+    return bundled_pkg_ids
+
+
+def _split_member_name(name):
+    # Return a tuple (prefix, filename) from the name of a bundle member
+    for prefix in (_CATALOG_PREFIX, _CACHE_PREFIX):
+        if name.startswith(prefix):
+            filename = name[len(prefix) :]
+            if filename and '/' not in filename and not filename.startswith('.'):
+                return prefix, filename
+    raise BundleError(f"invalid member in bundle: {name}")
+
+
+def _check_manifest(manifest, staged_files):
+    if not isinstance(manifest, dict):
+        raise BundleError('missing manifest in bundle')
+    if manifest.get('version') != _FORMAT_VERSION:
+        raise BundleError(f"unsupported bundle version: {manifest.get('version')}")
+    manifest_files = manifest.get('files')
+    packages = manifest.get('packages')
+    if not isinstance(manifest_files, dict) or not isinstance(packages, list):
+        raise BundleError('invalid manifest in bundle')
+    if set(manifest_files) != set(staged_files):
+        raise BundleError('bundle content does not match its manifest')
+    for name, (staged_path, future) in staged_files.items():
+        try:
+            expected_size = manifest_files[name]['size']
+            expected_sha1sum = manifest_files[name]['sha1sum']
+        except (KeyError, TypeError):
+            raise BundleError(f"invalid manifest entry for '{name}' in bundle")
+        if os.path.getsize(staged_path) != expected_size:
+            raise BundleError(f"invalid size for '{name}' in bundle")
+        if future.result() != expected_sha1sum:
+            raise BundleError(f"invalid sha1sum for '{name}' in bundle")
+
+
+def _strip_staged_catalog(staged_path, site_catalog, catalog_filename):
+    # Remove from the staged catalog file the sections already defined by
+    # other files of the site catalog and return the number of sections left
+    with open(staged_path) as fobj:
+        sections = catalog.parse_catalog(fobj, staged_path)
+    new_sections = {}
+    for section, options in sections:
+        if any(
+            filename != catalog_filename for filename in site_catalog.filenames(section)
+        ):
+            logger.info("Skipping section '%s' already in the catalog", section)
+        else:
+            new_sections[section] = options
+    if len(new_sections) != len(sections):
+        with open(staged_path, 'wb') as fobj:
+            fobj.write(_render_catalog(new_sections))
+    return len(new_sections)
+
+
+def import_bundle(filename, installable_db_dir, cache_dir, max_workers=4):
+    """Import the bundle filename, moving its catalog file in
+    installable_db_dir, named after its sha1sum and without the sections
+    already in the catalog of installable_db_dir, and its remote files in
+    cache_dir.
+
+    Members are extracted in hidden staging directories on the same
+    filesystems than their destination and are verified in parallel while
+    the bundle is read, so that they can be renamed into place once the
+    whole bundle has been verified.
+
+    Return the list of bundled package IDs.
+
+    """
+    staging_dirs = {}
+    try:
+        staging_dirs[_CATALOG_PREFIX] = tempfile.mkdtemp(
+            prefix='.import-', dir=installable_db_dir
+        )
+        staging_dirs[_CACHE_PREFIX] = tempfile.mkdtemp(prefix='.import-', dir=cache_dir)
+        dest_dirs = {_CATALOG_PREFIX: installable_db_dir, _CACHE_PREFIX: cache_dir}
+        staged_files = {}
+        manifest = None
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            with tarfile.open(filename, 'r|*') as tf:
+                for member in tf:
+                    if member.name == _MANIFEST_NAME:
+                        manifest = json.load(tf.extractfile(member))
+                        continue
+                    prefix, member_filename = _split_member_name(member.name)
+                    if not member.isfile() or member.name in staged_files:
+                        raise BundleError(f"invalid member in bundle: {member.name}")
+                    staged_path = os.path.join(staging_dirs[prefix], member_filename)
+                    with tf.extractfile(member) as src, open(staged_path, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, _BLOCK_SIZE)
+                    future = executor.submit(_sha1_file, staged_path)
+                    staged_files[member.name] = (staged_path, future)
+            _check_manifest(manifest, staged_files)
+
+        site_catalog = catalog.Catalog(installable_db_dir)
+        site_catalog.update()
+        for name, (staged_path, _) in staged_files.items():
+            prefix, member_filename = _split_member_name(name)
+            if prefix == _CATALOG_PREFIX:
+                sha1sum = manifest['files'][name]['sha1sum']
+                member_filename = _IMPORTED_CATALOG_NAME.format(sha1sum[:12])
+                if not _strip_staged_catalog(
+                    staged_path, site_catalog, member_filename
+                ):
+                    continue
+            os.replace(staged_path, os.path.join(dest_dirs[prefix], member_filename))
+    except (OSError, tarfile.TarError, ValueError, catalog.CatalogError) as e:
+        raise BundleError(f"could not import bundle '{filename}': {e}")
+    finally:
+        for staging_dir in staging_dirs.values():
+            shutil.rmtree(staging_dir, True)
+    return manifest['packages']
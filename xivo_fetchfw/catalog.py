@@ -0,0 +1,493 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Compiled snapshot of the catalog files of the installable storage.
+
+Parsing every catalog file with a config parser on each invocation is slow
+with large catalogs, so the parsed sections of each file are saved in a
+snapshot file, in the catalog directory, and reused as long as the
+modification time, size and inode of the file don't change. Only the files
+that changed are parsed again, after which the snapshot is rewritten
+atomically.
+
+The snapshot is a marshal dump of simple types, which is both fast to load
+and safe, unlike a pickle.
+
+Catalog files are parsed by parse_catalog, a single pass parser of the
+subset of the INI syntax of RawConfigParser used by catalog files, which is
+much faster than a RawConfigParser on large catalogs. Like when the files
+were all read by the same RawConfigParser, a section defined in more than
+one file is the merge of its definitions and the options of the DEFAULT
+sections are added to the sections of every file, files being merged in the
+order of their names.
+
+"""
+
+import collections.abc
+import configparser
+import logging
+import marshal
+import os
+import re
+import sys
+import tempfile
+
+from xivo_fetchfw.util import FetchfwError
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogError(FetchfwError):
+    pass
+
+
+SNAPSHOT_FILENAME = '.catalog.snapshot'
+_SNAPSHOT_MAGIC = b'FFWCAT'
+_SNAPSHOT_VERSION = 3
+_MARSHAL_VERSION = 4
+_SECTION_REGEX = re.compile(r'\[(?P<header>.+)\]')
+_DEFAULT_SECTION = 'DEFAULT'
+# options whose values are interned since they are often repeated; option
+# and section names are always interned. Interned strings stay interned when
+# loaded back from a snapshot.
+_INTERNED_OPTIONS = frozenset(['version', 'downloader', 'install'])
+
+
+class CatalogConfig:
+    """A read-only object with the same interface than a RawConfigParser
+    for the operations used by the catalog builders.
+
+    """
+
+    def __init__(self, sections):
+        # sections -- a dictionary where keys are section names and values
+        #   are dictionaries of options
+        self._sections = sections
+
+    def sections(self):
+        return list(self._sections)
+
+    def has_section(self, section):
+        return section in self._sections
+
+    def has_option(self, section, option):
+        return option in self._get_section(section)
+
+    def get(self, section, option):
+        try:
+            return self._get_section(section)[option]
+        except KeyError:
+            raise configparser.NoOptionError(option, section)
+
+    def getint(self, section, option):
+        return int(self.get(section, option))
+
+    def items(self, section):
+        return list(self._get_section(section).items())
+
+    def _get_section(self, section):
+        try:
+            return self._sections[section]
+        except KeyError:
+            raise configparser.NoSectionError(section)
+
+
+def file_key(stat_result):
+    """Return a key identifying the version of a file from its stat result."""
+    return stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino
+
+
+def _intern_value(option, value):
+    if option in _INTERNED_OPTIONS:
+        return sys.intern(value)
+    return value
+
+
+def parse_catalog(lines, filename='<catalog>'):
+    """Parse the lines of a catalog file and return a list of (section,
+    {option: value, ...}), in the order of the file.
+
+    The syntax is the one of a RawConfigParser with the default options,
+    i.e. full line comments starting with '#' or ';', options separated from
+    their value by '=' or ':', case-insensitive option names, multi-line
+    values made of the following lines that are more indented than the
+    option and a DEFAULT section whose options are added to every section.
+
+    Raise a CatalogError, mentioning the file and line number, on error.
+
+    """
+    sections, defaults = _parse_catalog(lines, filename)
+    if defaults:
+        return [(section, {**defaults, **options}) for section, options in sections]
+    return sections
+
+
+def _parse_catalog(lines, filename):
+    # Return a tuple (sections, defaults) where sections is the list of
+    # (section, {option: value, ...}) of the file, without the options of the
+    # DEFAULT section, and defaults the options of the DEFAULT section
+    sections = []
+    seen_sections = set()
+    defaults = {}
+    options = None
+    # the current option, or None if no option has been seen yet in the
+    # current section; the lines of its value are only kept in a list once
+    # a continuation line is seen, most values being on a single line
+    option = None
+    values = None
+    nb_blank_lines = 0
+    indent_level = 0
+    for lineno, line in enumerate(lines, 1):
+        stripped = line.strip()
+        if not stripped:
+            nb_blank_lines += 1
+            continue
+        if stripped[0] in '#;':
+            continue
+        indent = len(line) - len(line.lstrip())
+        if option is not None and indent > indent_level:
+            if values is None:
+                values = [options[option]]
+            if nb_blank_lines:
+                values.extend([''] * nb_blank_lines)
+            values.append(stripped)
+            nb_blank_lines = 0
+            continue
+        nb_blank_lines = 0
+        if values is not None:
+            options[option] = _intern_value(option, '\n'.join(values))
+            values = None
+        indent_level = indent
+        if stripped[0] == '[':
+            m = _SECTION_REGEX.match(stripped)
+            if m:
+                section = m.group('header')
+                if section == _DEFAULT_SECTION:
+                    options = defaults
+                elif section in seen_sections:
+                    raise CatalogError(
+                        f"{filename}:{lineno}: section '{section}' already exists"
+                    )
+                else:
+                    seen_sections.add(section)
+                    options = {}
+                    sections.append((sys.intern(section), options))
+                option = None
+                continue
+        if options is None:
+            raise CatalogError(f"{filename}:{lineno}: no section header")
+        sep_pos = stripped.find('=')
+        colon_pos = stripped.find(':')
+        if sep_pos == -1 or -1 < colon_pos < sep_pos:
+            sep_pos = colon_pos
+        option = sys.intern(stripped[:sep_pos].rstrip().lower())
+        if sep_pos == -1 or not option:
+            raise CatalogError(f"{filename}:{lineno}: invalid line: {stripped!r}")
+        if option in options:
+            raise CatalogError(f"{filename}:{lineno}: option '{option}' already exists")
+        options[option] = _intern_value(option, stripped[sep_pos + 1 :].lstrip())
+    if values is not None:
+        options[option] = _intern_value(option, '\n'.join(values))
+    return sections, defaults
+
+
+def _parse_file(path):
+    # Return a tuple (sections, defaults) from a catalog file
+    with open(path) as fobj:
+        return _parse_catalog(fobj, path)
+
+
+def read_snapshot_file(snapshot_path, magic, version):
+    """Return the value saved by write_snapshot_file in snapshot_path, or None
+    if the file is missing, invalid or from another version.
+
+    """
+    try:
+        with open(snapshot_path, 'rb') as fobj:
+            data = fobj.read()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logger.warning("Could not read snapshot '%s': %s", snapshot_path, e)
+        return None
+    if not data.startswith(magic):
+        return None
+    try:
+        snapshot_version, value = marshal.loads(data[len(magic) :])
+    except (EOFError, ValueError, TypeError):
+        logger.warning("Invalid snapshot '%s'", snapshot_path)
+        return None
+    if snapshot_version != version:
+        return None
+    return value
+
+
+def write_snapshot_file(snapshot_path, magic, version, value):
+    """Atomically save value, made of simple types, in snapshot_path.
+
+    Errors are logged and otherwise ignored, since snapshots are only caches.
+
+    """
+    dirname, basename = os.path.split(snapshot_path)
+    data = magic + marshal.dumps((version, value), _MARSHAL_VERSION)
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix=basename + '.', dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as fobj:
+                fobj.write(data)
+            os.replace(tmp_path, snapshot_path)
+        except Exception:
+            try:
+                raise
+            finally:
+                os.remove(tmp_path)
+    except OSError as e:
+        logger.warning("Could not write snapshot '%s': %s", snapshot_path, e)
+
+
+def _read_snapshot(snapshot_path):
+    # Return the dictionary of file entries of the snapshot, or an empty
+    # dictionary if the snapshot is missing, invalid or from another version
+    entries = read_snapshot_file(snapshot_path, _SNAPSHOT_MAGIC, _SNAPSHOT_VERSION)
+    if entries is None:
+        return {}
+    return entries
+
+
+def _write_snapshot(snapshot_path, entries):
+    write_snapshot_file(snapshot_path, _SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, entries)
+
+
+class Catalog:
+    """The catalog files of a directory.
+
+    The catalog is loaded by calling update, which can be called again later
+    to take into account the files that have been added, removed or
+    modified since the last call. Only these files are parsed again. The
+    changes can also be read with read_update, checked, and then applied
+    with apply_update.
+
+    Files whose name starts with a dot are ignored.
+
+    """
+
+    def __init__(self, db_dir, snapshot_filename=SNAPSHOT_FILENAME):
+        self._db_dir = db_dir
+        self._snapshot_path = os.path.join(db_dir, snapshot_filename)
+        # dictionary of filename -> (file key, [(section, options), ...],
+        #   default options)
+        self._entries = {}
+        # dictionary of section -> list of (filename, options) sorted by
+        #   filename
+        self._section_defs = {}
+        self._defaults = {}
+        self.config = CatalogConfig({})
+
+    def key(self):
+        """Return a value identifying the version of the catalog files as of
+        the last update.
+
+        """
+        return tuple(
+            sorted((filename, entry[0]) for filename, entry in self._entries.items())
+        )
+
+    def filenames(self, section):
+        """Return the sorted list of the names of the files defining section,
+        as of the last update.
+
+        """
+        return [filename for filename, _ in self._section_defs.get(section, ())]
+
+    def update(self):
+        """Update the catalog and return the set of the names of the sections
+        that have been added, removed or modified.
+
+        Raise a CatalogError if a file can't be read or parsed, in which case
+        the catalog is left unchanged.
+
+        """
+        return self.apply_update(self.read_update())
+
+    def read_update(self):
+        """Return a CatalogUpdate of the changes of the catalog files since
+        the last update, without applying it.
+
+        Raise a CatalogError if a file can't be read or parsed.
+
+        """
+        if self._entries:
+            cached_entries = self._entries
+        else:
+            cached_entries = _read_snapshot(self._snapshot_path)
+        entries = self._read_entries(cached_entries)
+
+        changed_filenames = {
+            filename
+            for filename in set(entries).union(self._entries)
+            if entries.get(filename) != self._entries.get(filename)
+        }
+        # dictionary of section -> new list of (filename, options), for the
+        # sections that may have changed
+        section_defs = {}
+
+        def updated_section_defs(section):
+            if section not in section_defs:
+                section_defs[section] = list(self._section_defs.get(section, ()))
+            return section_defs[section]
+
+        for filename in changed_filenames:
+            if filename in self._entries:
+                for section, _ in self._entries[filename][1]:
+                    defs = updated_section_defs(section)
+                    defs[:] = [
+                        section_def
+                        for section_def in defs
+                        if section_def[0] != filename
+                    ]
+            if filename in entries:
+                for section, options in entries[filename][1]:
+                    updated_section_defs(section).append((filename, options))
+                    section_defs[section].sort(key=lambda section_def: section_def[0])
+        defaults = {}
+        for filename in sorted(entries):
+            defaults.update(entries[filename][2])
+        if defaults != self._defaults:
+            for section in self._section_defs:
+                updated_section_defs(section)
+
+        sections = self.config._sections
+        changes = {}
+        for section, defs in section_defs.items():
+            if not defs:
+                if section in sections:
+                    changes[section] = None
+                continue
+            options = _merge_options(defs, defaults)
+            if sections.get(section) != options:
+                changes[section] = options
+        return CatalogUpdate(
+            CatalogConfig(_UpdatedSections(sections, changes)),
+            changes,
+            entries,
+            cached_entries,
+            section_defs,
+            defaults,
+        )
+
+    def apply_update(self, update):
+        """Apply update, a CatalogUpdate returned by the last call to
+        read_update, and return the set of the names of the sections that
+        have been added, removed or modified.
+
+        """
+        for section, defs in update._section_defs.items():
+            if defs:
+                self._section_defs[section] = defs
+            else:
+                self._section_defs.pop(section, None)
+        self._defaults = update._defaults
+        sections = self.config._sections
+        for section, options in update._changes.items():
+            if options is None:
+                del sections[section]
+            else:
+                sections[section] = options
+
+        if update._entries != update._cached_entries:
+            _write_snapshot(self._snapshot_path, update._entries)
+        self._entries = update._entries
+        return update.changed_sections
+
+    def _read_entries(self, cached_entries):
+        entries = {}
+        path = self._db_dir
+        try:
+            for filename in sorted(os.listdir(self._db_dir)):
+                if filename.startswith('.'):
+                    continue
+                path = os.path.join(self._db_dir, filename)
+                key = file_key(os.stat(path))
+                cached_entry = cached_entries.get(filename)
+                if cached_entry is not None and cached_entry[0] == key:
+                    entries[filename] = cached_entry
+                else:
+                    logger.debug("Parsing catalog file '%s'", path)
+                    entries[filename] = (key, *_parse_file(path))
+        except OSError as e:
+            raise CatalogError(f"could not open/read file '{path}': {e}")
+        except UnicodeDecodeError as e:
+            raise CatalogError(f"could not decode file '{path}': {e}")
+        return entries
+
+
+class CatalogUpdate:
+    """The changes of the catalog files since the last update of a Catalog.
+
+    changed_sections is the set of the names of the sections added, removed
+    or modified by the update, and config is a CatalogConfig of the catalog
+    as it will be once the update is applied.
+
+    """
+
+    def __init__(
+        self, config, changes, entries, cached_entries, section_defs, defaults
+    ):
+        self.config = config
+        self.changed_sections = set(changes)
+        # dictionary of section -> new options, or None if removed
+        self._changes = changes
+        self._entries = entries
+        self._cached_entries = cached_entries
+        self._section_defs = section_defs
+        self._defaults = defaults
+
+
+class _UpdatedSections(collections.abc.Mapping):
+    # The sections of a catalog with the changes of an update, without
+    # modifying them
+
+    def __init__(self, sections, changes):
+        self._sections = sections
+        self._changes = changes
+
+    def __getitem__(self, section):
+        if section in self._changes:
+            options = self._changes[section]
+            if options is None:
+                raise KeyError(section)
+            return options
+        return self._sections[section]
+
+    def __iter__(self):
+        for section in self._sections:
+            if self._changes.get(section, True) is not None:
+                yield section
+        for section, options in self._changes.items():
+            if options is not None and section not in self._sections:
+                yield section
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def _merge_options(section_defs, defaults):
+    # Return the options of a section from its definitions, the options of a
+    # section defined once and without defaults being shared with its entry
+    if len(section_defs) == 1 and not defaults:
+        return section_defs[0][1]
+    options = dict(defaults)
+    for _, file_options in section_defs:
+        options.update(file_options)
+    return options
+
+
+def load_catalog(db_dir, snapshot_filename=SNAPSHOT_FILENAME):
+    """Return a CatalogConfig of the catalog files in db_dir.
+
+    Raise a CatalogError on error (see Catalog.update).
+
+    """
+    catalog = Catalog(db_dir, snapshot_filename)
+    catalog.update()
+    return catalog.config
@@ -1,4 +1,4 @@
-# Copyright 2010-2023 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2010-2026 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import logging
@@ -21,116 +21,150 @@ class UserCancellationError(PackageError):
     pass
 
 
+def new_progress_bar(filename, size):
+    widgets = [
+        filename,
+        ':    ',
+        progressbar.FileTransferSpeed(),
+        ' ',
+        progressbar.ETA(),
+        ' ',
+        progressbar.Bar(),
+        ' ',
+        progressbar.Percentage(),
+    ]
+    return progressbar.ProgressBar(widgets=widgets, maxval=size)
+
+
+class ConsoleUserInterface:
+    """Interact with the user of the CLI controllers through the console.
+
+    The daemon passes its own user interface to the CLI controllers, so that
+    the interaction happens in the console of the client instead.
+
+    """
+
+    def message(self, text=''):
+        print(text)
+
+    def confirm(self, question):
+        """Ask a yes/no question and return true if the answer is yes."""
+        rep = input(question)
+        return not rep or rep.lower() == 'y'
+
+    def new_progress_bar(self, filename, size):
+        return new_progress_bar(filename, size)
+
+    def download_hooks(self, remote_file):
+        """Return the list of download hooks displaying the download of
+        remote_file.
+
+        """
+        pbar = self.new_progress_bar(remote_file.filename, remote_file.size)
+        return [ProgressBarHook(pbar)]
+
+
+_CONSOLE_UI = ConsoleUserInterface()
+
+
+def _list_pkgs(ui, title, pkgs):
+    ui.message(f"{title} ({len(pkgs)}):")
+    for pkg in pkgs:
+        ui.message(f"     {pkg}")
+    ui.message()
+
+
+def _confirm_download(ui, remote_files, question):
+    total_dl_size = sum(remote_file.size for remote_file in remote_files)
+    total_size = float(total_dl_size) / 1000**2
+    ui.message(f"Total Download Size:    {total_size:.2f} MB")
+    ui.message()
+    if not ui.confirm(question):
+        raise UserCancellationError()
+
+
 class CliInstallerController(DefaultInstallerController):
+    def __init__(
+        self, installable_pkg_sto, installed_pkg_sto, *args, ui=None, **kwargs
+    ):
+        super().__init__(installable_pkg_sto, installed_pkg_sto, *args, **kwargs)
+        self._ui = _CONSOLE_UI if ui is None else ui
+
     def preprocess_raw_pkgs(self, raw_installable_pkgs):
         if not self._nodeps:
-            print("resolving dependencies...")
+            self._ui.message("resolving dependencies...")
         installable_pkgs = DefaultInstallerController.preprocess_raw_pkgs(
             self, raw_installable_pkgs
         )
-        print(f"Targets ({len(installable_pkgs)}):")
-        for pkg in installable_pkgs:
-            print("    ", pkg)
-        print()
+        _list_pkgs(self._ui, "Targets", installable_pkgs)
         return installable_pkgs
 
     def pre_download(self, remote_files):
-        total_dl_size = sum(remote_file.size for remote_file in remote_files)
-        total_size = float(total_dl_size) / 1000**2
-        print(f"Total Download Size:    {total_size:.2f} MB")
-        print()
-        rep = input("Proceed with installation? [Y/n] ")
-        if rep and rep.lower() != 'y':
-            raise UserCancellationError()
+        _confirm_download(self._ui, remote_files, "Proceed with installation? [Y/n] ")
 
     def download_file(self, remote_file):
-        widgets = [
-            remote_file.filename,
-            ':    ',
-            progressbar.FileTransferSpeed(),
-            ' ',
-            progressbar.ETA(),
-            ' ',
-            progressbar.Bar(),
-            ' ',
-            progressbar.Percentage(),
-        ]
-        pbar = progressbar.ProgressBar(widgets=widgets, maxval=remote_file.size)
-        remote_file.download([ProgressBarHook(pbar)])
+        super().download_file(remote_file, self._ui.download_hooks(remote_file))
 
     def pre_install_pkg(self, installable_pkg):
-        print(f"Installing {installable_pkg.pkg_info['id']}...")
+        self._ui.message(f"Installing {installable_pkg.pkg_info['id']}...")
 
 
 class CliUninstallerController(DefaultUninstallerController):
+    def __init__(
+        self, installable_pkg_sto, installed_pkg_sto, *args, ui=None, **kwargs
+    ):
+        super().__init__(installable_pkg_sto, installed_pkg_sto, *args, **kwargs)
+        self._ui = _CONSOLE_UI if ui is None else ui
+
     def pre_uninstall(self, installed_pkgs):
-        print(f"Remove ({len(installed_pkgs)}):")
-        for pkg in installed_pkgs:
-            print("    ", pkg)
-        print()
-        rep = input("Do you want to remove these packages? [Y/n] ")
-        if rep and rep.lower() != 'y':
+        _list_pkgs(self._ui, "Remove", installed_pkgs)
+        if not self._ui.confirm("Do you want to remove these packages? [Y/n] "):
             raise UserCancellationError()
 
     def pre_uninstall_pkg(self, installed_pkg):
-        print(f"Removing {installed_pkg.pkg_info['id']}...")
+        self._ui.message(f"Removing {installed_pkg.pkg_info['id']}...")
 
 
 class CliUpgraderController(DefaultUpgraderController):
     _nothing_to_do = False
 
+    def __init__(
+        self, installable_pkg_sto, installed_pkg_sto, *args, ui=None, **kwargs
+    ):
+        super().__init__(installable_pkg_sto, installed_pkg_sto, *args, **kwargs)
+        self._ui = _CONSOLE_UI if ui is None else ui
+
     def preprocess_upgrade_list(self, upgrade_list):
         if not self._nodeps:
-            print("resolving dependencies...")
+            self._ui.message("resolving dependencies...")
         installed_specs = DefaultUpgraderController.preprocess_upgrade_list(
             self, upgrade_list
         )
         if not installed_specs:
-            print(" there is nothing to do")
+            self._ui.message(" there is nothing to do")
             self._nothing_to_do = True
         else:
             installable_pkgs = []
             for installed_spec in installed_specs:
                 installable_pkgs.append(installed_spec[1])
                 installable_pkgs.extend(installed_spec[2])
-            print(f"Targets ({len(installable_pkgs)}):")
-            for pkg in installable_pkgs:
-                print("    ", pkg)
-            print()
+            _list_pkgs(self._ui, "Targets", installable_pkgs)
         return installed_specs
 
     def pre_download(self, remote_files):
         if self._nothing_to_do:
             return
 
-        total_dl_size = sum(remote_file.size for remote_file in remote_files)
-        dl_size_mb = float(total_dl_size) / 1000**2
-        print(f"Total Download Size:    {dl_size_mb:.2f} MB")
-        print()
-        rep = input("Proceed with upgrade? [Y/n] ")
-        if rep and rep.lower() != 'y':
-            raise UserCancellationError()
+        _confirm_download(self._ui, remote_files, "Proceed with upgrade? [Y/n] ")
 
     def download_file(self, remote_file):
-        widgets = [
-            remote_file.filename,
-            ':    ',
-            progressbar.FileTransferSpeed(),
-            ' ',
-            progressbar.ETA(),
-            ' ',
-            progressbar.Bar(),
-            ' ',
-            progressbar.Percentage(),
-        ]
-        pbar = progressbar.ProgressBar(widgets=widgets, maxval=remote_file.size)
-        remote_file.download([ProgressBarHook(pbar)])
+        super().download_file(remote_file, self._ui.download_hooks(remote_file))
 
     def pre_upgrade_uninstall_pkg(self, installed_pkg):
-        print(f"Removing {installed_pkg.pkg_info['id']}...")
+        self._ui.message(f"Removing {installed_pkg.pkg_info['id']}...")
 
     def pre_upgrade_install_pkg(self, installable_pkg):
-        print(f"Installing {installable_pkg.pkg_info['id']}...")
+        self._ui.message(f"Installing {installable_pkg.pkg_info['id']}...")
 
     def pre_upgrade_pkg(self, installed_pkg):
-        print(f"Upgrading {installed_pkg.pkg_info['id']}...")
+        self._ui.message(f"Upgrading {installed_pkg.pkg_info['id']}...")
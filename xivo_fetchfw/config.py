@@ -1,9 +1,10 @@
-# Copyright 2010-2023 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2010-2026 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import os
 from configparser import RawConfigParser
 
-from xivo_fetchfw.params import ConfigSpec
+from xivo_fetchfw.params import ConfigSpec, bool_
 
 
 def _new_config_spec():
@@ -14,6 +15,35 @@ def _new_config_spec():
     cfg_spec.add_param('general.db_dir', default='/var/lib/xivo-fetchfw')
     cfg_spec.add_param('general.cache_dir', default='/var/cache/xivo-fetchfw')
 
+    cfg_spec.add_param('general.download_timeout', default=15.0, fun=float)
+    cfg_spec.add_param('general.file_timeout', default=0.0, fun=float)
+    cfg_spec.add_param('general.operation_timeout', default=0.0, fun=float)
+    cfg_spec.add_param('general.low_speed_limit', default=0, fun=int)
+    cfg_spec.add_param('general.low_speed_time', default=30.0, fun=float)
+    cfg_spec.add_param('general.download_retries', default=0, fun=int)
+    cfg_spec.add_param('general.pipelined_downloads', default=False, fun=bool_)
+    cfg_spec.add_param('general.download_windows', default='')
+
+    @cfg_spec.add_param_decorator('general.install_workers', default=1)
+    def _install_workers_fun(raw_value):
+        value = int(raw_value)
+        if value < 0:
+            raise ValueError(f'invalid number of install workers "{raw_value}"')
+        return value or os.cpu_count() or 1
+
+    @cfg_spec.add_param_decorator('general.installed_db_backend', default='json')
+    def _installed_db_backend_fun(raw_value):
+        if raw_value not in ('json', 'sqlite'):
+            raise ValueError(f'invalid installed db backend "{raw_value}"')
+        return raw_value
+
+    @cfg_spec.add_param_decorator('general.catalog_repositories', default=[])
+    def _catalog_repositories_fun(raw_value):
+        return raw_value.split()
+
+    cfg_spec.add_param('general.catalog_keyring', default='')
+    cfg_spec.add_param('general.daemon_socket', default='/run/xivo-fetchfwd.sock')
+
     @cfg_spec.add_param_decorator('general.auth_sections', default=[])
     def _auth_sections_fun(raw_value):
         return raw_value.split()
@@ -0,0 +1,467 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Daemon keeping the package storages loaded between operations.
+
+Loading the catalog and the installed packages database is most of the
+time taken by a short operation, so the daemon loads them once and only
+reloads what changed before each request. The CLI sends its requests to the
+daemon when it's running and falls back to doing the work itself otherwise.
+
+The protocol is newline-delimited JSON over a Unix stream socket. The client
+sends one request per connection:
+
+    {"method": "install", "params": {...}, "config": "...", "debug": false}
+
+where config is the configuration file used by the client, which must be
+the one of the daemon, and debug asks for the debug messages logged while
+executing the request. The daemon answers with zero or more events, then a
+final reply:
+
+    {"event": "message", "text": "..."}
+    {"event": "log", "text": "..."}
+    {"event": "confirm", "question": "..."}, answered by {"answer": true}
+    {"event": "download_start", "filename": "...", "size": 42}
+    {"event": "download_progress", "downloaded": 21}
+    {"event": "download_complete"}
+    {"result": ...} or {"error": {"message": "...", "cancelled": false}}
+
+Requests are executed one at a time, while holding the lock of the database
+directory, which mutations done without the daemon also take.
+
+"""
+
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+
+from xivo_fetchfw import cli, search
+from xivo_fetchfw.download import DownloadHook
+from xivo_fetchfw.schedule import DownloadWindows
+from xivo_fetchfw.util import FetchfwError
+
+logger = logging.getLogger(__name__)
+
+
+class DaemonError(FetchfwError):
+    pass
+
+
+LOCK_FILENAME = '.lock'
+_PROGRESS_INTERVAL = 0.25
+_LOG_FORMAT = '%(message)s'
+
+
+@contextlib.contextmanager
+def db_lock(db_dir):
+    """Hold an exclusive lock on db_dir for the duration of the block."""
+    with open(os.path.join(db_dir, LOCK_FILENAME), 'a') as fobj:
+        fcntl.flock(fobj, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fobj, fcntl.LOCK_UN)
+
+
+class _Connection:
+    def __init__(self, rfile, wfile, sock=None):
+        self._rfile = rfile
+        self._wfile = wfile
+        self._sock = sock
+        self._send_lock = threading.Lock()
+
+    def send(self, message):
+        # events may be sent by the download and installation threads
+        with self._send_lock:
+            self._wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+            self._wfile.flush()
+
+    def receive(self, timeout=None):
+        # On timeout, a socket.timeout is raised and the connection can't be
+        # read anymore
+        if timeout is not None:
+            self._sock.settimeout(timeout)
+        try:
+            line = self._rfile.readline()
+        finally:
+            if timeout is not None:
+                self._sock.settimeout(None)
+        if not line:
+            raise DaemonError('connection closed by peer')
+        try:
+            return json.loads(line)
+        except ValueError as e:
+            raise DaemonError(f'invalid message: {e}')
+
+
+class _EventDownloadHook(DownloadHook):
+    def __init__(self, ui, remote_file):
+        super().__init__()
+        self._ui = ui
+        self._filename = remote_file.filename
+        self._size = remote_file.size
+        self._downloaded = 0
+        self._last_sent = 0.0
+
+    def start(self):
+        self._ui.send_event('download_start', filename=self._filename, size=self._size)
+
+    def update(self, data):
+        self._downloaded += len(data)
+        now = time.monotonic()
+        if now - self._last_sent >= _PROGRESS_INTERVAL:
+            self._last_sent = now
+            self._ui.send_event('download_progress', downloaded=self._downloaded)
+
+    def complete(self):
+        self._ui.send_event('download_complete')
+
+
+class _RemoteUserInterface(cli.ConsoleUserInterface):
+    """Interact with the user through the events sent to the client.
+
+    Once the client is gone, events are dropped and questions are answered
+    no, so that an operation is never interrupted halfway by the client. A
+    question not answered in confirm_timeout seconds is also answered no,
+    since the locks are held while waiting for the answer.
+
+    """
+
+    def __init__(self, connection, confirm_timeout=None):
+        self._connection = connection
+        self._confirm_timeout = confirm_timeout
+        self._connected = True
+
+    def send_event(self, event, **kwargs):
+        if not self._connected:
+            return
+        kwargs['event'] = event
+        try:
+            self._connection.send(kwargs)
+        except OSError as e:
+            # the debug logs may be forwarded to the client, so it is marked
+            # as disconnected before logging
+            self._connected = False
+            logger.info('Client disconnected: %s', e)
+
+    def message(self, text=''):
+        self.send_event('message', text=text)
+
+    def confirm(self, question):
+        self.send_event('confirm', question=question)
+        if not self._connected:
+            return False
+        try:
+            answer = self._connection.receive(self._confirm_timeout)
+        except socket.timeout:
+            self._connected = False
+            logger.info('Client did not answer in time, answering no')
+            return False
+        except (OSError, DaemonError) as e:
+            self._connected = False
+            logger.info('Client disconnected: %s', e)
+            return False
+        return answer.get('answer') is True
+
+    def download_hooks(self, remote_file):
+        return [_EventDownloadHook(self, remote_file)]
+
+
+class _LogForwardingHandler(logging.Handler):
+    # Forward the records logged by the thread creating the handler, i.e. the
+    # one executing the request, and not those of the other requests
+
+    def __init__(self, ui):
+        super().__init__()
+        self._ui = ui
+        self._thread_id = threading.get_ident()
+        self.setFormatter(logging.Formatter(_LOG_FORMAT))
+
+    def filter(self, record):
+        return record.thread == self._thread_id and super().filter(record)
+
+    def emit(self, record):
+        try:
+            self._ui.send_event('log', text=self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+@contextlib.contextmanager
+def _forward_debug_logs(ui):
+    root_logger = logging.getLogger()
+    old_level = root_logger.level
+    handler = _LogForwardingHandler(ui)
+    root_logger.addHandler(handler)
+    root_logger.setLevel(logging.DEBUG)
+    try:
+        yield
+    finally:
+        root_logger.setLevel(old_level)
+        root_logger.removeHandler(handler)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        connection = _Connection(self.rfile, self.wfile, self.request)
+        try:
+            request = connection.receive()
+            method = request['method']
+            params = request.get('params', {})
+            config_filename = request.get('config')
+            debug = request.get('debug', False)
+        except (DaemonError, KeyError, TypeError, AttributeError) as e:
+            logger.warning('Invalid request: %s', e)
+            return
+        try:
+            result = self.server.execute(
+                method, params, connection, config_filename, debug
+            )
+            reply = {'result': result}
+        except cli.UserCancellationError:
+            reply = {'error': {'message': 'cancelled', 'cancelled': True}}
+        except FetchfwError as e:
+            reply = {'error': {'message': str(e), 'cancelled': False}}
+        except Exception as e:
+            logger.error('Error while executing %s: %s', method, e, exc_info=True)
+            reply = {'error': {'message': f'unexpected error: {e}', 'cancelled': False}}
+        try:
+            connection.send(reply)
+        except OSError as e:
+            logger.info('Could not send reply to client: %s', e)
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve the requests of the clients on a Unix socket.
+
+    The socket is only accessible to the user running the daemon.
+
+    deadline is the download.Deadline shared by the downloaders of pkg_mgr,
+    if any. It is restarted before each request.
+
+    config_filename is the configuration file config_dict has been read
+    from. If given, requests from clients using another configuration file
+    are refused.
+
+    """
+
+    daemon_threads = True
+    # seconds to wait for the client to answer a question
+    confirm_timeout = 300.0
+
+    def __init__(
+        self, socket_path, pkg_mgr, config_dict, deadline=None, config_filename=None
+    ):
+        self._pkg_mgr = pkg_mgr
+        self._config_dict = config_dict
+        self._deadline = deadline
+        self._config_filename = config_filename
+        self._lock = threading.Lock()
+        self._methods = {
+            'status': self._status,
+            'search': self._search,
+            'install': self._install,
+            'uninstall': self._uninstall,
+            'upgrade': self._upgrade,
+        }
+        if _is_socket(socket_path) and not is_running(socket_path):
+            logger.info("Removing stale socket '%s'", socket_path)
+            os.remove(socket_path)
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.server_address)
+        except OSError:
+            pass
+
+    def execute(self, method, params, connection, config_filename=None, debug=False):
+        try:
+            method_fun = self._methods[method]
+        except KeyError:
+            raise DaemonError(f"unknown method '{method}'")
+        self._check_config_filename(config_filename)
+        logger.debug('Executing %s %s', method, params)
+        ui = _RemoteUserInterface(connection, self.confirm_timeout)
+        with self._lock, db_lock(self._config_dict['general.db_dir']):
+            with _forward_debug_logs(ui) if debug else contextlib.nullcontext():
+                self._pkg_mgr.installable_pkg_sto.reload()
+                self._pkg_mgr.installed_pkg_sto.reload()
+                if self._deadline is not None:
+                    self._deadline.reset()
+                return method_fun(params, ui)
+
+    def _check_config_filename(self, config_filename):
+        if config_filename is None or self._config_filename is None:
+            return
+        if os.path.realpath(config_filename) != os.path.realpath(self._config_filename):
+            raise DaemonError(
+                f"the daemon uses the configuration file '{self._config_filename}',"
+                f" not '{config_filename}' -- use --no-daemon"
+            )
+
+    def _download_windows(self, params):
+        if not params.get('scheduled'):
+            return None
+        raw_windows = self._config_dict['general.download_windows']
+        if not raw_windows:
+            raise DaemonError('no download windows configured')
+        return DownloadWindows(raw_windows)
+
+    def _root_dir(self, params):
+        root_dir = params.get('root') or self._config_dict['general.root_dir']
+        if not os.path.isabs(root_dir):
+            raise DaemonError(f'root directory is not absolute: {root_dir}')
+        return root_dir
+
+    def _status(self, params, ui):
+        return {
+            'pid': os.getpid(),
+            'installable': len(self._pkg_mgr.installable_pkg_sto),
+            'installed': len(self._pkg_mgr.installed_pkg_sto),
+        }
+
+    def _search(self, params, ui):
+        results = search.search_pkgs(
+            self._pkg_mgr.installable_pkg_sto.get_search_index(),
+            self._pkg_mgr.installed_pkg_sto,
+            params.get('query', ''),
+            params.get('installed', False),
+            params.get('upgradable', False),
+        )
+        return [
+            {
+                'id': result.pkg_id,
+                'version': result.version,
+                'description': result.description,
+                'score': result.score,
+                'installed_version': installed_version,
+            }
+            for result, installed_version in results
+        ]
+
+    def _install(self, params, ui):
+        pkg_ids = params['packages']
+        for installed_pkg in self._pkg_mgr.get_reinstalled_pkgs(pkg_ids):
+            ui.message(f"warning: {installed_pkg} is up to date -- reinstalling")
+        ctrl_factory = cli.CliInstallerController.new_factory(
+            download_windows=self._download_windows(params), ui=ui
+        )
+        self._pkg_mgr.install(pkg_ids, self._root_dir(params), ctrl_factory)
+
+    def _uninstall(self, params, ui):
+        ctrl_factory = cli.CliUninstallerController.new_factory(recursive=True, ui=ui)
+        self._pkg_mgr.uninstall(
+            params['packages'], self._root_dir(params), ctrl_factory
+        )
+
+    def _upgrade(self, params, ui):
+        ctrl_factory = cli.CliUpgraderController.new_factory(
+            download_windows=self._download_windows(params), ui=ui
+        )
+        self._pkg_mgr.upgrade(self._root_dir(params), ctrl_factory)
+
+
+def _is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+def _connect(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+
+def is_running(socket_path):
+    """Return true if a daemon is listening on socket_path."""
+    try:
+        _connect(socket_path).close()
+    except OSError:
+        return False
+    return True
+
+
+class DaemonClient:
+    """Send requests to the daemon listening on socket_path.
+
+    config_filename is the configuration file used by the client and debug
+    is true if the debug messages of the daemon are to be logged by the
+    client.
+
+    """
+
+    def __init__(self, socket_path, config_filename=None, debug=False):
+        self._socket_path = socket_path
+        self._config_filename = config_filename
+        self._debug = debug
+
+    def call(self, method, params=None, ui=None):
+        """Execute method on the daemon and return its result.
+
+        The events sent by the daemon are handled by ui, a
+        cli.ConsoleUserInterface object.
+
+        Raise a cli.UserCancellationError if the user cancelled the
+        operation and a DaemonError on other errors.
+
+        """
+        if ui is None:
+            ui = cli.ConsoleUserInterface()
+        try:
+            sock = _connect(self._socket_path)
+        except OSError as e:
+            raise DaemonError(f"could not connect to '{self._socket_path}': {e}")
+        with sock, sock.makefile('rb') as rfile, sock.makefile('wb') as wfile:
+            connection = _Connection(rfile, wfile)
+            request = {'method': method, 'params': params or {}, 'debug': self._debug}
+            if self._config_filename is not None:
+                request['config'] = os.path.abspath(self._config_filename)
+            connection.send(request)
+            return self._wait_reply(connection, ui)
+
+    def _wait_reply(self, connection, ui):
+        pbar = None
+        while True:
+            message = connection.receive()
+            if 'result' in message:
+                return message['result']
+            if 'error' in message:
+                if message['error'].get('cancelled'):
+                    raise cli.UserCancellationError()
+                raise DaemonError(message['error']['message'])
+            event = message.get('event')
+            if event == 'message':
+                ui.message(message['text'])
+            elif event == 'log':
+                logger.debug('%s', message['text'])
+            elif event == 'confirm':
+                connection.send({'answer': ui.confirm(message['question'])})
+            elif event == 'download_start':
+                pbar = ui.new_progress_bar(message['filename'], message['size'])
+                pbar.start()
+            elif event == 'download_progress' and pbar is not None:
+                pbar.update(message['downloaded'])
+            elif event == 'download_complete' and pbar is not None:
+                pbar.finish()
+                pbar = None
+            else:
+                logger.debug('Ignoring unknown event %s', message)
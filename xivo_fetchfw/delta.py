@@ -0,0 +1,113 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Pure python decoder for binary delta patches.
+
+The supported patch format is the one produced by the "bsdiff" tool (the
+"BSDIFF40" format), which is simple to decode and produce small patches
+for successive versions of the same firmware image.
+
+"""
+
+import bz2
+import logging
+
+from xivo_fetchfw.util import FetchfwError
+
+logger = logging.getLogger(__name__)
+
+
+class DeltaError(FetchfwError):
+    pass
+
+
+_BSDIFF_MAGIC = b'BSDIFF40'
+_BSDIFF_HEADER_SIZE = 32
+
+
+def _offtin(buf, pos):
+    # Decode a bsdiff 64 bits sign-magnitude little-endian integer
+    value = int.from_bytes(buf[pos : pos + 8], 'little')
+    if value & (1 << 63):
+        return -(value & ((1 << 63) - 1))
+    return value
+
+
+def _add_bytes(data1, data2):
+    # Return the bytewise addition modulo 256 of data1 and data2, which must
+    # be of the same length. This is done on big integers instead of byte
+    # per byte since it's a lot faster in python.
+    length = len(data1)
+    if not length:
+        return b''
+    high_mask = int.from_bytes(b'\x80' * length, 'little')
+    low_mask = int.from_bytes(b'\x7f' * length, 'little')
+    int1 = int.from_bytes(data1, 'little')
+    int2 = int.from_bytes(data2, 'little')
+    result = ((int1 & low_mask) + (int2 & low_mask)) ^ ((int1 ^ int2) & high_mask)
+    return result.to_bytes(length, 'little')
+
+
+def _old_segment(old_data, start, length):
+    # Return length bytes of old_data starting at start, with bytes outside
+    # of old_data replaced by null bytes (bsdiff semantic)
+    end = start + length
+    old_size = len(old_data)
+    if start >= 0 and end <= old_size:
+        return old_data[start:end]
+    prefix = b'\x00' * min(max(-start, 0), length)
+    middle = old_data[max(start, 0) : max(min(end, old_size), 0)]
+    suffix = b'\x00' * (length - len(prefix) - len(middle))
+    return prefix + middle + suffix
+
+
+def apply_patch(old_data, patch_data):
+    """Return the new data obtained by applying the bsdiff patch patch_data
+    over old_data.
+
+    Raise a DeltaError if the patch is invalid or corrupted.
+
+    """
+    if len(patch_data) < _BSDIFF_HEADER_SIZE or patch_data[:8] != _BSDIFF_MAGIC:
+        raise DeltaError('invalid bsdiff patch header')
+    ctrl_len = _offtin(patch_data, 8)
+    diff_len = _offtin(patch_data, 16)
+    new_size = _offtin(patch_data, 24)
+    if ctrl_len < 0 or diff_len < 0 or new_size < 0:
+        raise DeltaError('invalid bsdiff patch header')
+
+    ctrl_start = _BSDIFF_HEADER_SIZE
+    diff_start = ctrl_start + ctrl_len
+    extra_start = diff_start + diff_len
+    try:
+        ctrl_block = bz2.decompress(patch_data[ctrl_start:diff_start])
+        diff_block = bz2.decompress(patch_data[diff_start:extra_start])
+        extra_block = bz2.decompress(patch_data[extra_start:])
+    except (OSError, ValueError) as e:
+        raise DeltaError(f'invalid bsdiff patch block: {e}')
+
+    new_data = bytearray()
+    old_pos = diff_pos = extra_pos = ctrl_pos = 0
+    while len(new_data) < new_size:
+        if ctrl_pos + 24 > len(ctrl_block):
+            raise DeltaError('truncated bsdiff control block')
+        add_len = _offtin(ctrl_block, ctrl_pos)
+        copy_len = _offtin(ctrl_block, ctrl_pos + 8)
+        seek_len = _offtin(ctrl_block, ctrl_pos + 16)
+        ctrl_pos += 24
+        if add_len < 0 or copy_len < 0:
+            raise DeltaError('corrupted bsdiff control block')
+        if len(new_data) + add_len + copy_len > new_size:
+            raise DeltaError('corrupted bsdiff control block')
+        if diff_pos + add_len > len(diff_block):
+            raise DeltaError('truncated bsdiff diff block')
+        if extra_pos + copy_len > len(extra_block):
+            raise DeltaError('truncated bsdiff extra block')
+
+        diff_segment = diff_block[diff_pos : diff_pos + add_len]
+        new_data += _add_bytes(diff_segment, _old_segment(old_data, old_pos, add_len))
+        diff_pos += add_len
+        new_data += extra_block[extra_pos : extra_pos + copy_len]
+        extra_pos += copy_len
+        old_pos += add_len + seek_len
+    return bytes(new_data)
@@ -1,10 +1,15 @@
-# Copyright 2010-2023 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2010-2026 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import contextlib
+import functools
 import hashlib
+import io
 import logging
 import os
+import queue
+import threading
+import time
 from binascii import b2a_hex
 from urllib import request
 from urllib.error import HTTPError, URLError
@@ -15,6 +20,7 @@ from urllib.request import (
     ProxyHandler,
 )
 
+from xivo_fetchfw.delta import DeltaError, apply_patch
 from xivo_fetchfw.util import FetchfwError
 
 logger = logging.getLogger(__name__)
@@ -36,21 +42,167 @@ class AbortedDownloadError(DownloadError):
     pass
 
 
+class DownloadPausedError(DownloadError):
+    """Raised to pause a download. The partially downloaded file is kept
+    so that the download can be resumed later.
+
+    """
+
+    pass
+
+
+class StalledDownloadError(DownloadError):
+    """Raised when a download is too slow or takes too much time."""
+
+    pass
+
+
+class DeadlineExceededError(DownloadError):
+    """Raised when the deadline of a whole operation has been exceeded."""
+
+    pass
+
+
+class NotModifiedError(DownloadError):
+    """Raised when the server answers a conditional request with a
+    "304 Not Modified" response.
+
+    """
+
+    pass
+
+
+class Deadline:
+    """A deadline shared by every downloads of an operation.
+
+    The deadline starts the first time it is used, so that time spent
+    before the first download (for example waiting for the user to confirm
+    the operation) is not taken into account.
+
+    """
+
+    def __init__(self, timeout):
+        self._timeout = timeout
+        self._end = None
+
+    def reset(self):
+        """Restart the deadline, for a new operation."""
+        self._end = None
+
+    def remaining(self):
+        """Return the number of seconds before the deadline."""
+        if self._end is None:
+            self._end = time.monotonic() + self._timeout
+        return self._end - time.monotonic()
+
+    def check(self):
+        """Raise a DeadlineExceededError if the deadline has been exceeded."""
+        if self.remaining() <= 0:
+            raise DeadlineExceededError(
+                f'operation deadline of {self._timeout}s exceeded'
+            )
+
+
+class _MonitoredFile:
+    # Wrap a downloaded file-like object to enforce deadlines and detect
+    # stalled transfers, like the curl "speed-limit" and "speed-time" options
+
+    def __init__(self, fobj, file_timeout, low_speed_limit, low_speed_time, deadline):
+        self._fobj = fobj
+        self.headers = getattr(fobj, 'headers', None)
+        now = time.monotonic()
+        self._file_end = now + file_timeout if file_timeout else None
+        self._low_speed_limit = low_speed_limit
+        self._low_speed_time = low_speed_time
+        self._deadline = deadline
+        self._window_start = now
+        self._window_size = 0
+
+    def read(self, size):
+        self._check_deadlines()
+        try:
+            data = self._fobj.read(size)
+        except TimeoutError:
+            raise StalledDownloadError('no data received before socket timeout')
+        self._check_deadlines()
+        if self._low_speed_limit:
+            self._check_speed(len(data))
+        return data
+
+    def _check_deadlines(self):
+        if self._deadline is not None:
+            self._deadline.check()
+        if self._file_end is not None and time.monotonic() > self._file_end:
+            raise StalledDownloadError('file deadline exceeded')
+
+    def _check_speed(self, data_size):
+        self._window_size += data_size
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed >= self._low_speed_time:
+            speed = self._window_size / elapsed
+            if speed < self._low_speed_limit:
+                raise StalledDownloadError(
+                    f'transfer speed below {self._low_speed_limit} bytes/s '
+                    f'for {self._low_speed_time} seconds'
+                )
+            self._window_start = now
+            self._window_size = 0
+
+    def close(self):
+        self._fobj.close()
+
+
 class DefaultDownloader:
     _TIMEOUT = 15.0
 
-    def __init__(self, handlers=None):
+    def __init__(
+        self,
+        handlers=None,
+        timeout=_TIMEOUT,
+        file_timeout=0,
+        low_speed_limit=0,
+        low_speed_time=0,
+        deadline=None,
+    ):
+        """
+        handlers -- a list of urllib handlers, or None
+        timeout -- the timeout of each socket operation, in seconds
+        file_timeout -- the maximum number of seconds each download can
+          take, or 0 for no limit
+        low_speed_limit -- the minimum average speed, in bytes per second,
+          a download must have over low_speed_time seconds, or 0 to disable
+          stalled downloads detection
+        low_speed_time -- see low_speed_limit
+        deadline -- a Deadline object for all the downloads, or None
+
+        """
         if handlers is None:
             self._opener = request.build_opener()
         else:
             self._opener = request.build_opener(*handlers)
         self._opener.addheaders = [('User-agent', 'xivo-fetchfw/1.0')]
+        self._timeout = timeout
+        self._file_timeout = file_timeout
+        self._low_speed_limit = low_speed_limit
+        self._low_speed_time = low_speed_time
+        self._deadline = deadline
 
-    def download(self, url, timeout=_TIMEOUT):
-        """Open the URL url and return a file-like object."""
+    def download(self, url, timeout=None, offset=0):
+        """Open the URL url and return a file-like object.
+
+        If offset is not 0, the returned file-like object starts at this
+        offset, using an HTTP range request if the server supports them.
+
+        """
+        timeout = self._socket_timeout(timeout)
+        if offset:
+            url = self._new_range_request(url, offset)
         try:
-            return self._do_download(url, timeout)
+            fobj = self._do_download(url, timeout)
         except HTTPError as e:
+            if e.code == 304:
+                raise NotModifiedError(f"'{self._get_url(url)}' is not modified")
             logger.warning(
                 "HTTPError while downloading '%s': %s", self._get_url(url), e
             )
@@ -62,7 +214,59 @@ class DefaultDownloader:
                 raise DownloadError(e)
         except URLError as e:
             logger.warning("URLError while downloading '%s': %s", self._get_url(url), e)
+            if isinstance(e.reason, TimeoutError):
+                raise StalledDownloadError(e)
             raise DownloadError(e)
+        except TimeoutError as e:
+            logger.warning("Timeout while downloading '%s': %s", self._get_url(url), e)
+            raise StalledDownloadError(e)
+        if offset:
+            self._skip_to_offset(fobj, offset)
+        if self._file_timeout or self._low_speed_limit or self._deadline is not None:
+            return _MonitoredFile(
+                fobj,
+                self._file_timeout,
+                self._low_speed_limit,
+                self._low_speed_time,
+                self._deadline,
+            )
+        return fobj
+
+    def _new_range_request(self, url, offset):
+        if isinstance(url, request.Request):
+            range_request = request.Request(
+                url.full_url, url.data, dict(url.header_items())
+            )
+        else:
+            range_request = request.Request(url)
+        range_request.add_header('Range', f'bytes={offset}-')
+        return range_request
+
+    def _skip_to_offset(self, fobj, offset):
+        # The server might not support range requests, in which case the
+        # beginning of the file must be skipped
+        if getattr(fobj, 'status', None) == 206:
+            return
+        logger.debug('Range request not supported, skipping %s bytes', offset)
+        while offset:
+            data = fobj.read(min(offset, 65536))
+            if not data:
+                raise DownloadError('file is smaller than the resume offset')
+            offset -= len(data)
+
+    def _socket_timeout(self, timeout):
+        # Return the socket timeout to use so that a socket operation never
+        # blocks longer than what the deadlines and speed limit allow
+        if timeout is None:
+            timeout = self._timeout
+        if self._file_timeout:
+            timeout = min(timeout, self._file_timeout)
+        if self._low_speed_limit and self._low_speed_time:
+            timeout = min(timeout, self._low_speed_time)
+        if self._deadline is not None:
+            self._deadline.check()
+            timeout = min(timeout, self._deadline.remaining())
+        return timeout
 
     def _get_url(self, url):
         # Return the URL from either a urllib2.Request or string instance
@@ -82,8 +286,8 @@ class DefaultDownloader:
 
 
 class AuthenticatingDownloader(DefaultDownloader):
-    def __init__(self, handlers=None):
-        super().__init__(handlers)
+    def __init__(self, handlers=None, **kwargs):
+        super().__init__(handlers, **kwargs)
         self._pwd_manager = HTTPPasswordMgrWithDefaultRealm()
         self._opener.add_handler(HTTPBasicAuthHandler(self._pwd_manager))
         self._opener.add_handler(HTTPDigestAuthHandler(self._pwd_manager))
@@ -103,45 +307,169 @@ class _OpenerWithTimeout:
         return self._opener.open(url, data, self._timeout)
 
 
+class _HookStage(threading.Thread):
+    # A thread calling the update method of a hook for every data put in its
+    # bounded queue, in order. None must be put to stop the thread.
+
+    def __init__(self, hook, maxsize):
+        super().__init__(daemon=True)
+        self._hook = hook
+        self._queue = queue.Queue(maxsize)
+        self.error = None
+
+    def run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            # after an error, keep consuming the queue so the reader never blocks
+            if self.error is None:
+                try:
+                    self._hook.update(data)
+                except Exception as e:
+                    self.error = e
+
+    def put(self, data):
+        self._queue.put(data)
+
+
+class _ResumedFile:
+    # File-like object reading the content of a partial file, then the rest
+    # of the file from the downloader
+
+    def __init__(self, partial_path, downloader, url):
+        self._partial_fobj = open(partial_path, 'rb')
+        self._offset = os.fstat(self._partial_fobj.fileno()).st_size
+        self._downloader = downloader
+        self._url = url
+        self._fobj = None
+
+    def read(self, size):
+        if self._partial_fobj is not None:
+            data = self._partial_fobj.read(size)
+            if data:
+                return data
+            self._partial_fobj.close()
+            self._partial_fobj = None
+            logger.debug('Resuming download of %s at %s', self._url, self._offset)
+            self._fobj = self._downloader.download(self._url, offset=self._offset)
+        return self._fobj.read(size)
+
+    def close(self):
+        if self._partial_fobj is not None:
+            self._partial_fobj.close()
+        if self._fobj is not None:
+            self._fobj.close()
+
+
 class BaseRemoteFile:
     """A remote file that can be downloaded."""
 
-    _BLOCK_SIZE = 4096
+    __slots__ = (
+        '_url',
+        '_downloader',
+        '_hook_factories',
+        '_mirror_urls',
+        '_retries',
+        '_pipelined',
+    )
 
-    def __init__(self, url, downloader, hook_factories=None):
+    _BLOCK_SIZE = 4096
+    _PIPELINED_BLOCK_SIZE = 65536
+    _PIPELINED_QUEUE_SIZE = 16
+
+    def __init__(
+        self,
+        url,
+        downloader,
+        hook_factories=None,
+        mirror_urls=(),
+        retries=0,
+        pipelined=False,
+    ):
         """
         url -- the URL/object to pass to the downloader
         downloader -- the file downloader
         hook_factories -- a list of callable objects that return download hook
+        mirror_urls -- a list of URL/object to try, in order, if the download
+          from url fails
+        retries -- the number of times the download from each URL is retried
+          before trying the next one
+        pipelined -- if true, each hook is updated from its own thread so
+          that reading from the network, hashing and writing to disk overlap
 
         """
         self._url = url
         self._downloader = downloader
         if hook_factories is None:
-            self._hook_factories = []
+            self._hook_factories = ()
         else:
-            self._hook_factories = list(hook_factories)
+            self._hook_factories = tuple(hook_factories)
+        self._mirror_urls = tuple(mirror_urls)
+        self._retries = retries
+        self._pipelined = pipelined
 
-    def download(self, supp_hooks=[]):
+    def download(self, supp_hooks=[], partial_path=None):
         """Download the file and run it through the hooks.
 
         Download hooks are stopped in the reverse order they are started.
 
+        If the download fails, it's retried and then the mirrors are tried,
+        in which case the hooks are started again for each attempt. Aborted,
+        paused downloads and exceeded operation deadlines are never retried.
+
+        If partial_path is not None, it's the path of the beginning of the
+        file, from a previous download that has been paused. Its content is
+        run through the hooks, then only the rest of the file is downloaded.
+
+        """
+        attempts = [
+            url
+            for url in (self._url,) + self._mirror_urls
+            for _ in range(self._retries + 1)
+        ]
+        for attempt_idx, url in enumerate(attempts, 1):
+            logger.debug('Downloading %s', url)
+            if partial_path is None:
+                open_fun = functools.partial(self._downloader.download, url)
+            else:
+                open_fun = functools.partial(
+                    _ResumedFile, partial_path, self._downloader, url
+                )
+            try:
+                self._process(open_fun, supp_hooks)
+            except (AbortedDownloadError, DeadlineExceededError, DownloadPausedError):
+                raise
+            except DownloadError as e:
+                if attempt_idx == len(attempts):
+                    raise
+                logger.warning("Error while downloading '%s', retrying: %s", url, e)
+            else:
+                return
+
+    def process_local(self, fobj, supp_hooks=[]):
+        """Run the content of the file-like object fobj through the hooks,
+        like if it was the content of the downloaded file.
+
+        This is useful when the content of the file has been obtained by
+        other means, for example by applying a delta patch.
+
         """
-        logger.debug('Downloading %s', self._url)
+        logger.debug('Processing local content for %s', self._url)
+        self._process(lambda: fobj, supp_hooks)
+
+    def _process(self, open_fun, supp_hooks):
         hooks = supp_hooks + [factory() for factory in self._hook_factories]
         last_started_idx = 0
         try:
             while last_started_idx < len(hooks):
                 hooks[last_started_idx].start()
                 last_started_idx += 1
-            with contextlib.closing(self._downloader.download(self._url)) as dlfile:
-                while True:
-                    data = dlfile.read(self._BLOCK_SIZE)
-                    if not data:
-                        break
-                    for hook in hooks:
-                        hook.update(data)
+            with contextlib.closing(open_fun()) as dlfile:
+                if self._pipelined:
+                    self._transfer_pipelined(dlfile, hooks)
+                else:
+                    self._transfer(dlfile, hooks)
             for hook in reversed(hooks):
                 hook.complete()
         except Exception as e:
@@ -168,6 +496,87 @@ class BaseRemoteFile:
                 except Exception:
                     logger.error('hook.stop raised an exception', exc_info=True)
 
+    def _transfer(self, dlfile, hooks):
+        while True:
+            data = dlfile.read(self._BLOCK_SIZE)
+            if not data:
+                break
+            for hook in hooks:
+                hook.update(data)
+
+    def _transfer_pipelined(self, dlfile, hooks):
+        # Each hook still sees every block in order, but the network read of
+        # the next block is done while the hooks are processing the previous
+        # ones. hashlib and file writes release the GIL on large buffers.
+        stages = [_HookStage(hook, self._PIPELINED_QUEUE_SIZE) for hook in hooks]
+        for stage in stages:
+            stage.start()
+        try:
+            while True:
+                for stage in stages:
+                    if stage.error is not None:
+                        raise stage.error
+                data = dlfile.read(self._PIPELINED_BLOCK_SIZE)
+                if not data:
+                    break
+                for stage in stages:
+                    stage.put(data)
+        finally:
+            for stage in stages:
+                stage.put(None)
+            for stage in stages:
+                stage.join()
+        for stage in stages:
+            if stage.error is not None:
+                raise stage.error
+
+
+class DeltaPatch:
+    """A binary patch that can rebuild a remote file from a previous version
+    of this file found on the filesystem.
+
+    """
+
+    __slots__ = ('base_path', 'base_sha1sum', '_base_remote_file')
+
+    def __init__(self, base_path, base_sha1sum, base_remote_file):
+        """
+        base_path -- the path of the previous version of the file
+        base_sha1sum -- the raw sha1 sum of the previous version of the file
+        base_remote_file -- the BaseRemoteFile of the patch
+
+        """
+        self.base_path = base_path
+        self.base_sha1sum = base_sha1sum
+        self._base_remote_file = base_remote_file
+
+    def is_applicable(self):
+        """Return True if the previous version of the file exists on the
+        filesystem and has the expected sha1 sum.
+
+        """
+        if not os.path.isfile(self.base_path):
+            return False
+        hash = hashlib.sha1()
+        with open(self.base_path, 'rb') as fobj:
+            for data in iter(lambda: fobj.read(BaseRemoteFile._BLOCK_SIZE * 16), b''):
+                hash.update(data)
+        return hash.digest() == self.base_sha1sum
+
+    def rebuild(self):
+        """Download the patch and return the content of the new file."""
+        patch_hook = _BufferHook()
+        self._base_remote_file.download([patch_hook])
+        with open(self.base_path, 'rb') as fobj:
+            base_data = fobj.read()
+        return apply_patch(base_data, patch_hook.getvalue())
+
+    @classmethod
+    def new_delta_patch(cls, base_path, base_sha1sum, url, sha1sum, downloader):
+        hook_factories = [SHA1Hook.create_factory(sha1sum)]
+        base_remote_file = BaseRemoteFile(url, downloader, hook_factories)
+        return cls(base_path, base_sha1sum, base_remote_file)
+
 
 class RemoteFile:
     """A BaseRemoteFile with a few extra attributes:
@@ -176,10 +585,13 @@ class RemoteFile:
     filename -- the filename of the file that will be written to the filesystem
     path -- the complete path of the file that will be written to the filesystem
     exists -- a method that returns true if the remote file exists on the filesystem
+    deltas -- a list of delta patches that can be used to rebuild the file
 
     """
 
-    def __init__(self, path, size, base_remote_file):
+    __slots__ = ('path', 'size', '_base_remote_file', 'deltas')
+
+    def __init__(self, path, size, base_remote_file, deltas=None):
         """
         path -- the path where the file will be written
 
@@ -190,6 +602,7 @@ class RemoteFile:
         self.path = path
         self.size = size
         self._base_remote_file = base_remote_file
+        self.deltas = () if deltas is None else tuple(deltas)
 
     @property
     def filename(self):
@@ -202,14 +615,95 @@ class RemoteFile:
         """
         return os.path.isfile(self.path)
 
-    def download(self, supp_hooks=[]):
-        self._base_remote_file.download(supp_hooks)
+    @property
+    def partial_path(self):
+        return self.path + PARTIAL_SUFFIX
+
+    def download(self, supp_hooks=[], use_deltas=False):
+        """Download the file.
+
+        If use_deltas is true and one of the delta patch is applicable, the
+        file is rebuilt locally from the patch and checked against the same
+        hooks than a full download. If this fails for any reason, the full
+        file is downloaded.
+
+        If a previous download of the file has been paused (see
+        DownloadPausedError), the download is resumed.
+
+        """
+        if use_deltas:
+            for delta in self.deltas:
+                if delta.is_applicable():
+                    try:
+                        self._download_delta(delta, supp_hooks)
+                    except (DownloadError, DeltaError) as e:
+                        logger.warning(
+                            "Could not rebuild '%s' from delta: %s", self.filename, e
+                        )
+                    else:
+                        return
+        if os.path.isfile(self.partial_path):
+            partial_path = self.partial_path
+        else:
+            partial_path = None
+        try:
+            self._base_remote_file.download(supp_hooks, partial_path)
+        except DownloadPausedError:
+            # the partial file has been updated by the write to file hook
+            raise
+        except Exception:
+            try:
+                raise
+            finally:
+                self._remove_partial_file(partial_path)
+        else:
+            self._remove_partial_file(partial_path)
+
+    def _remove_partial_file(self, partial_path):
+        if partial_path is not None:
+            try:
+                os.remove(partial_path)
+            except OSError as e:
+                logger.error("error while removing '%s': %s", partial_path, e)
+
+    def _download_delta(self, delta, supp_hooks):
+        logger.debug("Rebuilding '%s' from '%s'", self.filename, delta.base_path)
+        new_data = delta.rebuild()
+        self._base_remote_file.process_local(io.BytesIO(new_data), supp_hooks)
 
     @classmethod
-    def new_remote_file(cls, path, size, url, downloader, hook_factories=[]):
+    def new_remote_file(
+        cls,
+        path,
+        size,
+        url,
+        downloader,
+        hook_factories=[],
+        deltas=None,
+        mirror_urls=(),
+        retries=0,
+        pipelined=False,
+    ):
         hook_factories = hook_factories + [WriteToFileHook.create_factory(path)]
-        base_remote_file = BaseRemoteFile(url, downloader, hook_factories)
-        return cls(path, size, base_remote_file)
+        base_remote_file = BaseRemoteFile(
+            url, downloader, hook_factories, mirror_urls, retries, pipelined
+        )
+        return cls(path, size, base_remote_file, deltas)
+
+
+class _HookFactory:
+    # A hook factory, i.e. a callable object returning a new hook each time
+    # it's called. This is lighter than a closure since there's one for each
+    # remote file.
+
+    __slots__ = ('_hook_class', '_args')
+
+    def __init__(self, hook_class, *args):
+        self._hook_class = hook_class
+        self._args = args
+
+    def __call__(self):
+        return self._hook_class(*self._args)
 
 
 class DownloadHook:
@@ -267,8 +761,16 @@ class DownloadHook:
         pass
 
 
+PARTIAL_SUFFIX = '.part'
+
+
 class WriteToFileHook(DownloadHook):
-    """Write a download to a file."""
+    """Write a download to a file.
+
+    If the download is paused, the partially written file is kept with the
+    PARTIAL_SUFFIX appended to the filename.
+
+    """
 
     def __init__(self, filename):
         super().__init__()
@@ -302,20 +804,32 @@ class WriteToFileHook(DownloadHook):
             try:
                 if self._renamed:
                     filename = self._filename
+                    os.remove(filename)
+                elif isinstance(exc_value, DownloadPausedError):
+                    filename = self._tmp_filename
+                    self._keep_partial_file()
                 else:
                     filename = self._tmp_filename
-                os.remove(filename)
+                    os.remove(filename)
             except OSError as e:
                 logger.error("error while removing '%s': %s", filename, e)
 
+    def _keep_partial_file(self):
+        partial_filename = self._filename + PARTIAL_SUFFIX
+        if os.path.isfile(partial_filename) and os.path.getsize(
+            partial_filename
+        ) >= os.path.getsize(self._tmp_filename):
+            # the download has been paused while the content of the partial
+            # file of a previous download was replayed, so what has been
+            # written is only a prefix of the partial file
+            os.remove(self._tmp_filename)
+        else:
+            os.replace(self._tmp_filename, partial_filename)
+
     @classmethod
     def create_factory(cls, filename):
         """Create a hook factory that will return WriteToFileHook instances."""
-
-        def aux():
-            return cls(filename)
-
-        return aux
+        return _HookFactory(cls, filename)
 
 
 class SHA1Hook(DownloadHook):
@@ -345,11 +859,7 @@ class SHA1Hook(DownloadHook):
     @classmethod
     def create_factory(cls, sha1sum):
         """Create a hook factory that will return SHA1Hook instances."""
-
-        def aux():
-            return cls(sha1sum)
-
-        return aux
+        return _HookFactory(cls, sha1sum)
 
 
 class ProgressBarHook(DownloadHook):
@@ -371,6 +881,20 @@ class ProgressBarHook(DownloadHook):
         self._pbar.finish()
 
 
+class _BufferHook(DownloadHook):
+    """Keep a download in memory."""
+
+    def __init__(self):
+        super().__init__()
+        self._buf = io.BytesIO()
+
+    def update(self, data):
+        self._buf.write(data)
+
+    def getvalue(self):
+        return self._buf.getvalue()
+
+
 class AbortHook(DownloadHook):
     """Abort a download at will by raising an exception in a call to update."""
 
@@ -401,18 +925,20 @@ def new_handlers(proxies=None):
         return []
 
 
-def new_downloaders_from_handlers(handlers=None):
+def new_downloaders_from_handlers(handlers=None, **kwargs):
     """Return a 2-items dictionary ret, for which:
 
     ret['default'] is a DefaultDownloader
     ret['auth'] is an AuthenticatingDownloader
 
+    Extra keyword arguments are passed to the downloaders constructor.
+
     """
-    auth = AuthenticatingDownloader(handlers)
-    default = DefaultDownloader(handlers)
+    auth = AuthenticatingDownloader(handlers, **kwargs)
+    default = DefaultDownloader(handlers, **kwargs)
     return {'auth': auth, 'default': default}
 
 
-def new_downloaders(proxies=None):
+def new_downloaders(proxies=None, **kwargs):
     """Create standard handlers and downloaders."""
-    return new_downloaders_from_handlers(new_handlers(proxies))
+    return new_downloaders_from_handlers(new_handlers(proxies), **kwargs)
@@ -0,0 +1,197 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""File copies avoiding to read and write the data in user space.
+
+A file is copied with the first of these methods that works:
+- reflink -- the destination shares the data blocks of the source until
+  one of them is modified, on copy-on-write filesystems (btrfs, xfs, ...)
+- hardlink -- only when asked by the caller, since the destination is then
+  the same file as the source, which is only safe if neither is modified
+  afterward
+- copy_file_range -- the data is copied by the kernel
+- copy -- a plain read and write of the data
+
+Methods that fail because they are not supported are not tried again for
+the same pair of source and destination filesystems. A hard link refused
+with EPERM only falls back for that file, since it is refused depending on
+the file (for example with fs.protected_hardlinks).
+
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import threading
+
+logger = logging.getLogger(__name__)
+
+REFLINK = 'reflink'
+HARDLINK = 'hardlink'
+COPY_FILE_RANGE = 'copy_file_range'
+COPY = 'copy'
+METHODS = (REFLINK, HARDLINK, COPY_FILE_RANGE, COPY)
+
+# from linux/fs.h
+_FICLONE = 0x40049409
+_UNSUPPORTED_ERRNOS = frozenset(
+    [
+        errno.EBADF,
+        errno.EINVAL,
+        errno.ENOSYS,
+        errno.ENOTSUP,
+        errno.EOPNOTSUPP,
+        errno.ENOTTY,
+        errno.EPERM,
+        errno.EXDEV,
+    ]
+)
+# errnos of os.link that only concern the linked file
+_LINK_FILE_ERRNOS = frozenset([errno.EPERM])
+_COPY_FILE_RANGE_SIZE = 1 << 30
+_COPY_BUFFER_SIZE = 1 << 20
+
+
+class CopyStats:
+    """Thread-safe counters of the number of bytes copied by each method."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bytes = dict.fromkeys(METHODS, 0)
+
+    def add(self, method, nbytes):
+        with self._lock:
+            self._bytes[method] += nbytes
+
+    def get(self, method):
+        with self._lock:
+            return self._bytes[method]
+
+    @property
+    def copied_bytes(self):
+        """Number of bytes whose data has been copied."""
+        return self.get(COPY_FILE_RANGE) + self.get(COPY)
+
+    @property
+    def linked_bytes(self):
+        """Number of bytes shared with the source instead of being copied."""
+        return self.get(REFLINK) + self.get(HARDLINK)
+
+    def reset(self):
+        with self._lock:
+            self._bytes = dict.fromkeys(METHODS, 0)
+
+    def __str__(self):
+        with self._lock:
+            return ', '.join(f'{method}: {self._bytes[method]}' for method in METHODS)
+
+
+stats = CopyStats()
+
+# dictionary of (source st_dev, destination st_dev) -> set of unsupported
+# methods
+_unsupported_methods = {}
+
+
+def _is_supported(fs_pair, method):
+    return method not in _unsupported_methods.get(fs_pair, ())
+
+
+def _set_unsupported(fs_pair, method, error):
+    logger.debug('%s not supported between devices %s: %s', method, fs_pair, error)
+    _unsupported_methods.setdefault(fs_pair, set()).add(method)
+
+
+def _reflink(src_fd, dst_fd, size):
+    fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+
+
+def _copy_file_range(src_fd, dst_fd, size):
+    copied = 0
+    while True:
+        n = os.copy_file_range(src_fd, dst_fd, _COPY_FILE_RANGE_SIZE)
+        if not n:
+            break
+        copied += n
+    if not copied and size:
+        # some filesystems (procfs, ...) report a size but copy nothing
+        raise OSError(errno.EINVAL, 'nothing copied')
+
+
+_FD_METHODS = [(REFLINK, _reflink)]
+if hasattr(os, 'copy_file_range'):
+    _FD_METHODS.append((COPY_FILE_RANGE, _copy_file_range))
+
+
+def copy_file(src, dst, allow_link=False):
+    """Copy the data and mode of the file src to the file dst.
+
+    If allow_link is true, dst may be a hard link of src, in which case an
+    existing dst is replaced instead of being overwritten.
+
+    Return the method used.
+
+    """
+    src_stat = os.stat(src)
+    dst_dir_stat = os.stat(os.path.dirname(dst) or os.curdir)
+    fs_pair = (src_stat.st_dev, dst_dir_stat.st_dev)
+    size = src_stat.st_size
+
+    if allow_link:
+        if os.path.lexists(dst):
+            os.remove(dst)
+        if src_stat.st_dev == dst_dir_stat.st_dev and _is_supported(fs_pair, HARDLINK):
+            try:
+                os.link(src, dst)
+            except OSError as e:
+                if e.errno in _LINK_FILE_ERRNOS or e.errno not in _UNSUPPORTED_ERRNOS:
+                    logger.debug('Could not link %s: %s', src, e)
+                else:
+                    _set_unsupported(fs_pair, HARDLINK, e)
+            else:
+                stats.add(HARDLINK, size)
+                return HARDLINK
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        for method, fun in _FD_METHODS:
+            if not _is_supported(fs_pair, method):
+                continue
+            try:
+                fun(fsrc.fileno(), fdst.fileno(), size)
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED_ERRNOS:
+                    raise
+                _set_unsupported(fs_pair, method, e)
+                os.lseek(fsrc.fileno(), 0, os.SEEK_SET)
+                os.lseek(fdst.fileno(), 0, os.SEEK_SET)
+                os.ftruncate(fdst.fileno(), 0)
+            else:
+                break
+        else:
+            method = COPY
+            shutil.copyfileobj(fsrc, fdst, _COPY_BUFFER_SIZE)
+    shutil.copymode(src, dst)
+    stats.add(method, size)
+    return method
+
+
+def copy(src, dst, allow_link=False):
+    """Copy the file src to dst like shutil.copy, dst being either a file or
+    a directory, but with copy_file.
+
+    Return the path of the new file.
+
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    copy_file(src, dst, allow_link)
+    return dst
+
+
+def copy2(src, dst):
+    """Like copy, but also copy the metadata of src, like shutil.copy2."""
+    dst = copy(src, dst)
+    shutil.copystat(src, dst)
+    return dst
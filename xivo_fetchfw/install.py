@@ -1,19 +1,24 @@
-# Copyright 2010-2023 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2010-2026 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import abc
 import collections
+import concurrent.futures
 import contextlib
 import glob
 import itertools
 import logging
+import multiprocessing
 import os
 import shutil
 import subprocess
 import tarfile
 import tempfile
+import threading
 import zipfile
 from fnmatch import fnmatch
 
+from xivo_fetchfw import fastcopy
 from xivo_fetchfw.util import FetchfwError
 
 logger = logging.getLogger(__name__)
@@ -28,13 +33,15 @@ class InstallationGraphError(InstallationError):
 
 
 class _InstallationProcess:
-    def __init__(self, sources, filters, dir=None):
+    def __init__(self, sources, filters, dir=None, max_workers=1):
         self._sources = sources
         self._filters = filters
         self._dir = dir
+        self._max_workers = max_workers
         self._executed = False
         self._need_cleanup = False
         self._base_dir = None
+        self._output_predicates = {}
 
     def execute(self):
         """Execute the installation.
@@ -42,29 +49,30 @@ class _InstallationProcess:
         Return the directory (subdirectory of dir) which contains the result
         of the installation process.
 
+        Filters that can produce only part of their output are asked to
+        produce only the files needed by the filters that depend on them,
+        when all of these filters tell which files they need.
+
+        If more than one worker was asked, nodes are executed in parallel,
+        each node being executed as soon as the node it depends on has been
+        executed. Nodes writing to the result directory are never executed
+        at the same time. If a node fails, the nodes that have not been
+        started yet are cancelled.
+
         """
         if self._executed:
             raise Exception('Installation process already executed')
         self._base_dir = tempfile.mkdtemp(dir=self._dir)
         req_map = self._build_requirement_map()
 
-        sources = self._sources
-        filters = self._filters
         result_dir, input_dirs, output_dirs = self._create_directories_map(req_map)
+        self._output_predicates = self._build_output_predicates(req_map)
         try:
-            for node_id in self._create_execution_plan(req_map):
-                if node_id in sources:
-                    source_obj = sources[node_id]
-                    output_dir = output_dirs[node_id]
-                    logger.debug("Executing source node %s", node_id)
-                    source_obj.pull(output_dir)
-                else:
-                    assert node_id in filters
-                    filter_obj = filters[node_id][0]
-                    input_dir = input_dirs[node_id]
-                    output_dir = output_dirs[node_id]
-                    logger.debug("Executing filter node %s", node_id)
-                    filter_obj.apply(input_dir, output_dir)
+            if self._max_workers > 1:
+                self._execute_in_parallel(req_map, result_dir, input_dirs, output_dirs)
+            else:
+                for node_id in self._create_execution_plan(req_map):
+                    self._execute_node(node_id, input_dirs, output_dirs)
         except Exception:
             logger.error(
                 "Error during execution of installation manager", exc_info=True
@@ -78,6 +86,55 @@ class _InstallationProcess:
             self._need_cleanup = True
             return result_dir
 
+    def _execute_node(self, node_id, input_dirs, output_dirs):
+        if node_id in self._sources:
+            source_obj = self._sources[node_id]
+            logger.debug("Executing source node %s", node_id)
+            source_obj.pull(output_dirs[node_id])
+        else:
+            assert node_id in self._filters
+            filter_obj = self._filters[node_id][0]
+            logger.debug("Executing filter node %s", node_id)
+            predicate = self._output_predicates.get(node_id)
+            if predicate is None:
+                filter_obj.apply(input_dirs[node_id], output_dirs[node_id])
+            else:
+                filter_obj.apply_selected(
+                    input_dirs[node_id], output_dirs[node_id], predicate
+                )
+
+    def _execute_in_parallel(self, req_map, result_dir, input_dirs, output_dirs):
+        result_dir_lock = threading.Lock()
+
+        def execute_node(node_id):
+            if output_dirs[node_id] == result_dir:
+                with result_dir_lock:
+                    self._execute_node(node_id, input_dirs, output_dirs)
+            else:
+                self._execute_node(node_id, input_dirs, output_dirs)
+
+        with concurrent.futures.ThreadPoolExecutor(self._max_workers) as executor:
+            pending = {
+                executor.submit(execute_node, node_id): node_id
+                for node_id in self._sources
+            }
+            while pending:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    node_id = pending.pop(future)
+                    exception = future.exception()
+                    if exception is not None:
+                        # wait for the running nodes before the base directory
+                        # is removed
+                        executor.shutdown(cancel_futures=True)
+                        raise exception
+                    for requirement in req_map[node_id]:
+                        pending[
+                            executor.submit(execute_node, requirement)
+                        ] = requirement
+
     def _build_requirement_map(self):
         # Return a 'requirement map', i.e. a dictionary which keys are node id
         # and values are node id that depends on the key
@@ -88,6 +145,30 @@ class _InstallationProcess:
             req_map[filter_dependency].append(filter_id)
         return req_map
 
+    def _build_output_predicates(self, req_map):
+        # Return a dictionary which keys are the id of the filters having an
+        # 'apply_selected' method and values are the predicate of the files
+        # needed by the filters that depend on it, if known
+        output_predicates = {}
+        for node_id, requirements in req_map.items():
+            if not requirements or node_id not in self._filters:
+                continue
+            if not hasattr(self._filters[node_id][0], 'apply_selected'):
+                continue
+            predicates = []
+            for requirement in requirements:
+                filter_obj = self._filters[requirement][0]
+                predicate = None
+                if hasattr(filter_obj, 'input_predicate'):
+                    predicate = filter_obj.input_predicate()
+                if predicate is None:
+                    break
+                predicates.append(predicate)
+            else:
+                logger.debug("Pushing down the input predicates of %s", requirements)
+                output_predicates[node_id] = _AnyPathPredicate(predicates)
+        return output_predicates
+
     def _create_directories_map(self, req_map):
         # note that self._base_dir must have been set
         result_dir = os.path.join(self._base_dir, 'result')
@@ -132,9 +213,77 @@ class _InstallationProcess:
             self._need_cleanup = False
 
 
+def _check_nodes_id_are_unique(sources, filters):
+    common_ids = set(sources).intersection(filters)
+    if common_ids:
+        raise InstallationGraphError(
+            f"these IDs are shared by both a source and a filter: {common_ids}"
+        )
+
+
+def _check_filters_depend_on_valid_node(sources, filters):
+    # Check that there's no unknown identifier in the installation graph, i.e. raise an
+    # exception if there's a filter such that it depends on an unknown node.
+    for filter_id, filter_value in filters.items():
+        node_dependency = filter_value[1]
+        if node_dependency not in filters and node_dependency not in sources:
+            raise InstallationGraphError(
+                f"filter '{filter_id}' depends on unknown filter/source '{node_dependency}'"
+            )
+
+
+def _check_no_useless_source(sources, filters):
+    # Check if every source participates in the installation process, i.e. raise an exception
+    # if there's a source such that no other filter depend on it.
+    dependencies = (v[1] for v in filters.values())
+    unused_sources = set(sources).difference(dependencies)
+    if unused_sources:
+        raise InstallationGraphError(
+            f"these sources doesn't participate in the installation: {unused_sources}"
+        )
+
+
+def _check_is_acyclic(sources, filters):
+    # Check that the installation graph is acyclic
+    visited = set()
+    for node_id in filters:
+        if node_id not in visited:
+            currently_visited = {node_id}
+            while True:
+                next_node_id = filters[node_id][1]
+                if next_node_id in sources:
+                    break
+                if next_node_id in currently_visited:
+                    raise InstallationGraphError(
+                        "a cycle in the installation graph has been detected"
+                    )
+                currently_visited.add(next_node_id)
+                node_id = next_node_id
+            visited.update(currently_visited)
+
+
+def check_installation_graph(installation_graph):
+    """Raise an InstallationGraphError if the installation graph is invalid.
+
+    Only the structure of the graph is checked, so the source and filter
+    objects of the graph can be anything, including None.
+
+    See InstallationManager for the format of the installation graph.
+
+    """
+    sources = installation_graph['sources']
+    filters = installation_graph['filters']
+    _check_nodes_id_are_unique(sources, filters)
+    _check_filters_depend_on_valid_node(sources, filters)
+    _check_no_useless_source(sources, filters)
+    _check_is_acyclic(sources, filters)
+
+
 class InstallationManager:
     """An installation manager..."""
 
+    __slots__ = ('_sources', '_filters')
+
     def __init__(self, installation_graph):
         r"""Build an InstallationManager.
 
@@ -152,70 +301,24 @@ class InstallationManager:
         A filter is an object with a 'apply(src_directory, dst_directory)' method.
         A source is an object with a 'pull(dst_directory)' method.
 
+        A filter can also have:
+        - an 'input_predicate()' method, returning a picklable predicate
+          taking the relative path of a file of the source directory and
+          returning false if the filter doesn't need this file, or None if
+          the filter might need every file
+        - an 'apply_selected(src_directory, dst_directory, predicate)' method,
+          which is called instead of 'apply' with the predicates of the
+          filters that depend on it, when every one of them has one. The
+          filter may then skip the files for which predicate returns false.
+
         Raise an InstallationGraphError if the installation graph is invalid.
 
         """
         self._sources = installation_graph['sources']
         self._filters = installation_graph['filters']
-        self._check_installation_graph_validity()
-
-    def _check_installation_graph_validity(self):
-        # Check if the installation graph is valid, if not, raise an InstallationError.
-        self._check_nodes_id_are_unique()
-        self._check_filters_depend_on_valid_node()
-        self._check_no_useless_source()
-        self._check_is_acyclic()
-
-    def _check_nodes_id_are_unique(self):
-        common_ids = set(self._sources).intersection(self._filters)
-        if common_ids:
-            raise InstallationGraphError(
-                f"these IDs are shared by both a source and a filter: {common_ids}"
-            )
-
-    def _check_filters_depend_on_valid_node(self):
-        # Check that there's no unknown identifier in the installation graph, i.e. raise an
-        # exception if there's a filter such that it depends on an unknown node.
-        sources = self._sources
-        filters = self._filters
-        for filter_id, filter_value in filters.items():
-            node_dependency = filter_value[1]
-            if node_dependency not in filters and node_dependency not in sources:
-                raise InstallationGraphError(
-                    f"filter '{filter_id}' depends on unknown filter/source '{node_dependency}'"
-                )
-
-    def _check_no_useless_source(self):
-        # Check if every source participates in the installation process, i.e. raise an exception
-        # if there's a source such that no other filter depend on it.
-        dependencies = (v[1] for v in self._filters.values())
-        unused_sources = set(self._sources).difference(dependencies)
-        if unused_sources:
-            raise InstallationGraphError(
-                f"these sources doesn't participate in the installation: {unused_sources}"
-            )
-
-    def _check_is_acyclic(self):
-        # Check that the installation graph is acyclic
-        sources = self._sources
-        filters = self._filters
-        visited = set()
-        for node_id in filters:
-            if node_id not in visited:
-                currently_visited = {node_id}
-                while True:
-                    next_node_id = filters[node_id][1]
-                    if next_node_id in sources:
-                        break
-                    if next_node_id in currently_visited:
-                        raise InstallationGraphError(
-                            "a cycle in the installation graph has been detected"
-                        )
-                    currently_visited.add(next_node_id)
-                    node_id = next_node_id
-                visited.update(currently_visited)
+        check_installation_graph(installation_graph)
 
-    def new_installation_process(self, dir=None):
+    def new_installation_process(self, dir=None, max_workers=1):
         """Return an installation process instance, i.e. an object with an
         "execute" and "cleanup" method.
 
@@ -225,8 +328,39 @@ class InstallationManager:
         dir, which can be None, in the case the default system temporary
         directory will be used.
 
+        max_workers is the maximum number of nodes executed in parallel.
+
         """
-        return _InstallationProcess(self._sources, self._filters, dir)
+        return _InstallationProcess(self._sources, self._filters, dir, max_workers)
+
+
+class _PathPredicate:
+    """A predicate on relative paths which is true if the path, or one of
+    its parent directories, matches one of the patterns. The result is
+    inverted if negate is true.
+
+    """
+
+    def __init__(self, patterns, negate=False):
+        self._patterns = patterns
+        self._negate = negate
+
+    def __call__(self, rel_path):
+        prefix = ''
+        for component in rel_path.split(os.sep):
+            prefix = os.path.join(prefix, component)
+            for pattern in self._patterns:
+                if fnmatch(prefix, pattern):
+                    return not self._negate
+        return self._negate
+
+
+class _AnyPathPredicate:
+    def __init__(self, predicates):
+        self._predicates = predicates
+
+    def __call__(self, rel_path):
+        return any(predicate(rel_path) for predicate in self._predicates)
 
 
 class _GlobHelper:
@@ -254,15 +388,25 @@ class _GlobHelper:
     def glob_in_dir(self, src_directory):
         return list(self.iglob_in_dir(src_directory))
 
+    def path_predicate(self):
+        """Return a predicate which is true for every file that is, or is
+        under, a file matched by the glob patterns, and maybe for some others,
+        or None if the patterns match the directory itself.
+
+        """
+        if os.curdir in self._pathnames:
+            return None
+        return _PathPredicate(self._pathnames)
+
     def iglob_in_dir(self, src_directory):
         """Apply the glob patterns in src_directory and return an iterator over
-        each file matched.
+        each file matched, in the order of the patterns and then of the names.
 
         """
         no_matches = True
         for rel_pathname in self._pathnames:
             abs_pathname = os.path.join(src_directory, rel_pathname)
-            for globbed_abs_pathname in glob.iglob(abs_pathname):
+            for globbed_abs_pathname in sorted(glob.iglob(abs_pathname)):
                 no_matches = False
                 yield globbed_abs_pathname
         if no_matches and self._error_on_no_matches:
@@ -272,6 +416,46 @@ class _GlobHelper:
             )
 
 
+class _FileCopier:
+    """Copy the files of a source directory with fastcopy.
+
+    If link_files is true, the regular files of the source directory are
+    hard linked instead of copied when possible, so that filters selecting
+    or moving files around don't copy their data again. This is only safe
+    when the source directory is not modified afterward, like the
+    directories of the nodes of an installation process. Files reached
+    through a symlink to the outside of the source directory, like the files
+    pulled by a FilesystemLinkSource, are never linked.
+
+    """
+
+    def __init__(self, src_directory, link_files=False):
+        self._link_files = link_files
+        self._real_src_directory = os.path.join(os.path.realpath(src_directory), '')
+
+    def _can_link(self, src_file):
+        if not self._link_files:
+            return False
+        real_src_file = os.path.realpath(src_file)
+        return real_src_file.startswith(self._real_src_directory) and os.path.isfile(
+            real_src_file
+        )
+
+    def copy(self, src_file, dst_file):
+        """Copy src_file to dst_file, like shutil.copy.
+
+        An existing dst_file is replaced instead of being overwritten, since
+        it might be a hard link to another file.
+
+        """
+        if os.path.isdir(dst_file):
+            dst_file = os.path.join(dst_file, os.path.basename(src_file))
+        if os.path.lexists(dst_file):
+            os.remove(dst_file)
+        fastcopy.copy_file(src_file, dst_file, self._can_link(src_file))
+        return dst_file
+
+
 class FilesystemLinkSource:
     """A source which create symlink of existing files to the destination
     directory.
@@ -349,9 +533,11 @@ class FilesystemCopySource:
                     dst_directory, os.path.basename(globbed_pathname)
                 )
                 if os.path.isdir(globbed_pathname):
-                    shutil.copytree(globbed_pathname, dst_pathname)
+                    shutil.copytree(
+                        globbed_pathname, dst_pathname, copy_function=fastcopy.copy2
+                    )
                 else:
-                    shutil.copy(globbed_pathname, dst_pathname)
+                    fastcopy.copy(globbed_pathname, dst_pathname)
 
 
 class NullSource:
@@ -365,48 +551,226 @@ class NullSource:
         pass
 
 
-class ZipFilter:
-    """A filter who transform a directory containing zip files to a directory containing
-    the content of these zip files.
+def _merge_extracted_dir(staging_dir, dst_directory, archive, rel_dir=''):
+    # Move the content of staging_dir into dst_directory, the content of
+    # staging_dir replacing the files already in dst_directory, like if the
+    # archive had been extracted directly in dst_directory
+    for name in sorted(os.listdir(staging_dir)):
+        src_path = os.path.join(staging_dir, name)
+        dst_path = os.path.join(dst_directory, name)
+        rel_path = os.path.join(rel_dir, name)
+        if os.path.lexists(dst_path):
+            src_is_dir = os.path.isdir(src_path) and not os.path.islink(src_path)
+            dst_is_dir = os.path.isdir(dst_path) and not os.path.islink(dst_path)
+            if src_is_dir and dst_is_dir:
+                _merge_extracted_dir(src_path, dst_path, archive, rel_path)
+                continue
+            logger.info(
+                "'%s' of archive '%s' replaces a file of a previous archive",
+                rel_path,
+                archive,
+            )
+            if dst_is_dir:
+                shutil.rmtree(dst_path)
+            else:
+                os.remove(dst_path)
+        os.rename(src_path, dst_path)
+
+
+class _ArchiveFilter(abc.ABC):
+    """Base class of the filters extracting the archives matching glob
+    patterns.
+
+    When more than one archive matches and max_workers is greater than 1,
+    the archives are extracted concurrently, each in its own temporary
+    directory, by a pool of at most max_workers processes or threads. The
+    temporary directories are then merged in the destination directory in
+    the order of the matches, so the result is the same as if the archives
+    had been extracted one after the other.
 
     """
 
-    def __init__(self, pathnames):
+    # true if _extract must be executed in a process pool, i.e. if it does
+    # the extraction itself instead of running an external command
+    _use_processes = False
+
+    def __init__(self, pathnames, max_workers=1):
         """
         pathnames -- a single glob pattern or an iterator over multiple glob
           patterns
+        max_workers -- the maximum number of archives extracted concurrently
 
         """
         self._glob_helper = _GlobHelper(pathnames)
+        self._max_workers = max_workers
+
+    @abc.abstractmethod
+    def _extract(self, pathname, dst_directory, *args):
+        """Extract the archive pathname in dst_directory.
+
+        args are the extract_args given to _apply.
+
+        """
+
+    def input_predicate(self):
+        return self._glob_helper.path_predicate()
+
+    def _new_executor(self, max_workers):
+        if self._use_processes:
+            # processes are spawned instead of forked since the installation
+            # process might be running other nodes in threads
+            return concurrent.futures.ProcessPoolExecutor(
+                max_workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        return concurrent.futures.ThreadPoolExecutor(max_workers)
 
     def apply(self, src_directory, dst_directory):
-        for pathname in self._glob_helper.iglob_in_dir(src_directory):
-            with contextlib.closing(zipfile.ZipFile(pathname, 'r')) as zf:
-                zf.extractall(dst_directory)
+        self._apply(src_directory, dst_directory, ())
+
+    def _apply(self, src_directory, dst_directory, extract_args):
+        pathnames = self._glob_helper.glob_in_dir(src_directory)
+        max_workers = min(self._max_workers, len(pathnames))
+        if max_workers < 2:
+            for pathname in pathnames:
+                self._extract(pathname, dst_directory, *extract_args)
+            return
 
+        staging_dirs = []
+        try:
+            for _ in pathnames:
+                staging_dirs.append(
+                    tempfile.mkdtemp(prefix='.extract-', dir=dst_directory)
+                )
+            with self._new_executor(max_workers) as executor:
+                futures = [
+                    executor.submit(self._extract, pathname, staging_dir, *extract_args)
+                    for pathname, staging_dir in zip(pathnames, staging_dirs)
+                ]
+            # raise the error of the first archive that failed, if any
+            for future in futures:
+                future.result()
+            for pathname, staging_dir in zip(pathnames, staging_dirs):
+                _merge_extracted_dir(staging_dir, dst_directory, pathname)
+        finally:
+            for staging_dir in staging_dirs:
+                shutil.rmtree(staging_dir, True)
+
+
+def _is_member_selected(name, is_dir, dst_directory, predicate):
+    # Return true if the archive member name is to be extracted, i.e. if it's
+    # a directory or if predicate is true for its relative path. The parent
+    # directories of a skipped member are still created, so that the
+    # destination directory has the same directories as if every member had
+    # been extracted.
+    if is_dir:
+        return True
+    components = [
+        component for component in name.split('/') if component not in ('', os.curdir)
+    ]
+    if not components or os.pardir in components:
+        return True
+    if predicate(os.path.join(*components)):
+        return True
+    if len(components) > 1:
+        os.makedirs(os.path.join(dst_directory, *components[:-1]), exist_ok=True)
+    return False
 
-class TarFilter:
+
+def _extract_zip(pathname, dst_directory, predicate=None):
+    with contextlib.closing(zipfile.ZipFile(pathname, 'r')) as zf:
+        if predicate is None:
+            zf.extractall(dst_directory)
+        else:
+            # the skipped members are never read, since the members are
+            # located with the central directory of the zip file
+            members = [
+                info
+                for info in zf.infolist()
+                if _is_member_selected(
+                    info.filename, info.is_dir(), dst_directory, predicate
+                )
+            ]
+            zf.extractall(dst_directory, members)
+
+
+def _select_tar_members(tf, dst_directory, predicate, skipped_members):
+    # Yield the members of tf to extract while they are read, so that the
+    # data of the skipped members is only skipped over. Since a link can
+    # point to any member, and a needed path can go through a symbolic link
+    # to a directory, every member is selected once a link is found, in which
+    # case the members skipped before, and not replaced by a member of the
+    # same name after, are put in skipped_members.
+    members = iter(tf)
+    skipped = []
+    for member in members:
+        if member.issym() or member.islnk():
+            logger.debug("Extracting every member since '%s' is a link", member.name)
+            yield member
+            break
+        if _is_member_selected(member.name, member.isdir(), dst_directory, predicate):
+            yield member
+        else:
+            skipped.append(member)
+    else:
+        return
+    names = set()
+    for member in members:
+        names.add(member.name)
+        yield member
+    skipped_members.extend(member for member in skipped if member.name not in names)
+
+
+def _extract_tar(pathname, dst_directory, predicate=None):
+    with contextlib.closing(tarfile.open(pathname)) as tf:
+        if predicate is None:
+            tf.extractall(dst_directory)
+        else:
+            skipped_members = []
+            tf.extractall(
+                dst_directory,
+                _select_tar_members(tf, dst_directory, predicate, skipped_members),
+            )
+            if skipped_members:
+                tf.extractall(dst_directory, skipped_members)
+
+
+class ZipFilter(_ArchiveFilter):
+    """A filter who transform a directory containing zip files to a directory containing
+    the content of these zip files.
+
+    """
+
+    _use_processes = True
+    _extract = staticmethod(_extract_zip)
+
+    def apply_selected(self, src_directory, dst_directory, predicate):
+        """Like apply, but only extract the directories and the files for
+        which predicate returns true.
+
+        """
+        self._apply(src_directory, dst_directory, (predicate,))
+
+
+class TarFilter(_ArchiveFilter):
     """A filter who transform a directory containing tar files to a directory containing
     the content of these tar files. The tar files can be either uncompressed, gzipped
     or bz2-ipped.
 
     """
 
-    def __init__(self, pathnames):
-        """
-        pathnames -- a single glob pattern or an iterator over multiple glob
-          patterns
+    _use_processes = True
+    _extract = staticmethod(_extract_tar)
 
-        """
-        self._glob_helper = _GlobHelper(pathnames)
+    def apply_selected(self, src_directory, dst_directory, predicate):
+        """Like apply, but only extract the directories and the files for
+        which predicate returns true, unless the archive contains links, in
+        which case everything is extracted.
 
-    def apply(self, src_directory, dst_directory):
-        for pathname in self._glob_helper.iglob_in_dir(src_directory):
-            with contextlib.closing(tarfile.open(pathname)) as tf:
-                tf.extractall(dst_directory)
+        """
+        self._apply(src_directory, dst_directory, (predicate,))
 
 
-class RarFilter:
+class RarFilter(_ArchiveFilter):
     """A filter who transform a directory containing rar files to a directory
     containing the content of these rar files.
 
@@ -418,24 +782,15 @@ class RarFilter:
 
     _CMD_PREFIX = ['unrar', 'e', '-idq', '-y']
 
-    def __init__(self, pathnames):
-        """
-        pathnames -- a single glob pattern or an iterator over multiple glob
-          patterns
-
-        """
-        self._glob_helper = _GlobHelper(pathnames)
-
-    def apply(self, src_directory, dst_directory):
-        for pathname in self._glob_helper.iglob_in_dir(src_directory):
-            cmd = self._CMD_PREFIX + [pathname, dst_directory]
-            logger.debug('Executing external command: %s', cmd)
-            retcode = subprocess.call(cmd)
-            if retcode:
-                raise InstallationError(f'unrar returned status code {retcode}')
+    def _extract(self, pathname, dst_directory):
+        cmd = self._CMD_PREFIX + [pathname, dst_directory]
+        logger.debug('Executing external command: %s', cmd)
+        retcode = subprocess.call(cmd)
+        if retcode:
+            raise InstallationError(f'unrar returned status code {retcode}')
 
 
-class Filter7z:
+class Filter7z(_ArchiveFilter):
     """A filter who transform a directory containing 7z files to a directory
     containing the content of these 7z files.
 
@@ -453,23 +808,14 @@ class Filter7z:
 
     _CMD_PREFIX = ['7zr', 'e', '-bd']
 
-    def __init__(self, pathnames):
-        """
-        pathnames -- a single glob pattern or an iterator over multiple glob
-          patterns
-
-        """
-        self._glob_helper = _GlobHelper(pathnames)
-
-    def apply(self, src_directory, dst_directory):
-        for pathname in self._glob_helper.iglob_in_dir(src_directory):
-            cmd = self._CMD_PREFIX + [f'-o{dst_directory}', pathname]
-            # there's no "quiet" option for 7zr, so we redirect stdout to /dev/null
-            with open(os.devnull, 'wb') as devnull_fobj:
-                logger.debug('Executing external command: %s', cmd)
-                retcode = subprocess.call(cmd, stdout=devnull_fobj)
-            if retcode:
-                raise InstallationError(f'7zr returned status code {retcode}')
+    def _extract(self, pathname, dst_directory):
+        cmd = self._CMD_PREFIX + [f'-o{dst_directory}', pathname]
+        # there's no "quiet" option for 7zr, so we redirect stdout to /dev/null
+        with open(os.devnull, 'wb') as devnull_fobj:
+            logger.debug('Executing external command: %s', cmd)
+            retcode = subprocess.call(cmd, stdout=devnull_fobj)
+        if retcode:
+            raise InstallationError(f'7zr returned status code {retcode}')
 
 
 class CiscoUnsignFilter:
@@ -523,7 +869,7 @@ class CiscoUnsignFilter:
 
 
 class IncludeExcludeFilter:
-    def __init__(self, filter_fun):
+    def __init__(self, filter_fun, link_files=False, input_predicate=None):
         """
         filter_fun -- a callable object taking two arguments, the first being
           the relative name of the file currently under test and the second
@@ -545,10 +891,23 @@ class IncludeExcludeFilter:
         directory are not automatically included and the filter_fun will be
         called for every child files of this directory.
 
+        If link_files is true, included files are hard linked instead of
+        copied when possible (see _FileCopier).
+
+        input_predicate -- if not None, a predicate returning false for the
+          relative names of the files for which filter_fun, or the filter_fun
+          of a parent directory, returns false. See InstallationManager.
+
         """
         self._filter_fun = filter_fun
+        self._link_files = link_files
+        self._input_predicate = input_predicate
+
+    def input_predicate(self):
+        return self._input_predicate
 
     def apply(self, src_directory, dst_directory):
+        copier = _FileCopier(src_directory, self._link_files)
         rel_dir_stack = [os.curdir]
         while rel_dir_stack:
             rel_current_dir = rel_dir_stack.pop()
@@ -565,16 +924,17 @@ class IncludeExcludeFilter:
                         os.mkdir(dst_abs_file)
                         rel_dir_stack.append(rel_file)
                     else:
-                        shutil.copy(src_abs_file, dst_abs_file)
+                        copier.copy(src_abs_file, dst_abs_file)
 
 
-def ExcludeFilter(pathnames):
+def ExcludeFilter(pathnames, link_files=False):
     """A filter which excludes some files of the source directory from the destination
     directory. Excluded files can be either files, directories or both.
 
     Takes the following arguments:
       pathnames -- a single glob pattern or an iterator over multiple glob
         patterns
+      link_files -- see IncludeExcludeFilter
 
     """
     if isinstance(pathnames, str):
@@ -588,16 +948,19 @@ def ExcludeFilter(pathnames):
                 return False
         return True
 
-    return IncludeExcludeFilter(filter_fun)
+    return IncludeExcludeFilter(
+        filter_fun, link_files, _PathPredicate(pathnames, negate=True)
+    )
 
 
-def IncludeFilter(pathnames):
+def IncludeFilter(pathnames, link_files=False):
     """A filter which includes some files of the source directory from the destination
     directory. Included files can be either files, directories or both.
 
     Takes the following arguments:
       pathnames -- a single glob pattern or an iterator over multiple glob
         patterns
+      link_files -- see IncludeExcludeFilter
 
     """
     if isinstance(pathnames, str):
@@ -621,7 +984,7 @@ def IncludeFilter(pathnames):
                 return True
         return False
 
-    return IncludeExcludeFilter(filter_fun)
+    return IncludeExcludeFilter(filter_fun, link_files, _PathPredicate(pathnames))
 
 
 class CopyFilter:
@@ -630,17 +993,23 @@ class CopyFilter:
 
     """
 
-    def __init__(self, pathnames, dst):
+    def __init__(self, pathnames, dst, link_files=False):
         """
         pathnames -- a single glob pattern or an iterator over multiple glob
           patterns
         dst -- either a directory name, if it ends with '/', or else a file name.
           This must be explicit because the installer create any missing directory
           when copying files. This is a relative destination.
+        link_files -- if true, files are hard linked instead of copied when
+          possible (see _FileCopier)
 
         """
         self._glob_helper = _GlobHelper(pathnames)
         self._dst = dst
+        self._link_files = link_files
+
+    def input_predicate(self):
+        return self._glob_helper.path_predicate()
 
     def apply(self, src_directory, dst_directory):
         dst_is_dir = self._dst.endswith('/')
@@ -660,28 +1029,34 @@ class CopyFilter:
                 dirname = os.path.dirname(abs_dst)
                 if not os.path.exists(dirname):
                     os.makedirs(dirname)
+            copier = _FileCopier(src_directory, self._link_files)
             if dst_is_dir:
-                self._apply_dir(src_directory, abs_dst)
+                self._apply_dir(src_directory, abs_dst, copier)
             else:
-                self._apply_file(src_directory, abs_dst)
+                self._apply_file(src_directory, abs_dst, copier)
         except OSError as e:
             logger.error("Error during execution of copy filter", exc_info=True)
             raise InstallationError(e)
 
-    def _apply_dir(self, src_directory, abs_dst):
+    def _apply_dir(self, src_directory, abs_dst, copier):
         for pathname in self._glob_helper.iglob_in_dir(src_directory):
             if os.path.isdir(pathname):
                 src_dir_name = os.path.basename(pathname)
-                shutil.copytree(pathname, os.path.join(abs_dst, src_dir_name), True)
+                shutil.copytree(
+                    pathname,
+                    os.path.join(abs_dst, src_dir_name),
+                    True,
+                    copy_function=copier.copy,
+                )
             else:
-                shutil.copy(pathname, abs_dst)
+                copier.copy(pathname, abs_dst)
 
-    def _apply_file(self, src_directory, abs_dst):
+    def _apply_file(self, src_directory, abs_dst, copier):
         pathnames = self._glob_helper.glob_in_dir(src_directory)
         if len(pathnames) > 1:
             raise InstallationError(f"glob pattern matched {len(pathnames)} files")
         pathname = pathnames[0]
-        shutil.copy(pathname, abs_dst)
+        copier.copy(pathname, abs_dst)
 
 
 class NullFilter:
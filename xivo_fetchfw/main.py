@@ -1,11 +1,28 @@
-# Copyright 2010-2023 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2010-2026 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import argparse
+import contextlib
 import logging
+import os
+import signal
 import sys
-from operator import itemgetter
 
-from xivo_fetchfw import cli, commands, config, download, package, params, storage, util
+from xivo_fetchfw import (
+    bundle,
+    cli,
+    commands,
+    config,
+    daemon,
+    download,
+    package,
+    params,
+    schedule,
+    search,
+    storage,
+    sync,
+    util,
+)
 
 logger = logging.getLogger('xivo-fetchfw')
 
@@ -26,12 +43,90 @@ def main():
         sys.exit(1)
 
 
-def _init_logging():
+def _init_logging(level=logging.ERROR, handler_level=logging.NOTSET):
     logger = logging.getLogger()
     handler = logging.StreamHandler()
     handler.setFormatter(logging.Formatter("%(message)s"))
+    handler.setLevel(handler_level)
     logger.addHandler(handler)
-    logger.setLevel(logging.ERROR)
+    logger.setLevel(level)
+
+
+def daemon_main():
+    parser = argparse.ArgumentParser(description='xivo-fetchfw daemon')
+    parser.add_argument(
+        '--config',
+        default='/etc/xivo/xivo-fetchfw.conf',
+        help='set an alternate configuration file',
+    )
+    parser.add_argument('--socket', help='set an alternate socket path')
+    parser.add_argument(
+        '--debug', action='store_true', default=False, help='display debug messages'
+    )
+    parsed_args = parser.parse_args()
+    # the level of the handler is also set, since the level of the root
+    # logger is lowered while executing requests of clients in debug mode
+    level = logging.DEBUG if parsed_args.debug else logging.INFO
+    _init_logging(level, level)
+    try:
+        config_dict = config.read_config(parsed_args.config)
+        socket_path = parsed_args.socket or config_dict['general.daemon_socket']
+        deadline = _new_deadline(config_dict)
+        pkg_mgr = _new_pkg_mgr(config_dict, _new_downloaders(config_dict, deadline))
+        server = daemon.DaemonServer(
+            socket_path, pkg_mgr, config_dict, deadline, parsed_args.config
+        )
+    except Exception as e:
+        print("error:", e, file=sys.stderr)
+        logger.debug('Stack trace:', exc_info=True)
+        sys.exit(1)
+
+    def on_sigterm(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    logger.info("Listening on '%s'", socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def _new_deadline(config_dict):
+    if not config_dict['general.operation_timeout']:
+        return None
+    return download.Deadline(config_dict['general.operation_timeout'])
+
+
+def _new_downloaders(config_dict, deadline=None):
+    proxies = params.filter_section(config_dict, 'proxy')
+    return download.new_downloaders(
+        proxies,
+        timeout=config_dict['general.download_timeout'],
+        file_timeout=config_dict['general.file_timeout'],
+        low_speed_limit=config_dict['general.low_speed_limit'],
+        low_speed_time=config_dict['general.low_speed_time'],
+        deadline=deadline,
+    )
+
+
+def _new_pkg_mgr(config_dict, downloaders):
+    global_vars = params.filter_section(config_dict, 'global_vars')
+    able_pkg_sto, ed_pkg_sto = storage.new_pkg_storages(
+        config_dict['general.db_dir'],
+        config_dict['general.cache_dir'],
+        downloaders,
+        global_vars,
+        config_dict['general.download_retries'],
+        config_dict['general.pipelined_downloads'],
+        config_dict['general.installed_db_backend'],
+        config_dict['general.install_workers'],
+    )
+    return package.PackageManager(
+        able_pkg_sto, ed_pkg_sto, config_dict['general.install_workers']
+    )
 
 
 class _XivoFetchfwCommand(commands.AbstractCommand):
@@ -45,18 +140,31 @@ class _XivoFetchfwCommand(commands.AbstractCommand):
             '--debug', action='store_true', default=False, help='display debug messages'
         )
         parser.add_argument('--root', help='set the root directory')
+        parser.add_argument(
+            '--no-daemon',
+            action='store_true',
+            default=False,
+            help='do not use the xivo-fetchfwd daemon even if it is running',
+        )
 
     def configure_subcommands(self, subcommands):
         subcommands.add_subcommand(_InstallSubcommand('install'))
         subcommands.add_subcommand(_UpgradeSubcommand('upgrade'))
+        subcommands.add_subcommand(_DownloadSubcommand('download'))
         subcommands.add_subcommand(_SearchSubcommand('search'))
+        subcommands.add_subcommand(_UpdateSubcommand('update'))
         subcommands.add_subcommand(_RemoveSubcommand('remove'))
+        subcommands.add_subcommand(_OwnerSubcommand('owner'))
+        subcommands.add_subcommand(_ExportBundleSubcommand('export-bundle'))
+        subcommands.add_subcommand(_ImportBundleSubcommand('import-bundle'))
 
     def pre_execute(self, parsed_args):
         self._process_debug(parsed_args)
         self._process_config(parsed_args)
         self._process_root(parsed_args)
-        self._create_pkg_mgr(parsed_args)
+        self._process_daemon(parsed_args)
+        if parsed_args.daemon_client is None:
+            self._create_pkg_mgr(parsed_args)
 
     def _process_debug(self, parsed_args):
         if parsed_args.debug:
@@ -78,95 +186,319 @@ class _XivoFetchfwCommand(commands.AbstractCommand):
         if not parsed_args.root:
             parsed_args.root = parsed_args.config_dict['general.root_dir']
 
+    def _process_daemon(self, parsed_args):
+        parsed_args.daemon_client = None
+        if parsed_args.no_daemon or not isinstance(
+            parsed_args._subcommand, _DaemonSubcommand
+        ):
+            return
+        socket_path = parsed_args.config_dict['general.daemon_socket']
+        if daemon.is_running(socket_path):
+            logger.debug("Using daemon on '%s'", socket_path)
+            parsed_args.daemon_client = daemon.DaemonClient(
+                socket_path, parsed_args.config, parsed_args.debug
+            )
+
     def _create_pkg_mgr(self, parsed_args):
         config_dict = parsed_args.config_dict
-        proxies = params.filter_section(config_dict, 'proxy')
-        downloaders = download.new_downloaders(proxies)
-        global_vars = params.filter_section(config_dict, 'global_vars')
-        able_pkg_sto, ed_pkg_sto = storage.new_pkg_storages(
-            config_dict['general.db_dir'],
-            config_dict['general.cache_dir'],
-            downloaders,
-            global_vars,
+        parsed_args.downloaders = _new_downloaders(
+            config_dict, _new_deadline(config_dict)
         )
-        parsed_args.pkg_mgr = package.PackageManager(able_pkg_sto, ed_pkg_sto)
+        parsed_args.pkg_mgr = _new_pkg_mgr(config_dict, parsed_args.downloaders)
+
+
+def _add_scheduled_argument(parser):
+    parser.add_argument(
+        '--scheduled',
+        action='store_true',
+        help='download files only inside the configured download windows',
+    )
+
 
+class _DaemonSubcommand(commands.AbstractSubcommand):
+    # A subcommand that is executed by the daemon when it's running
 
-class _InstallSubcommand(commands.AbstractSubcommand):
+    def execute(self, parsed_args):
+        if parsed_args.daemon_client is None:
+            self.execute_locally(parsed_args)
+        else:
+            self.execute_with_daemon(parsed_args, parsed_args.daemon_client)
+
+    def execute_locally(self, parsed_args):
+        raise Exception('must be overriden in derived class')
+
+    def execute_with_daemon(self, parsed_args, daemon_client):
+        raise Exception('must be overriden in derived class')
+
+
+@contextlib.contextmanager
+def _db_lock(parsed_args):
+    # Another process may have changed the installed packages while the
+    # storages were loaded, so they are reloaded once the lock is taken
+    with daemon.db_lock(parsed_args.config_dict['general.db_dir']):
+        parsed_args.pkg_mgr.installed_pkg_sto.reload()
+        yield
+
+
+def _get_download_windows(parsed_args):
+    if not parsed_args.scheduled:
+        return None
+    raw_windows = parsed_args.config_dict['general.download_windows']
+    if not raw_windows:
+        print("error: no download windows configured", file=sys.stderr)
+        sys.exit(1)
+    return schedule.DownloadWindows(raw_windows)
+
+
+class _InstallSubcommand(_DaemonSubcommand):
     def configure_parser(self, parser):
+        _add_scheduled_argument(parser)
         parser.add_argument('packages', nargs='+', help='package(s) to install')
 
-    def execute(self, parsed_args):
+    def execute_locally(self, parsed_args):
         pkg_ids = parsed_args.packages
         pkg_mgr = parsed_args.pkg_mgr
-        for pkg_id in pkg_ids:
-            if (
-                pkg_id in pkg_mgr.installed_pkg_sto
-                and pkg_id in pkg_mgr.installable_pkg_sto
-            ):
-                installed_pkg = pkg_mgr.installed_pkg_sto[pkg_id]
-                installed_version = installed_pkg.pkg_info['version']
-                installable_version = pkg_mgr.installable_pkg_sto[pkg_id].pkg_info[
-                    'version'
-                ]
-                cmp_result = util.cmp_version(installed_version, installable_version)
-                if cmp_result == 0:
-                    print(f"warning: {installed_pkg} is up to date -- reinstalling")
-                else:
-                    print(
-                        f"error: {installed_pkg} is already installed",
-                        file=sys.stderr,
-                    )
-                    sys.exit(1)
-        ctrl_factory = cli.CliInstallerController.new_factory()
-        pkg_mgr.install(pkg_ids, parsed_args.root, ctrl_factory)
-
-
-class _UpgradeSubcommand(commands.AbstractSubcommand):
-    def execute(self, parsed_args):
+        ctrl_factory = cli.CliInstallerController.new_factory(
+            download_windows=_get_download_windows(parsed_args)
+        )
+        with _db_lock(parsed_args):
+            for installed_pkg in pkg_mgr.get_reinstalled_pkgs(pkg_ids):
+                print(f"warning: {installed_pkg} is up to date -- reinstalling")
+            pkg_mgr.install(pkg_ids, parsed_args.root, ctrl_factory)
+
+    def execute_with_daemon(self, parsed_args, daemon_client):
+        _get_download_windows(parsed_args)
+        daemon_client.call(
+            'install',
+            {
+                'packages': parsed_args.packages,
+                'root': os.path.abspath(parsed_args.root),
+                'scheduled': parsed_args.scheduled,
+            },
+        )
+
+
+class _UpgradeSubcommand(_DaemonSubcommand):
+    def configure_parser(self, parser):
+        _add_scheduled_argument(parser)
+
+    def execute_locally(self, parsed_args):
         pkg_mgr = parsed_args.pkg_mgr
-        ctrl_factory = cli.CliUpgraderController.new_factory()
-        pkg_mgr.upgrade(parsed_args.root, ctrl_factory)
+        ctrl_factory = cli.CliUpgraderController.new_factory(
+            download_windows=_get_download_windows(parsed_args)
+        )
+        with _db_lock(parsed_args):
+            pkg_mgr.upgrade(parsed_args.root, ctrl_factory)
+
+    def execute_with_daemon(self, parsed_args, daemon_client):
+        _get_download_windows(parsed_args)
+        daemon_client.call(
+            'upgrade',
+            {
+                'root': os.path.abspath(parsed_args.root),
+                'scheduled': parsed_args.scheduled,
+            },
+        )
 
 
-class _SearchSubcommand(commands.AbstractSubcommand):
+class _DownloadSubcommand(commands.AbstractSubcommand):
     def configure_parser(self, parser):
-        parser.add_argument('pattern', nargs='?', help='search pattern')
+        _add_scheduled_argument(parser)
+        parser.add_argument('packages', nargs='+', help='package(s) to download')
 
     def execute(self, parsed_args):
-        search_pattern = parsed_args.pattern
         pkg_mgr = parsed_args.pkg_mgr
-        if not search_pattern:
-            word = ''
+        installable_pkg_sto = pkg_mgr.installable_pkg_sto
+        for pkg_id in parsed_args.packages:
+            if pkg_id not in installable_pkg_sto:
+                print(f"error: could not find package '{pkg_id}'", file=sys.stderr)
+                sys.exit(1)
+        pkg_ids = set(parsed_args.packages)
+        pkg_ids.update(installable_pkg_sto.get_dependencies_many(pkg_ids))
+        remote_files = {
+            remote_file.path: remote_file
+            for pkg_id in sorted(pkg_ids)
+            for remote_file in installable_pkg_sto[pkg_id].remote_files
+        }
+        download_windows = _get_download_windows(parsed_args)
+        for remote_file in remote_files.values():
+            if remote_file.exists():
+                continue
+            print(f"Downloading {remote_file.filename}...")
+            if download_windows is None:
+                remote_file.download()
+            else:
+                schedule.download_in_windows(remote_file, download_windows)
+
+
+class _SearchSubcommand(_DaemonSubcommand):
+    def configure_parser(self, parser):
+        parser.add_argument('terms', nargs='*', help='search terms')
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument(
+            '--installed', action='store_true', help='only search installed packages'
+        )
+        group.add_argument(
+            '--upgradable',
+            action='store_true',
+            help='only search packages that can be upgraded',
+        )
+
+    def execute_locally(self, parsed_args):
+        pkg_mgr = parsed_args.pkg_mgr
+        results = search.search_pkgs(
+            pkg_mgr.installable_pkg_sto.get_search_index(),
+            pkg_mgr.installed_pkg_sto,
+            ' '.join(parsed_args.terms),
+            parsed_args.installed,
+            parsed_args.upgradable,
+        )
+        _print_search_results(results)
+
+    def execute_with_daemon(self, parsed_args, daemon_client):
+        raw_results = daemon_client.call(
+            'search',
+            {
+                'query': ' '.join(parsed_args.terms),
+                'installed': parsed_args.installed,
+                'upgradable': parsed_args.upgradable,
+            },
+        )
+        results = [
+            (
+                search.SearchResult(
+                    raw_result['id'],
+                    raw_result['version'],
+                    raw_result['description'],
+                    raw_result['score'],
+                ),
+                raw_result['installed_version'],
+            )
+            for raw_result in raw_results
+        ]
+        _print_search_results(results)
+
+
+def _print_search_results(results):
+    for result, installed_version in results:
+        if installed_version is None:
+            print(result.pkg_id, result.version)
+        elif installed_version != result.version:
+            print(result.pkg_id, result.version, f"[installed: {installed_version}]")
         else:
-            word = search_pattern.lower()
-        for installable_pkg in _sorted_itervalues(pkg_mgr.installable_pkg_sto):
-            pkg_id = installable_pkg.pkg_info['id']
-            description = installable_pkg.pkg_info['description']
-            if word in pkg_id.lower() or word in description.lower():
-                if pkg_id in pkg_mgr.installed_pkg_sto:
-                    installed_version = pkg_mgr.installed_pkg_sto[pkg_id].pkg_info[
-                        'version'
-                    ]
-                    if installed_version != installable_pkg.pkg_info['version']:
-                        print(installable_pkg, f"[installed: {installed_version}]")
-                    else:
-                        print(installable_pkg, "[installed]")
-                else:
-                    print(installable_pkg)
-                print('   ', installable_pkg.pkg_info['description'])
-
-
-def _sorted_itervalues(dict_):
-    return list(map(itemgetter(1), sorted(dict_.items(), key=itemgetter(0))))
-
-
-class _RemoveSubcommand(commands.AbstractSubcommand):
+            print(result.pkg_id, result.version, "[installed]")
+        print('   ', result.description)
+
+
+class _UpdateSubcommand(commands.AbstractSubcommand):
+    def execute(self, parsed_args):
+        config_dict = parsed_args.config_dict
+        urls = config_dict['general.catalog_repositories']
+        installable_db_dir = os.path.join(config_dict['general.db_dir'], 'installable')
+        # without repositories, a sync is still done if some have been
+        # removed, so that their catalog files are removed
+        if not urls and not os.path.exists(
+            os.path.join(installable_db_dir, sync.STATE_FILENAME)
+        ):
+            print("error: no catalog repositories configured", file=sys.stderr)
+            sys.exit(1)
+        with _db_lock(parsed_args):
+            updated, removed = sync.sync_catalog(
+                urls,
+                installable_db_dir,
+                parsed_args.downloaders['default'],
+                config_dict['general.catalog_keyring'] or None,
+            )
+        if not updated and not removed:
+            print("Catalog is up to date")
+        for filename in updated:
+            print("Updated", filename)
+        for filename in removed:
+            print("Removed", filename)
+
+
+class _RemoveSubcommand(_DaemonSubcommand):
     def configure_parser(self, parser):
         parser.add_argument('packages', nargs='+', help='package(s) to remove')
 
-    def execute(self, parsed_args):
+    def execute_locally(self, parsed_args):
         pkg_ids = parsed_args.packages
         pkg_mgr = parsed_args.pkg_mgr
         ctrl_factory = cli.CliUninstallerController.new_factory(recursive=True)
-        pkg_mgr.uninstall(pkg_ids, parsed_args.root, ctrl_factory)
+        with _db_lock(parsed_args):
+            pkg_mgr.uninstall(pkg_ids, parsed_args.root, ctrl_factory)
+
+    def execute_with_daemon(self, parsed_args, daemon_client):
+        daemon_client.call(
+            'uninstall',
+            {
+                'packages': parsed_args.packages,
+                'root': os.path.abspath(parsed_args.root),
+            },
+        )
+
+
+class _OwnerSubcommand(commands.AbstractSubcommand):
+    def configure_parser(self, parser):
+        parser.add_argument('path', help='path of an installed file or directory')
+
+    def execute(self, parsed_args):
+        pkg_mgr = parsed_args.pkg_mgr
+        root_dir = os.path.abspath(parsed_args.root)
+        abs_path = os.path.abspath(parsed_args.path)
+        path = os.path.relpath(abs_path, root_dir)
+        if path.startswith(os.pardir):
+            print(f"error: {abs_path} is not in {root_dir}", file=sys.stderr)
+            sys.exit(1)
+        installed_pkg_sto = pkg_mgr.installed_pkg_sto
+        owners = installed_pkg_sto.get_owners(path)
+        owners.update(installed_pkg_sto.get_owners(path + '/'))
+        if not owners:
+            print(f"error: no package owns {abs_path}", file=sys.stderr)
+            sys.exit(1)
+        for pkg_id in sorted(owners):
+            print(f"{abs_path} is owned by {installed_pkg_sto[pkg_id]}")
+
+
+class _ExportBundleSubcommand(commands.AbstractSubcommand):
+    def configure_parser(self, parser):
+        parser.add_argument(
+            '-o', '--output', required=True, help='filename of the bundle to create'
+        )
+        parser.add_argument('packages', nargs='+', help='package(s) to export')
+
+    def execute(self, parsed_args):
+        pkg_mgr = parsed_args.pkg_mgr
+        for pkg_id in parsed_args.packages:
+            if pkg_id not in pkg_mgr.installable_pkg_sto:
+                print(f"error: could not find package '{pkg_id}'", file=sys.stderr)
+                sys.exit(1)
+        pkg_ids = bundle.export_bundle(
+            parsed_args.output,
+            parsed_args.packages,
+            pkg_mgr.installable_pkg_sto,
+            parsed_args.config_dict['general.cache_dir'],
+        )
+        print(f"Exported ({len(pkg_ids)}):")
+        for pkg_id in pkg_ids:
+            print("    ", pkg_mgr.installable_pkg_sto[pkg_id])
+
+
+class _ImportBundleSubcommand(commands.AbstractSubcommand):
+    def configure_parser(self, parser):
+        parser.add_argument('bundle', help='filename of the bundle to import')
+
+    def execute(self, parsed_args):
+        config_dict = parsed_args.config_dict
+        cache_dir = config_dict['general.cache_dir']
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with _db_lock(parsed_args):
+            pkg_ids = bundle.import_bundle(
+                parsed_args.bundle,
+                os.path.join(config_dict['general.db_dir'], 'installable'),
+                cache_dir,
+            )
+        print(f"Imported ({len(pkg_ids)}):")
+        for pkg_id in pkg_ids:
+            print("    ", pkg_id)
@@ -0,0 +1,146 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Compact file manifests of installed packages.
+
+A manifest is the list of paths installed by a package. It's stored sorted
+and front-coded, i.e. each path is stored as the length of the prefix it
+shares with the previous path followed by the rest of the path, which is
+compact since successive paths of a package usually share long prefixes.
+
+"""
+
+import collections.abc
+import logging
+import os
+
+from xivo_fetchfw.util import FetchfwError
+
+logger = logging.getLogger(__name__)
+
+
+class ManifestError(FetchfwError):
+    pass
+
+
+_MAGIC = b'FFWMAN1\n'
+
+
+def _encode_varint(value, output):
+    while value >= 0x80:
+        output.append((value & 0x7F) | 0x80)
+        value >>= 7
+    output.append(value)
+
+
+def _decode_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        try:
+            byte = data[pos]
+        except IndexError:
+            raise ManifestError('truncated manifest')
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode_manifest(paths):
+    """Return the bytes of the manifest of the given paths."""
+    output = bytearray(_MAGIC)
+    encoded_paths = sorted({path.encode('utf-8') for path in paths})
+    _encode_varint(len(encoded_paths), output)
+    previous = b''
+    for encoded_path in encoded_paths:
+        prefix_len = 0
+        max_prefix_len = min(len(previous), len(encoded_path))
+        while (
+            prefix_len < max_prefix_len
+            and previous[prefix_len] == encoded_path[prefix_len]
+        ):
+            prefix_len += 1
+        suffix = encoded_path[prefix_len:]
+        _encode_varint(prefix_len, output)
+        _encode_varint(len(suffix), output)
+        output += suffix
+        previous = encoded_path
+    return bytes(output)
+
+
+def decode_manifest(data):
+    """Return the sorted list of paths of a manifest."""
+    if not data.startswith(_MAGIC):
+        raise ManifestError('invalid manifest header')
+    count, pos = _decode_varint(data, len(_MAGIC))
+    paths = []
+    previous = b''
+    for _ in range(count):
+        prefix_len, pos = _decode_varint(data, pos)
+        suffix_len, pos = _decode_varint(data, pos)
+        if prefix_len > len(previous) or pos + suffix_len > len(data):
+            raise ManifestError('corrupted manifest')
+        encoded_path = previous[:prefix_len] + data[pos : pos + suffix_len]
+        pos += suffix_len
+        paths.append(encoded_path.decode('utf-8'))
+        previous = encoded_path
+    return paths
+
+
+def read_manifest(filename):
+    with open(filename, 'rb') as fobj:
+        return decode_manifest(fobj.read())
+
+
+def write_manifest(filename, paths, fsync=False):
+    # The manifest is written in a temporary file and then renamed, so that
+    # the manifest is either the old one or the new one after a crash. If
+    # fsync is true, the temporary file is fsynced before being renamed.
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as fobj:
+        fobj.write(encode_manifest(paths))
+        if fsync:
+            fobj.flush()
+            os.fsync(fobj.fileno())
+    os.replace(tmp_filename, filename)
+
+
+class LazyManifest(collections.abc.Sequence):
+    """A sequence of paths that are only loaded, by calling load_fun, on
+    first access.
+
+    """
+
+    def __init__(self, load_fun):
+        self._load_fun = load_fun
+        self._paths = None
+
+    @property
+    def loaded(self):
+        return self._paths is not None
+
+    def _get_paths(self):
+        if self._paths is None:
+            self._paths = self._load_fun()
+        return self._paths
+
+    def __getitem__(self, index):
+        return self._get_paths()[index]
+
+    def __len__(self):
+        return len(self._get_paths())
+
+    def __iter__(self):
+        return iter(self._get_paths())
+
+    def __eq__(self, other):
+        if isinstance(other, collections.abc.Sequence):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        if self._paths is None:
+            return '<LazyManifest (not loaded)>'
+        return f'<LazyManifest {self._paths!r}>'
@@ -1,10 +1,18 @@
-# Copyright 2010-2023 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2010-2026 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import copy
 import logging
 
-from xivo_fetchfw.util import FetchfwError, cmp_version, install_paths, remove_paths
+from xivo_fetchfw import fastcopy
+from xivo_fetchfw.schedule import download_in_windows
+from xivo_fetchfw.util import (
+    FetchfwError,
+    cmp_version,
+    install_paths,
+    list_paths,
+    remove_paths,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +35,8 @@ def _add_pkg_info_defaults(pkg_info):
 
 
 class InstallablePackage:
+    __slots__ = ('pkg_info', 'remote_files', 'install_mgr')
+
     _MANDATORY_KEYS = _COMMON_MANDATORY_KEYS
 
     def __init__(self, pkg_info, remote_files, install_mgr):
@@ -76,6 +86,8 @@ class InstallablePackage:
 
 
 class InstalledPackage:
+    __slots__ = ('pkg_info',)
+
     _MANDATORY_KEYS = _COMMON_MANDATORY_KEYS + ['files', 'explicit_install']
 
     def __init__(self, pkg_info):
@@ -97,13 +109,31 @@ class InstalledPackage:
         return f"{self.pkg_info['id']} {self.pkg_info['version']}"
 
 
+class FileConflictError(PackageError):
+    def __init__(self, pkg_id, conflicts):
+        self.pkg_id = pkg_id
+        self.conflicts = conflicts
+        path, owners = sorted(conflicts.items())[0]
+        msg = (
+            f"{len(conflicts)} file(s) of pkg {pkg_id} already owned by other "
+            f"packages, e.g. '{path}' owned by {', '.join(sorted(owners))}"
+        )
+        PackageError.__init__(self, msg)
+
+
 class PackageManager:
-    def __init__(self, installable_pkg_sto, installed_pkg_sto):
+    def __init__(self, installable_pkg_sto, installed_pkg_sto, install_workers=1):
+        # install_workers -- the maximum number of nodes of the installation
+        #   graph of a package executed in parallel
         self.installable_pkg_sto = installable_pkg_sto
         self.installed_pkg_sto = installed_pkg_sto
+        self._install_workers = install_workers
 
-    def _remove_installed_paths(self, installed_paths, root_dir):
+    def _remove_installed_paths(self, installed_paths, root_dir, pkg_id):
         # This method never raise an error
+        installed_paths = self.installed_pkg_sto.get_exclusive_paths(
+            pkg_id, installed_paths
+        )
         removed_paths = []
         try:
             # this rely on the fact that remove_paths is a generator
@@ -122,12 +152,21 @@ class PackageManager:
             )
 
     def _install_pkg_from_install_mgr(self, install_mgr, root_dir, pkg_id):
-        install_process = install_mgr.new_installation_process()
+        copied_bytes = fastcopy.stats.copied_bytes
+        linked_bytes = fastcopy.stats.linked_bytes
+        install_process = install_mgr.new_installation_process(
+            max_workers=self._install_workers
+        )
         result_dir = install_process.execute()
 
         installed_paths = []
         # this rely on the fact that install_paths is a generator (see doc)
         try:
+            conflicts = self.installed_pkg_sto.get_conflicts(
+                pkg_id, list_paths(result_dir)
+            )
+            if conflicts:
+                raise FileConflictError(pkg_id, conflicts)
             for installed_path in install_paths(result_dir, root_dir):
                 installed_paths.append(installed_path)
         except Exception as e:
@@ -138,8 +177,14 @@ class PackageManager:
             try:
                 raise
             finally:
-                self._remove_installed_paths(installed_paths, root_dir)
+                self._remove_installed_paths(installed_paths, root_dir, pkg_id)
         else:
+            logger.debug(
+                'Installed pkg %s: %d bytes copied, %d bytes linked',
+                pkg_id,
+                fastcopy.stats.copied_bytes - copied_bytes,
+                fastcopy.stats.linked_bytes - linked_bytes,
+            )
             return installed_paths
         finally:
             install_process.cleanup()
@@ -168,10 +213,31 @@ class PackageManager:
             try:
                 raise
             finally:
-                self._remove_installed_paths(files, root_dir)
+                self._remove_installed_paths(files, root_dir, pkg_id)
         else:
             return installed_pkg
 
+    def get_reinstalled_pkgs(self, pkg_ids):
+        """Return the list of installed packages that would be reinstalled
+        by installing pkg_ids, i.e. those that are up to date.
+
+        Raise a PackageError if one of the packages is installed in another
+        version than the installable one.
+
+        """
+        reinstalled_pkgs = []
+        for pkg_id in pkg_ids:
+            if pkg_id in self.installed_pkg_sto and pkg_id in self.installable_pkg_sto:
+                installed_pkg = self.installed_pkg_sto[pkg_id]
+                installed_version = installed_pkg.pkg_info['version']
+                installable_version = self.installable_pkg_sto[pkg_id].pkg_info[
+                    'version'
+                ]
+                if cmp_version(installed_version, installable_version):
+                    raise PackageError(f"{installed_pkg} is already installed")
+                reinstalled_pkgs.append(installed_pkg)
+        return reinstalled_pkgs
+
     def install(self, raw_pkg_ids, root_dir, installer_ctrl_factory):
         # 1. do some preparation
         installable_pkg_sto = self.installable_pkg_sto
@@ -209,10 +275,7 @@ class PackageManager:
 
             # 4. install package
             installer_ctrl.pre_install(pkgs)
-            for pkg in pkgs:
-                installer_ctrl.pre_install_pkg(pkg)
-                self._install_pkg(pkg, root_dir)
-                installer_ctrl.post_install_pkg(pkg)
+            self._install_pkgs(pkgs, root_dir, installer_ctrl)
             installer_ctrl.post_install(pkgs)
         except Exception as e:
             # preserve stack trace
@@ -228,10 +291,44 @@ class PackageManager:
         else:
             installer_ctrl.post_installation(None)
 
+    def _install_pkgs(self, pkgs, root_dir, installer_ctrl):
+        # Install the packages in a single transaction. If the installation
+        # of a package fails, the files of the packages that were not
+        # already installed are removed and the transaction is rolled back
+        installed_pkg_sto = self.installed_pkg_sto
+        new_installed_pkgs = []
+        installed_pkg_sto.begin()
+        try:
+            for pkg in pkgs:
+                installer_ctrl.pre_install_pkg(pkg)
+                pkg_id = pkg.pkg_info['id']
+                already_installed = pkg_id in installed_pkg_sto
+                installed_pkg = self._install_pkg(pkg, root_dir)
+                if not already_installed:
+                    new_installed_pkgs.append(installed_pkg)
+                installer_ctrl.post_install_pkg(pkg)
+        except Exception:
+            try:
+                raise
+            finally:
+                installed_pkg_sto.rollback()
+                for installed_pkg in reversed(new_installed_pkgs):
+                    self._remove_installed_paths(
+                        installed_pkg.pkg_info['files'],
+                        root_dir,
+                        installed_pkg.pkg_info['id'],
+                    )
+        else:
+            installed_pkg_sto.commit()
+
     def _uninstall_pkg(self, installed_pkg, root_dir):
         # uninstall the installed pkg and update the installed pkg sto
         pkg_id = installed_pkg.pkg_info['id']
-        installed_paths = installed_pkg.pkg_info['files']
+        # paths also owned by other packages, like shared directories, are
+        # left in place
+        installed_paths = self.installed_pkg_sto.get_exclusive_paths(
+            pkg_id, installed_pkg.pkg_info['files']
+        )
 
         removed_paths = []
         try:
@@ -283,10 +380,16 @@ class PackageManager:
 
             # 3. uninstall package
             uninstaller_ctrl.pre_uninstall(pkgs)
-            for pkg in pkgs:
-                uninstaller_ctrl.pre_uninstall_pkg(pkg)
-                self._uninstall_pkg(pkg, root_dir)
-                uninstaller_ctrl.post_uninstall_pkg(pkg)
+            # since removed files can't be restored, the packages that have
+            # been uninstalled are committed even if an error occurs
+            installed_pkg_sto.begin()
+            try:
+                for pkg in pkgs:
+                    uninstaller_ctrl.pre_uninstall_pkg(pkg)
+                    self._uninstall_pkg(pkg, root_dir)
+                    uninstaller_ctrl.post_uninstall_pkg(pkg)
+            finally:
+                installed_pkg_sto.commit()
             uninstaller_ctrl.post_uninstall(pkgs)
         except Exception as e:
             # preserve stack trace
@@ -354,32 +457,38 @@ class PackageManager:
             # 3. download remote files
             upgrader_ctrl.pre_download(remote_files)
             for remote_file in remote_files:
-                upgrader_ctrl.download(remote_file)
+                upgrader_ctrl.download_file(remote_file)
             upgrader_ctrl.post_download(remote_files)
 
             # 4. upgrade packages
             upgrader_ctrl.pre_upgrade(upgrade_specs)
-            for (
-                installed_pkg,
-                installable_pkg,
-                install_list,
-                uninstall_list,
-            ) in upgrade_specs:
-                # 4.1 first uninstall pkg from the list
-                for cur_installed_pkg in uninstall_list:
-                    upgrader_ctrl.pre_upgrade_uninstall_pkg(cur_installed_pkg)
-                    self._uninstall_pkg(cur_installed_pkg, root_dir)
-                    upgrader_ctrl.post_upgrade_uninstall_pkg(cur_installed_pkg)
-                # 4.2 then install pkg from the list
-                for cur_installable_pkg in install_list:
-                    upgrader_ctrl.pre_upgrade_install_pkg(cur_installable_pkg)
-                    self._install_pkg(pkg, root_dir)
-                    upgrader_ctrl.post_upgrade_install_pkg(cur_installable_pkg)
-                # 4.3 then "upgrade" installed pkg, i.e. uninstall and install
-                upgrader_ctrl.pre_upgrade_pkg(installed_pkg)
-                self._uninstall_pkg(installed_pkg, root_dir)
-                self._install_pkg(installable_pkg, root_dir)
-                upgrader_ctrl.post_upgrade_pkg(installed_pkg)
+            # since removed files can't be restored, the packages that have
+            # been upgraded are committed even if an error occurs
+            installed_pkg_sto.begin()
+            try:
+                for (
+                    installed_pkg,
+                    installable_pkg,
+                    install_list,
+                    uninstall_list,
+                ) in upgrade_specs:
+                    # 4.1 first uninstall pkg from the list
+                    for cur_installed_pkg in uninstall_list:
+                        upgrader_ctrl.pre_upgrade_uninstall_pkg(cur_installed_pkg)
+                        self._uninstall_pkg(cur_installed_pkg, root_dir)
+                        upgrader_ctrl.post_upgrade_uninstall_pkg(cur_installed_pkg)
+                    # 4.2 then install pkg from the list
+                    for cur_installable_pkg in install_list:
+                        upgrader_ctrl.pre_upgrade_install_pkg(cur_installable_pkg)
+                        self._install_pkg(cur_installable_pkg, root_dir)
+                        upgrader_ctrl.post_upgrade_install_pkg(cur_installable_pkg)
+                    # 4.3 then "upgrade" installed pkg, i.e. uninstall and install
+                    upgrader_ctrl.pre_upgrade_pkg(installed_pkg)
+                    self._uninstall_pkg(installed_pkg, root_dir)
+                    self._install_pkg(installable_pkg, root_dir)
+                    upgrader_ctrl.post_upgrade_pkg(installed_pkg)
+            finally:
+                installed_pkg_sto.commit()
             upgrader_ctrl.post_upgrade(upgrade_specs)
         except Exception as e:
             # preserve stack trace
@@ -499,10 +608,26 @@ class InstallerController:
 
 
 class DefaultInstallerController(InstallerController):
-    def __init__(self, installable_pkg_sto, installed_pkg_sto, nodeps=False):
+    def __init__(
+        self,
+        installable_pkg_sto,
+        installed_pkg_sto,
+        nodeps=False,
+        download_windows=None,
+    ):
         self._installable_pkg_sto = installable_pkg_sto
         self._installed_pkg_sto = installed_pkg_sto
         self._nodeps = nodeps
+        self._download_windows = download_windows
+
+    def download_file(self, remote_file, supp_hooks=[]):
+        """Called to download the next file.
+
+        If download windows were given, the file is only downloaded inside
+        these windows.
+
+        """
+        _download_file(remote_file, self._download_windows, supp_hooks)
 
     def preprocess_raw_pkg_ids(self, raw_pkg_ids):
         # check that all package are installable and raise our own
@@ -536,6 +661,13 @@ class DefaultInstallerController(InstallerController):
         return installable_pkgs
 
 
+def _download_file(remote_file, download_windows, supp_hooks, **kwargs):
+    if download_windows is None:
+        remote_file.download(supp_hooks, **kwargs)
+    else:
+        download_in_windows(remote_file, download_windows, supp_hooks, **kwargs)
+
+
 class UninstallerController:
     def __init__(self, installable_pkg_sto, installed_pkg_sto):
         pass
@@ -662,7 +794,13 @@ class UpgraderController:
         pass
 
     def download_file(self, remote_file):
-        remote_file.download()
+        """Called to download the next file.
+
+        Delta patches are used when possible since the previous version of
+        the file is often still in the cache.
+
+        """
+        remote_file.download(use_deltas=True)
 
     def post_download(self, remote_files):
         pass
@@ -705,12 +843,27 @@ class UpgraderController:
 
 class DefaultUpgraderController(UpgraderController):
     def __init__(
-        self, installable_pkg_sto, installed_pkg_sto, ignore=None, nodeps=False
+        self,
+        installable_pkg_sto,
+        installed_pkg_sto,
+        ignore=None,
+        nodeps=False,
+        download_windows=None,
     ):
         self._installable_pkg_sto = installable_pkg_sto
         self._installed_pkg_sto = installed_pkg_sto
         self._ignore = [] if ignore is None else ignore
         self._nodeps = nodeps
+        self._download_windows = download_windows
+
+    def download_file(self, remote_file, supp_hooks=[]):
+        """Called to download the next file.
+
+        Delta patches are used when possible. If download windows were
+        given, the file is only downloaded inside these windows.
+
+        """
+        _download_file(remote_file, self._download_windows, supp_hooks, use_deltas=True)
 
     def _upgrade_list_filter_function(self, pkgs):
         # Return true if installed_pkg is not in the ignore list and if
@@ -0,0 +1,131 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Download windows, to restrict downloads to off-peak hours.
+
+Downloads done inside windows are paused when a window closes and resumed,
+from where they stopped, when the next window opens.
+
+"""
+
+import datetime
+import logging
+import re
+import time
+
+from xivo_fetchfw.download import DownloadHook, DownloadPausedError
+from xivo_fetchfw.util import FetchfwError
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduleError(FetchfwError):
+    pass
+
+
+_WINDOW_REGEX = re.compile(r'^(\d\d):(\d\d)-(\d\d):(\d\d)$')
+_MINUTES_PER_DAY = 24 * 60
+
+
+def _parse_window(raw_window):
+    m = _WINDOW_REGEX.match(raw_window)
+    if not m:
+        raise ScheduleError(f"invalid download window: {raw_window}")
+    start_hour, start_minute, end_hour, end_minute = map(int, m.groups())
+    if start_hour > 23 or end_hour > 24 or start_minute > 59 or end_minute > 59:
+        raise ScheduleError(f"invalid download window: {raw_window}")
+    start = start_hour * 60 + start_minute
+    end = end_hour * 60 + end_minute
+    if end > _MINUTES_PER_DAY or start == end:
+        raise ScheduleError(f"invalid download window: {raw_window}")
+    return start, end
+
+
+class DownloadWindows:
+    """A set of daily time windows, in local time.
+
+    Windows are given as a string of whitespace separated "HH:MM-HH:MM"
+    items, for example "00:00-06:30 22:00-24:00". A window whose end is
+    before its start spans midnight, i.e. "22:00-06:30" is also valid.
+
+    """
+
+    def __init__(self, raw_windows, now_fun=datetime.datetime.now):
+        self._windows = []
+        for raw_window in raw_windows.split():
+            start, end = _parse_window(raw_window)
+            if end < start:
+                self._windows.append((start, _MINUTES_PER_DAY))
+                self._windows.append((0, end))
+            else:
+                self._windows.append((start, end))
+        if not self._windows:
+            raise ScheduleError('no download window')
+        self._now_fun = now_fun
+
+    def _seconds_of_day(self):
+        now = self._now_fun()
+        return now.hour * 3600 + now.minute * 60 + now.second + now.microsecond / 1e6
+
+    def is_open(self):
+        seconds = self._seconds_of_day()
+        return any(start * 60 <= seconds < end * 60 for start, end in self._windows)
+
+    def seconds_until_open(self):
+        """Return the number of seconds until the next window opens, or 0 if
+        a window is currently open.
+
+        """
+        if self.is_open():
+            return 0
+        seconds = self._seconds_of_day()
+        return min(
+            (start * 60 - seconds) % (_MINUTES_PER_DAY * 60)
+            for start, _ in self._windows
+        )
+
+    def wait_until_open(self, sleep_fun=time.sleep):
+        delay = self.seconds_until_open()
+        if delay:
+            logger.info('Waiting %d seconds for the next download window', delay)
+            sleep_fun(delay)
+
+
+class DownloadWindowHook(DownloadHook):
+    """Pause the download when the download windows are closed."""
+
+    def __init__(self, windows):
+        super().__init__()
+        self._windows = windows
+
+    def start(self):
+        self._check_open()
+
+    def update(self, arg):
+        self._check_open()
+
+    def _check_open(self):
+        if not self._windows.is_open():
+            raise DownloadPausedError('download window is closed')
+
+
+def download_in_windows(
+    remote_file, windows, supp_hooks=[], sleep_fun=time.sleep, **kwargs
+):
+    """Download the remote file inside the download windows.
+
+    The download is paused when the current window closes and resumed from
+    where it stopped when the next one opens. Other keyword arguments are
+    passed to the remote file download method.
+
+    """
+    while True:
+        windows.wait_until_open(sleep_fun)
+        try:
+            remote_file.download(
+                [DownloadWindowHook(windows)] + list(supp_hooks), **kwargs
+            )
+        except DownloadPausedError:
+            logger.info('Download of %s paused', remote_file.filename)
+        else:
+            return
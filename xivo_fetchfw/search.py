@@ -0,0 +1,213 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Search index of the installable packages.
+
+The index is a trigram index over the IDs, descriptions and localized
+descriptions of the packages, so that a query term only needs to be checked
+against the packages having all the trigrams of the term. It's built from
+the catalog sections, without building any package object, and saved in the
+catalog directory, where it's reused as long as the catalog files don't
+change.
+
+"""
+
+import collections
+import logging
+import os
+import re
+
+from xivo_fetchfw import catalog
+from xivo_fetchfw.util import cmp_version
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = '.search.index'
+_INDEX_MAGIC = b'FFWIDX'
+_INDEX_VERSION = 1
+_WORD_REGEX = re.compile(r'\w+')
+
+# score of a query term depending on where it matches, best match first
+_SCORE_ID = 100
+_SCORE_ID_PREFIX = 50
+_SCORE_IN_ID = 20
+_SCORE_DESCRIPTION_WORD = 10
+_SCORE_IN_DESCRIPTION = 5
+
+
+SearchResult = collections.namedtuple(
+    'SearchResult', ['pkg_id', 'version', 'description', 'score']
+)
+
+
+def _trigrams(text):
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    def __init__(self, docs, trigrams):
+        # docs -- a list of (pkg id, version, description, folded pkg id,
+        #   folded descriptions, folded description words) where folded
+        #   descriptions is the default and localized descriptions joined by
+        #   newlines and folded description words is a string of the words of
+        #   the descriptions surrounded by spaces
+        # trigrams -- a dictionary where keys are trigrams and values are
+        #   the list of the indexes of the docs having this trigram
+        self._docs = docs
+        self._trigrams = trigrams
+
+    @classmethod
+    def build(cls, config):
+        """Return a new search index of the pkg sections of config, a
+        RawConfigParser or catalog.CatalogConfig object.
+
+        """
+        docs = []
+        trigrams = collections.defaultdict(list)
+        for section in sorted(config.sections()):
+            if not section.startswith('pkg_'):
+                continue
+            pkg_id = section[4:]
+            options = dict(config.items(section))
+            description = options.get('description', '')
+            descriptions = [description]
+            descriptions.extend(
+                value
+                for option, value in sorted(options.items())
+                if option.startswith('description_')
+            )
+            folded_id = pkg_id.casefold()
+            folded_descriptions = '\n'.join(descriptions).casefold()
+            words = ' '.join(_WORD_REGEX.findall(folded_descriptions))
+            doc_index = len(docs)
+            docs.append(
+                (
+                    pkg_id,
+                    options.get('version', ''),
+                    description,
+                    folded_id,
+                    folded_descriptions,
+                    f' {words} ',
+                )
+            )
+            for trigram in _trigrams(folded_id) | _trigrams(folded_descriptions):
+                trigrams[trigram].append(doc_index)
+        return cls(docs, dict(trigrams))
+
+    def _candidates(self, term):
+        # Return the set of indexes of the docs that might match term, or
+        # None if every doc might match
+        if len(term) < 3:
+            return None
+        postings = []
+        for trigram in _trigrams(term):
+            posting = self._trigrams.get(trigram)
+            if posting is None:
+                return set()
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+        return candidates
+
+    def _score(self, doc, term):
+        folded_id, folded_descriptions, words = doc[3:]
+        if term == folded_id:
+            return _SCORE_ID
+        if folded_id.startswith(term):
+            return _SCORE_ID_PREFIX
+        if term in folded_id:
+            return _SCORE_IN_ID
+        if f' {term} ' in words:
+            return _SCORE_DESCRIPTION_WORD
+        if term in folded_descriptions:
+            return _SCORE_IN_DESCRIPTION
+        return 0
+
+    def search(self, query, filter_fun=None):
+        """Return the list of SearchResult of the packages matching every
+        term of query, best match first.
+
+        filter_fun -- a function taking a package ID and version and returning
+          true if the package is to be included in the results
+
+        """
+        terms = query.casefold().split()
+        candidates = None
+        for term in terms:
+            term_candidates = self._candidates(term)
+            if term_candidates is None:
+                continue
+            if candidates is None:
+                candidates = term_candidates
+            else:
+                candidates.intersection_update(term_candidates)
+        if candidates is None:
+            candidates = range(len(self._docs))
+
+        results = []
+        for doc_index in candidates:
+            doc = self._docs[doc_index]
+            if filter_fun is not None and not filter_fun(doc[0], doc[1]):
+                continue
+            score = 0
+            for term in terms:
+                term_score = self._score(doc, term)
+                if not term_score:
+                    break
+                score += term_score
+            else:
+                results.append(SearchResult(doc[0], doc[1], doc[2], score))
+        results.sort(key=lambda result: (-result.score, result.pkg_id))
+        return results
+
+
+def load_search_index(db_dir, catalog_, index_filename=INDEX_FILENAME):
+    """Return the search index of the catalog catalog_ of db_dir.
+
+    The index saved in db_dir is used if it's up to date with the catalog,
+    else a new index is built and saved.
+
+    """
+    index_path = os.path.join(db_dir, index_filename)
+    key = catalog_.key()
+    value = catalog.read_snapshot_file(index_path, _INDEX_MAGIC, _INDEX_VERSION)
+    if value is not None and value[0] == key:
+        return SearchIndex(value[1], value[2])
+    logger.debug("Building search index '%s'", index_path)
+    index = SearchIndex.build(catalog_.config)
+    catalog.write_snapshot_file(
+        index_path, _INDEX_MAGIC, _INDEX_VERSION, (key, index._docs, index._trigrams)
+    )
+    return index
+
+
+def search_pkgs(
+    search_index, installed_pkg_sto, query, installed=False, upgradable=False
+):
+    """Search the packages matching query and return a list of tuples
+    (SearchResult, installed version or None).
+
+    installed -- if true, only return the installed packages
+    upgradable -- if true, only return the installed packages that can be
+      upgraded
+
+    """
+
+    def filter_fun(pkg_id, version):
+        if pkg_id not in installed_pkg_sto:
+            return not (installed or upgradable)
+        if upgradable:
+            installed_version = installed_pkg_sto[pkg_id].pkg_info['version']
+            return cmp_version(version, installed_version) > 0
+        return True
+
+    results = []
+    for result in search_index.search(query, filter_fun):
+        if result.pkg_id in installed_pkg_sto:
+            installed_version = installed_pkg_sto[result.pkg_id].pkg_info['version']
+        else:
+            installed_version = None
+        results.append((result, installed_version))
+    return results
@@ -1,14 +1,19 @@
-# Copyright 2010-2023 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2010-2026 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import collections
+import collections.abc
+import contextlib
+import functools
 import json
 import logging
 import os
+import re
+import sqlite3
+import sys
 from binascii import a2b_hex
-from configparser import RawConfigParser
 
-from xivo_fetchfw import download, install, util
+from xivo_fetchfw import catalog, download, install, manifest, search, util
 from xivo_fetchfw.package import InstallablePackage, InstalledPackage
 
 logger = logging.getLogger(__name__)
@@ -23,27 +28,46 @@ class ParsingError(StorageError):
 
 
 class DefaultRemoteFileBuilder:
-    """A remote file builder takes a config object (RawConfigParser) and a
-    file section and builds a remote file (RemoteFile) from it.
+    """A remote file builder takes a config object (RawConfigParser or
+    catalog.CatalogConfig) and a file section and builds a remote file
+    (RemoteFile) from it.
 
     Here's an example section:
 
     [some_section_name]
     filename: foo.gz    ; optional
-    url: http://example.org/foo.gz
+    url: http://example.org/foo.gz http://mirror.example.org/foo.gz
     size: 29252
     sha1sum: 56c59081b1bd29c97f352b62c9667c409ca99f69
     downloader: default      ; optional
+    deltas: foo-1.0.gz 0f4c7e1c5bf39d4a9d1d7a3c1b3c0f7c15b4aa19
+            http://example.org/foo-1.0-1.1.bsdiff
+            20e6d2a3c7b86e8d2c97f0d29a1a2c3f2bbd2e31
+
+    The url option can contain more than one URL, in which case the
+    following URLs are mirrors that are tried in order if the download from
+    the first one fails. The filename defaults to the basename of the first
+    URL.
+
+    The optional deltas option is a list of binary delta patches, each one being
+    described by 4 whitespace separated tokens: the filename of the previous
+    version of the file in the cache directory, its sha1sum, the URL of the
+    patch and the sha1sum of the patch. Many patches can be given, one after
+    the other.
 
     """
 
-    def __init__(self, cache_dir, downloaders):
+    def __init__(self, cache_dir, downloaders, retries=0, pipelined=False):
         """Initialize a new remote file builder.
 
         cache_dir -- the directory where downloaded files are going to be
           saved
         downloaders -- a dictionary where keys are strings and values are
           downloaders (see fetchfw.download).
+        retries -- the number of times a failed download is retried on each
+          URL of a remote file
+        pipelined -- true if the remote files must be downloaded in
+          pipelined mode (see download.BaseRemoteFile)
 
         When a remote file is built, if no downloader is specified in the
         section, the builder will look for the key 'default' in the
@@ -52,16 +76,32 @@ class DefaultRemoteFileBuilder:
         """
         self._cache_dir = cache_dir
         self._downloaders = downloaders
+        self._retries = retries
+        self._pipelined = pipelined
 
-    def build_remote_file(self, config, section):
-        url = config.get(section, 'url')
-        size = config.getint(section, 'size')
-        sha1sum = a2b_hex(config.get(section, 'sha1sum'))
+    def _get_urls(self, config, section):
+        urls = config.get(section, 'url').split()
+        if not urls:
+            raise ParsingError(f"empty url in file definition '{section}'")
+        return urls
+
+    def get_remote_file_path(self, config, section):
+        """Return the path of the remote file of the section, without
+        building the remote file.
+
+        """
         if config.has_option(section, 'filename'):
             filename = config.get(section, 'filename')
         else:
-            filename = os.path.basename(url)
-        path = os.path.join(self._cache_dir, filename)
+            filename = os.path.basename(self._get_urls(config, section)[0])
+        return os.path.join(self._cache_dir, filename)
+
+    def build_remote_file(self, config, section):
+        urls = self._get_urls(config, section)
+        url = urls[0]
+        size = config.getint(section, 'size')
+        sha1sum = a2b_hex(config.get(section, 'sha1sum'))
+        path = self.get_remote_file_path(config, section)
         if config.has_option(section, 'downloader'):
             downloader_name = config.get(section, 'downloader')
         else:
@@ -73,10 +113,47 @@ class DefaultRemoteFileBuilder:
                 f"'{downloader_name}' is not a valid downloader "
                 f"name in file definition '{section}'"
             )
+        if config.has_option(section, 'deltas'):
+            deltas = self._build_deltas(
+                config.get(section, 'deltas'), section, downloader
+            )
+        else:
+            deltas = None
         return download.RemoteFile.new_remote_file(
-            path, size, url, downloader, [download.SHA1Hook.create_factory(sha1sum)]
+            path,
+            size,
+            url,
+            downloader,
+            [download.SHA1Hook.create_factory(sha1sum)],
+            deltas,
+            urls[1:],
+            self._retries,
+            self._pipelined,
         )
 
+    def _build_deltas(self, raw_value, section, downloader):
+        tokens = raw_value.split()
+        if len(tokens) % 4:
+            raise ParsingError(f"invalid deltas value in file definition '{section}'")
+        deltas = []
+        for i in range(0, len(tokens), 4):
+            base_filename, base_sha1sum, url, sha1sum = tokens[i : i + 4]
+            if os.sep in base_filename:
+                raise ParsingError(
+                    f"invalid delta base filename '{base_filename}' "
+                    f"in file definition '{section}'"
+                )
+            deltas.append(
+                download.DeltaPatch.new_delta_patch(
+                    os.path.join(self._cache_dir, base_filename),
+                    a2b_hex(base_sha1sum),
+                    url,
+                    a2b_hex(sha1sum),
+                    downloader,
+                )
+            )
+        return deltas
+
 
 class DefaultFilterBuilder:
     """A filter builder takes a list of string tokens and returns a filter object.
@@ -85,27 +162,36 @@ class DefaultFilterBuilder:
       fb.build_node(['untar', 'test.tar'])
     will return a <TarFilter('test.tar')> object.
 
+    The exclude, include and cp filters hard link the files produced by the
+    previous nodes of the installation process instead of copying them.
+
+    The archive filters extract at most extract_workers archives
+    concurrently.
+
     """
 
+    def __init__(self, extract_workers=1):
+        self._extract_workers = extract_workers
+
     def _build_unzip(self, args):
         if len(args) != 1:
             raise ValueError(f"unzip takes 1 arguments: has {len(args)}")
-        return install.ZipFilter(args[0])
+        return install.ZipFilter(args[0], self._extract_workers)
 
     def _build_untar(self, args):
         if len(args) != 1:
             raise ValueError(f"untar takes 1 arguments: has {len(args)}")
-        return install.TarFilter(args[0])
+        return install.TarFilter(args[0], self._extract_workers)
 
     def _build_unrar(self, args):
         if len(args) != 1:
             raise ValueError(f"unrar takes 1 arguments: has {len(args)}")
-        return install.RarFilter(args[0])
+        return install.RarFilter(args[0], self._extract_workers)
 
     def _build_7z(self, args):
         if len(args) != 1:
             raise ValueError(f"7z takes 1 arguments: has {len(args)}")
-        return install.Filter7z(args[0])
+        return install.Filter7z(args[0], self._extract_workers)
 
     def _build_unsign(self, args):
         if len(args) != 2:
@@ -115,17 +201,17 @@ class DefaultFilterBuilder:
     def _build_exclude(self, args):
         if not args:
             raise ValueError("exclude takes at least 1 arguments")
-        return install.ExcludeFilter(args)
+        return install.ExcludeFilter(args, link_files=True)
 
     def _build_include(self, args):
         if not args:
             raise ValueError("include takes at least 1 arguments")
-        return install.IncludeFilter(args)
+        return install.IncludeFilter(args, link_files=True)
 
     def _build_cp(self, args):
         if len(args) < 2:
             raise ValueError(f"cp takes at least 2 arguments: has {len(args)}")
-        return install.CopyFilter(args[:-1], args[-1])
+        return install.CopyFilter(args[:-1], args[-1], link_files=True)
 
     def _build_null(self, args):
         if args:
@@ -149,6 +235,10 @@ class DefaultFilterBuilder:
             return fun(args)
 
 
+# variables defined by each package, see DefaultPkgBuilder
+_LOCAL_VAR_REGEX = re.compile(r'^(?:FILE|ARG)[1-9]\d*$')
+
+
 class DefaultInstallMgrFactory:
     """
 
@@ -166,34 +256,49 @@ class DefaultInstallMgrFactory:
     """
 
     def __init__(self, config, section, filter_builder, global_vars):
-        # XXX it could be "better" if we could create an intermediate representation
-        #     with the info we have so that creating a new install manager would
-        #     be faster and we would already have checked the validity of the section
-        self._config = config
+        # The section is compiled once, here, into a list of (dst, src, token
+        # templates) so that creating a new install manager only needs to render
+        # the templates, and so that an invalid section is detected when loading
+        # the catalog instead of when installing a package
         self._section = section
         self._filter_builder = filter_builder
         self._global_vars = global_vars
+        self._nodes = self._compile(config.items(section), section)
 
-    def new_install_mgr(self, src_node, local_vars):
-        vars = dict(self._global_vars)
-        vars.update(local_vars)
-        filters = {}
-        graph = {'sources': {'a': src_node}, 'filters': filters}
-        for name, value in self._config.items(self._section):
-            src, dst = self._get_src_and_dst(name, self._section)
+    def _compile(self, items, section):
+        nodes = []
+        dsts = set()
+        for name, value in items:
+            src, dst = self._get_src_and_dst(name, section)
             if dst == 'a':
                 raise ParsingError(
-                    f"usage of reserved dst 'a' in install definition '{self._section}'"
+                    f"usage of reserved dst 'a' in install definition '{section}'"
                 )
-            if dst in filters:
+            if dst in dsts:
                 raise ParsingError(
-                    f"at least two filter with dst '{dst}' in install definition '{self._section}'"
+                    f"at least two filter with dst '{dst}' in install definition '{section}'"
                 )
-            raw_tokens = self._tokenize(value, self._section)
-            tokens = self._substitute(raw_tokens, vars)
-            filter_obj = self._filter_builder.build_node(tokens)
-            filters[dst] = (filter_obj, src)
-        return install.InstallationManager(graph)
+            dsts.add(dst)
+            nodes.append((dst, src, self._compile_tokens(value, section)))
+        graph = {
+            'sources': {'a': None},
+            'filters': {dst: (None, src) for dst, src, _ in nodes},
+        }
+        try:
+            install.check_installation_graph(graph)
+        except install.InstallationGraphError as e:
+            raise ParsingError(f"invalid install definition '{section}': {e}")
+        return nodes
+
+    def new_install_mgr(self, src_node, local_vars):
+        vars = collections.ChainMap(local_vars, self._global_vars)
+        filters = {}
+        for dst, src, templates in self._nodes:
+            tokens = [template.render(vars) for template in templates]
+            filters[dst] = (self._filter_builder.build_node(tokens), src)
+        return install.InstallationManager(
+            {'sources': {'a': src_node}, 'filters': filters}
+        )
 
     def _get_src_and_dst(self, name, section):
         try:
@@ -213,10 +318,23 @@ class DefaultInstallMgrFactory:
             )
         return tokens
 
-    def _substitute(self, raw_tokens, local_vars):
-        vars = dict(self._global_vars)
-        vars.update(local_vars)
-        return [util.apply_subs(token, vars) for token in raw_tokens]
+    def _compile_tokens(self, value, section):
+        templates = []
+        for token in self._tokenize(value, section):
+            try:
+                template = util.SubsTemplate(token)
+            except ValueError as e:
+                raise ParsingError(f"{e} in install definition '{section}'")
+            for var_name in template.names:
+                if not self._is_defined_var(var_name):
+                    raise ParsingError(
+                        f"undefined substitution '{var_name}' in install definition '{section}'"
+                    )
+            templates.append(template)
+        return templates
+
+    def _is_defined_var(self, var_name):
+        return var_name in self._global_vars or _LOCAL_VAR_REGEX.match(var_name)
 
 
 class DefaultInstallMgrFactoryBuilder:
@@ -233,8 +351,9 @@ class DefaultInstallMgrFactoryBuilder:
 
 
 class DefaultPkgBuilder:
-    """A package builder takes a config object (RawConfigParser) and a
-    pkg section and builds an installable package (InstallablePackage) from it.
+    """A package builder takes a config object (RawConfigParser or
+    catalog.CatalogConfig) and a pkg section and builds an installable
+    package (InstallablePackage) from it.
 
     It also takes a package id, a dict of available remotes files and a dict
     of installation manager factories to build a package.
@@ -263,7 +382,10 @@ class DefaultPkgBuilder:
             raise ParsingError(f"found invalid option 'id' in pkg def '{section}'")
 
         if 'depends' in raw_pkg_info:
-            pkg_info['depends'] = raw_pkg_info.pop('depends').split()
+            pkg_info['depends'] = [
+                sys.intern(dep_pkg_id)
+                for dep_pkg_id in raw_pkg_info.pop('depends').split()
+            ]
 
         pkg_remote_files = []
         if 'files' in raw_pkg_info:
@@ -283,7 +405,7 @@ class DefaultPkgBuilder:
                 install_mgr_factory = install_mgr_factories[install_mgr_id]
             except KeyError:
                 raise ParsingError(
-                    f"unknown install '{remote_file_id}' in pkg def '{section}'"
+                    f"unknown install '{install_mgr_id}' in pkg def '{section}'"
                 )
             else:
                 src_node = install.NonGlobbingFilesystemLinkSource(
@@ -305,15 +427,79 @@ class DefaultPkgBuilder:
         return InstallablePackage(pkg_info, pkg_remote_files, pkg_install_mgr)
 
 
+class _LazyMap(collections.abc.Mapping):
+    # Mapping whose values are built on first access by calling build_fun
+    # with the key. Errors raised by build_fun are reported as ParsingError,
+    # so that they can't be mistaken for a missing key.
+
+    def __init__(self, keys, build_fun):
+        self._keys = dict.fromkeys(keys)
+        self._build_fun = build_fun
+        self._values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            if key not in self._keys:
+                raise
+        try:
+            value = self._build_fun(key)
+        except StorageError:
+            raise
+        except Exception as e:
+            raise ParsingError(f"invalid definition of '{key}': {e!r}") from e
+        self._values[key] = value
+        return value
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key):
+        self._keys[key] = None
+
+    def discard(self, key):
+        # Remove key and return its built value, if any
+        self._keys.pop(key, None)
+        return self._values.pop(key, None)
+
+    def invalidate(self, key):
+        # Forget the built value of key, if any, and return it
+        return self._values.pop(key, None)
+
+    def set(self, key, value):
+        # Add key with an already built value
+        self._keys[key] = None
+        self._values[key] = value
+
+
+_EMPTY_FROZENSET = frozenset()
+
+
 class BasePkgStorage:
     """Note to be instantiated directly but to serve as a base class for
     package storage classes.
 
     If you derive from this class, instances must haves a '_pkgs' attribute
-    which is a dictionary where keys are package ids and values are package.
+    which is a mapping where keys are package ids and values are package.
+
+    The transitive dependencies of the packages are cached, so derived
+    classes must call _invalidate_dependencies when the dependencies of a
+    package change.
 
     """
 
+    # dictionary of pkg id -> (frozenset of the ids of its direct and indirect
+    # dependencies, frozenset of the ids of the missing packages among them
+    # and itself), or None if not computed yet
+    _dependency_cache = None
+
     def __getitem__(self, key):
         return self._pkgs[key]
 
@@ -338,6 +524,112 @@ class BasePkgStorage:
     def values(self):
         return list(self._pkgs.values())
 
+    def _get_depends(self, pkg_id):
+        # Return the list of direct dependencies of pkg_id or raise a KeyError
+        return self._pkgs[pkg_id].pkg_info['depends']
+
+    def _invalidate_dependencies(self):
+        self._dependency_cache = None
+
+    def _resolve_dependencies(self, pkg_ids):
+        # Compute and cache the dependencies of pkg_ids, and of the packages
+        # they depend on, in one pass over the dependency graph, using
+        # Tarjan's strongly connected components algorithm so that packages
+        # in a dependency cycle share the same dependencies. Return the list
+        # of dependency cycles found, as lists of package ids.
+        if self._dependency_cache is None:
+            self._dependency_cache = {}
+        cache = self._dependency_cache
+        # dictionary of pkg id -> list of direct dependencies or None if the
+        # package is missing
+        depends_map = {}
+        indexes = {}
+        lowlinks = {}
+        scc_stack = []
+        cycles = []
+
+        def visit(pkg_id):
+            indexes[pkg_id] = lowlinks[pkg_id] = len(indexes)
+            scc_stack.append(pkg_id)
+            try:
+                depends_map[pkg_id] = depends = self._get_depends(pkg_id)
+            except KeyError:
+                depends_map[pkg_id] = depends = None
+            call_stack.append((pkg_id, iter(depends or ())))
+
+        for root_pkg_id in pkg_ids:
+            if root_pkg_id in cache or root_pkg_id in indexes:
+                continue
+            call_stack = []
+            visit(root_pkg_id)
+            while call_stack:
+                pkg_id, depends_iter = call_stack[-1]
+                for dep_pkg_id in depends_iter:
+                    if dep_pkg_id in cache:
+                        continue
+                    if dep_pkg_id not in indexes:
+                        visit(dep_pkg_id)
+                        break
+                    # the package is on the stack since it has been visited
+                    # but its component has not been added yet
+                    lowlinks[pkg_id] = min(lowlinks[pkg_id], indexes[dep_pkg_id])
+                else:
+                    call_stack.pop()
+                    if call_stack:
+                        parent_pkg_id = call_stack[-1][0]
+                        lowlinks[parent_pkg_id] = min(
+                            lowlinks[parent_pkg_id], lowlinks[pkg_id]
+                        )
+                    if lowlinks[pkg_id] == indexes[pkg_id]:
+                        self._add_component(pkg_id, scc_stack, depends_map, cycles)
+        return cycles
+
+    def _add_component(self, pkg_id, scc_stack, depends_map, cycles):
+        # Pop the strongly connected component rooted at pkg_id from the stack
+        # and cache the dependencies of its members
+        cache = self._dependency_cache
+        members = []
+        while True:
+            member_pkg_id = scc_stack.pop()
+            members.append(member_pkg_id)
+            if member_pkg_id == pkg_id:
+                break
+        dependencies = set()
+        missing = set()
+        if len(members) > 1 or pkg_id in (depends_map[pkg_id] or ()):
+            cycles.append(members)
+            dependencies.update(members)
+        for member_pkg_id in members:
+            depends = depends_map[member_pkg_id]
+            if depends is None:
+                missing.add(member_pkg_id)
+                continue
+            for dep_pkg_id in depends:
+                if dep_pkg_id not in dependencies:
+                    dependencies.add(dep_pkg_id)
+                    dep_dependencies, dep_missing = cache.get(dep_pkg_id, ((), ()))
+                    dependencies.update(dep_dependencies)
+                    missing.update(dep_missing)
+        value = (
+            frozenset(dependencies) if dependencies else _EMPTY_FROZENSET,
+            frozenset(missing) if missing else _EMPTY_FROZENSET,
+        )
+        for member_pkg_id in members:
+            cache[member_pkg_id] = value
+
+    def _check_dependencies(self):
+        # Log the dependency cycles and missing dependencies of the packages
+        for members in self._resolve_dependencies(self._pkgs):
+            logger.warning('Dependency cycle between packages: %s', ' '.join(members))
+        for pkg_id in self._pkgs:
+            for dep_pkg_id in self._get_depends(pkg_id):
+                if dep_pkg_id not in self._pkgs:
+                    logger.warning(
+                        "Package '%s' depends on missing package '%s'",
+                        pkg_id,
+                        dep_pkg_id,
+                    )
+
     def get_dependencies(
         self, pkg_id, maxdepth=-1, filter_fun=None, ignore_missing=False
     ):
@@ -364,6 +656,8 @@ class BasePkgStorage:
         # return immediately if maxdepth is 0, this simplify the implementation
         if maxdepth == 0:
             return set()
+        if maxdepth == -1 and filter_fun is None:
+            return self._get_cached_dependencies_many(pkg_ids, ignore_missing)
         stack = [(pkg_id, maxdepth) for pkg_id in pkg_ids]
         dependencies = set()
         # dictionary of pkg_id -> maxdepth to prevent infinite loop
@@ -372,13 +666,13 @@ class BasePkgStorage:
             # note that depth is not a real depth value
             pkg_id, depth = stack.pop()
             try:
-                pkg = self._pkgs[pkg_id]
+                depends = self._get_depends(pkg_id)
             except KeyError:
                 if not ignore_missing:
                     raise
             else:
                 next_depth = depth - 1
-                for dep_pkg_id in pkg.pkg_info['depends']:
+                for dep_pkg_id in depends:
                     if dep_pkg_id in visited:
                         visit_depth = visited[dep_pkg_id]
                         if visit_depth >= next_depth:
@@ -390,6 +684,17 @@ class BasePkgStorage:
                             stack.append((dep_pkg_id, next_depth))
         return dependencies
 
+    def _get_cached_dependencies_many(self, pkg_ids, ignore_missing):
+        self._resolve_dependencies(pkg_ids)
+        cache = self._dependency_cache
+        dependencies = set()
+        for pkg_id in pkg_ids:
+            pkg_dependencies, missing = cache[pkg_id]
+            if missing and not ignore_missing:
+                raise KeyError(min(missing))
+            dependencies.update(pkg_dependencies)
+        return dependencies
+
 
 class DefaultInstallablePkgStorage(BasePkgStorage):
     def __init__(
@@ -402,114 +707,426 @@ class DefaultInstallablePkgStorage(BasePkgStorage):
         self._load_pkgs()
 
     def _load_pkgs(self):
-        config = self._read_db_files()
-        pkg_sections, file_sections, install_sections = self._split_sections(config)
-        remote_files = self._create_remote_files(config, file_sections)
-        install_mgr_factories = self._create_install_mgr_factories(
-            config, install_sections
-        )
-        self._pkgs = self._create_pkg(
-            config, pkg_sections, remote_files, install_mgr_factories
+        # Only index the sections here; packages, remote files and install
+        # manager factories are built on first access
+        self._catalog = catalog.Catalog(self._db_dir)
+        self._config = self._catalog.config
+        # dictionaries of remote file path -> remote file id, and the reverse
+        self._remote_file_paths = {}
+        self._remote_file_path_ids = {}
+        self._remote_files = _LazyMap([], self._create_remote_file)
+        self._install_mgr_factories = _LazyMap([], self._create_install_mgr_factory)
+        self._pkgs = _LazyMap([], self._create_pkg)
+        # dictionaries of remote file/install manager factory id -> set of pkg
+        # ids referencing it, and the reverse
+        self._remote_file_refs = collections.defaultdict(set)
+        self._install_mgr_factory_refs = collections.defaultdict(set)
+        self._pkg_refs = {}
+        self._search_index = None
+        self._update_pkgs()
+
+    def _update_pkgs(self):
+        # Update the storage from the catalog sections that have changed. The
+        # changed sections are checked before the update of the catalog is
+        # applied, so that the storage is left unchanged if one is invalid and
+        # the same sections are checked again on the next update.
+        try:
+            update = self._catalog.read_update()
+        except catalog.CatalogError as e:
+            raise StorageError(str(e))
+        changed_sections = update.changed_sections
+        self._check_sections(changed_sections)
+        remote_file_paths = self._get_remote_file_paths(update.config, changed_sections)
+        install_mgr_factories = self._build_install_mgr_factories(
+            update.config, changed_sections
         )
+        self._catalog.apply_update(update)
+        self._update_remote_file_paths(remote_file_paths)
 
-    def _read_db_files(self):
-        # Read the files in the db dir and return a config parser object
-        db_dir = self._db_dir
-        config = RawConfigParser()
-        try:
-            for rel_path in os.listdir(db_dir):
-                if not rel_path.startswith('.'):
-                    path = os.path.join(db_dir, rel_path)
-                    with open(path) as f:
-                        config.read_file(f)
-        except OSError as e:
-            raise StorageError(f"could not open/read file '{path}': {e}")
-        except ParsingError as e:
-            raise StorageError(f"could not parse file '{path}': {e}")
-        return config
-
-    def _split_sections(self, config):
-        pkg_sections = []
-        file_sections = []
-        install_sections = []
-        for section in config.sections():
+        invalidated_pkg_ids = set()
+        changed_pkg_ids = set()
+        for section in changed_sections:
             if section.startswith('pkg_'):
-                pkg_sections.append(section)
+                pkg_id = section[4:]
+                self._update_pkg_section(pkg_id, section)
+                changed_pkg_ids.add(pkg_id)
             elif section.startswith('file_'):
-                file_sections.append(section)
-            elif section.startswith('install_'):
-                install_sections.append(section)
+                remote_file_id = section[5:]
+                self._remote_files.discard(remote_file_id)
+                if self._config.has_section(section):
+                    self._remote_files.add(remote_file_id)
+                invalidated_pkg_ids.update(
+                    self._remote_file_refs.get(remote_file_id, ())
+                )
             else:
+                install_mgr_factory_id = section[8:]
+                self._install_mgr_factories.discard(install_mgr_factory_id)
+                if install_mgr_factory_id in install_mgr_factories:
+                    self._install_mgr_factories.set(
+                        install_mgr_factory_id,
+                        install_mgr_factories[install_mgr_factory_id],
+                    )
+                invalidated_pkg_ids.update(
+                    self._install_mgr_factory_refs.get(install_mgr_factory_id, ())
+                )
+        for pkg_id in invalidated_pkg_ids.union(changed_pkg_ids):
+            self._pkgs.invalidate(pkg_id)
+        if changed_pkg_ids:
+            self._search_index = None
+            self._invalidate_dependencies()
+            self._check_dependencies()
+
+    def _check_sections(self, sections):
+        for section in sections:
+            if not section.startswith(('pkg_', 'file_', 'install_')):
                 raise ParsingError(f"invalid section '{section}'")
-        return pkg_sections, file_sections, install_sections
 
-    def _create_remote_files(self, config, sections):
-        # Return a map where keys are remote file ids and values are remote files
-        remote_files = {}
-        remote_file_paths = set()
+    def _get_remote_file_paths(self, config, sections):
+        # Return a dictionary of remote file id -> path, or None if removed,
+        # of the remote files of the changed sections, and raise a
+        # ParsingError if two remote files use the same path
+        paths = {}
         for section in sections:
-            assert section.startswith('file_')
-            remote_file_id = section[5:]
-            remote_file = self._remote_file_builder.build_remote_file(config, section)
-            if remote_file.path in remote_file_paths:
-                raise ParsingError(
-                    f'two remote files use the same path: {remote_file.path}'
-                )
-            remote_file_paths.add(remote_file.path)
-            remote_files[remote_file_id] = remote_file
-        return remote_files
-
-    def _create_install_mgr_factories(self, config, sections):
-        install_mgr_factories = {}
+            if not section.startswith('file_'):
+                continue
+            path = None
+            if config.has_section(section):
+                try:
+                    path = self._remote_file_builder.get_remote_file_path(
+                        config, section
+                    )
+                except StorageError:
+                    raise
+                except Exception as e:
+                    raise ParsingError(
+                        f"invalid file definition '{section}': {e!r}"
+                    ) from e
+            paths[section[5:]] = path
+        remote_file_ids = {}
+        for remote_file_id, path in paths.items():
+            if path is None:
+                continue
+            other_remote_file_id = remote_file_ids.setdefault(path, remote_file_id)
+            # the path of an unchanged remote file
+            old_remote_file_id = self._remote_file_paths.get(path)
+            if other_remote_file_id != remote_file_id or (
+                old_remote_file_id is not None and old_remote_file_id not in paths
+            ):
+                raise ParsingError(f'two remote files use the same path: {path}')
+        return paths
+
+    def _update_remote_file_paths(self, paths):
+        for remote_file_id in paths:
+            path = self._remote_file_path_ids.pop(remote_file_id, None)
+            if path is not None:
+                del self._remote_file_paths[path]
+        for remote_file_id, path in paths.items():
+            if path is not None:
+                self._remote_file_paths[path] = remote_file_id
+                self._remote_file_path_ids[remote_file_id] = path
+
+    def _build_install_mgr_factories(self, config, sections):
+        # Return a dictionary of install manager factory id -> factory of the
+        # changed install sections. Install definitions are cheap to compile,
+        # so they are compiled right away to report invalid ones at load.
+        factories = {}
         for section in sections:
-            assert section.startswith('install_')
+            if not section.startswith('install_') or not config.has_section(section):
+                continue
             install_mgr_factory_id = section[8:]
-            install_mgr_factory = (
-                self._install_mgr_factory_builder.build_install_mgr_factory(
+            try:
+                factories[
+                    install_mgr_factory_id
+                ] = self._install_mgr_factory_builder.build_install_mgr_factory(
                     config, section
                 )
+            except StorageError:
+                raise
+            except Exception as e:
+                raise ParsingError(
+                    f"invalid definition of '{install_mgr_factory_id}': {e!r}"
+                ) from e
+        return factories
+
+    def _update_pkg_section(self, pkg_id, section):
+        remote_file_ids, install_mgr_factory_ids = self._pkg_refs.pop(pkg_id, ((), ()))
+        for remote_file_id in remote_file_ids:
+            self._remote_file_refs[remote_file_id].discard(pkg_id)
+        for install_mgr_factory_id in install_mgr_factory_ids:
+            self._install_mgr_factory_refs[install_mgr_factory_id].discard(pkg_id)
+        self._pkgs.discard(pkg_id)
+        if not self._config.has_section(section):
+            return
+        self._pkgs.add(pkg_id)
+        remote_file_ids = ()
+        if self._config.has_option(section, 'files'):
+            remote_file_ids = tuple(self._config.get(section, 'files').split())
+        install_mgr_factory_ids = ()
+        if self._config.has_option(section, 'install'):
+            install_mgr_factory_ids = tuple(
+                self._config.get(section, 'install').split()[:1]
             )
-            install_mgr_factories[install_mgr_factory_id] = install_mgr_factory
-        return install_mgr_factories
+        for remote_file_id in remote_file_ids:
+            self._remote_file_refs[remote_file_id].add(pkg_id)
+        for install_mgr_factory_id in install_mgr_factory_ids:
+            self._install_mgr_factory_refs[install_mgr_factory_id].add(pkg_id)
+        self._pkg_refs[pkg_id] = remote_file_ids, install_mgr_factory_ids
+
+    def _create_remote_file(self, remote_file_id):
+        section = f'file_{remote_file_id}'
+        return self._remote_file_builder.build_remote_file(self._config, section)
+
+    def _create_install_mgr_factory(self, install_mgr_factory_id):
+        section = f'install_{install_mgr_factory_id}'
+        return self._install_mgr_factory_builder.build_install_mgr_factory(
+            self._config, section
+        )
 
-    def _create_pkg(self, config, sections, remote_files, install_mgr_factories):
-        pkgs = {}
-        for section in sections:
-            assert section.startswith('pkg_')
-            pkg_id = section[4:]
-            pkg = self._pkg_builder.build_installable_pkg(
-                config, section, pkg_id, remote_files, install_mgr_factories
-            )
-            pkgs[pkg_id] = pkg
-        return pkgs
+    def _create_pkg(self, pkg_id):
+        section = f'pkg_{pkg_id}'
+        return self._pkg_builder.build_installable_pkg(
+            self._config,
+            section,
+            pkg_id,
+            self._remote_files,
+            self._install_mgr_factories,
+        )
+
+    def _get_depends(self, pkg_id):
+        # Read the dependencies from the catalog so that no package needs
+        # to be built
+        if pkg_id not in self._pkgs:
+            raise KeyError(pkg_id)
+        section = f'pkg_{pkg_id}'
+        if self._config.has_option(section, 'depends'):
+            return self._config.get(section, 'depends').split()
+        return []
 
     def reload(self):
-        self._load_pkgs()
+        """Reload the packages from the catalog files that have changed."""
+        self._update_pkgs()
+
+    def get_search_index(self):
+        """Return the search.SearchIndex of the packages."""
+        if self._search_index is None:
+            self._search_index = search.load_search_index(self._db_dir, self._catalog)
+        return self._search_index
+
+    def get_pkg_sections(self, pkg_ids):
+        """Return a dictionary of the catalog sections defining the given
+        packages, i.e. their pkg sections and the file and install sections
+        they reference.
+
+        Keys are section names and values are dictionaries of options.
+
+        """
+        config = self._config
+        sections = {}
+        for pkg_id in pkg_ids:
+            pkg_section = f'pkg_{pkg_id}'
+            if not config.has_section(pkg_section):
+                raise KeyError(pkg_id)
+            sections[pkg_section] = dict(config.items(pkg_section))
+            if config.has_option(pkg_section, 'files'):
+                for remote_file_id in config.get(pkg_section, 'files').split():
+                    file_section = f'file_{remote_file_id}'
+                    sections[file_section] = dict(config.items(file_section))
+            if config.has_option(pkg_section, 'install'):
+                install_mgr_id = config.get(pkg_section, 'install').split()[0]
+                install_section = f'install_{install_mgr_id}'
+                sections[install_section] = dict(config.items(install_section))
+        return sections
+
+
+class BaseInstalledPkgStorage(BasePkgStorage):
+    """Base class for installed package storage classes.
+
+    Derived classes must implement a get_owners method returning the set of
+    IDs of the packages owning a path, and the begin, commit, rollback and
+    transaction methods to group writes in transactions.
+
+    """
+
+    def get_conflicts(self, pkg_id, paths):
+        """Return a dictionary of the paths, among the given paths, that are
+        already owned by packages other than pkg_id.
+
+        Keys are paths and values are the set of IDs of the other packages.
+        Directories, which end with a '/', can be shared and are never
+        conflicting.
+
+        """
+        conflicts = {}
+        for path in paths:
+            if path.endswith('/'):
+                continue
+            owners = self.get_owners(path)
+            owners.discard(pkg_id)
+            if owners:
+                conflicts[path] = owners
+        return conflicts
+
+    def get_exclusive_paths(self, pkg_id, paths):
+        """Return the list of the given paths that are not owned by packages
+        other than pkg_id, i.e. the paths that can be removed when pkg_id is
+        removed.
+
+        """
+        return [path for path in paths if not self.get_owners(path) - {pkg_id}]
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DefaultInstalledPkgStorage(BaseInstalledPkgStorage):
+    """An installed package storage with one JSON file per package.
 
+    The files of each package are stored in a compact manifest in the
+    MANIFESTS_DIR directory of the db dir, and are only loaded when the
+    'files' key of the package is used (see manifest.LazyManifest).
+
+    The owners of each installed path are stored in the OWNERS_FILENAME
+    file of the db dir. This index is loaded on first use and is rebuilt
+    from the manifests if it's missing or if the packages files have been
+    modified by something else than the storage.
+
+    Writes are done in transactions (see begin, commit and rollback). Write
+    methods called outside of a transaction are done in their own
+    transaction. On commit, every change of the transaction is first written
+    in the JOURNAL_FILENAME file, which is fsynced and renamed into place,
+    and then applied to the package files, each of them being written in a
+    temporary file that is fsynced and renamed into place. The journal is
+    only removed once the directories of the package files have been
+    fsynced. A journal left by an interrupted commit is applied the next
+    time the storage is loaded.
+
+    """
+
+    MANIFESTS_DIR = '.manifests'
+    OWNERS_FILENAME = '.owners'
+    JOURNAL_FILENAME = '.journal'
 
-class DefaultInstalledPkgStorage(BasePkgStorage):
     def __init__(self, db_dir, pretty_printing=False):
         self._db_dir = db_dir
+        self._manifests_dir = os.path.join(db_dir, self.MANIFESTS_DIR)
+        self._owners_filename = os.path.join(db_dir, self.OWNERS_FILENAME)
+        self._journal_filename = os.path.join(db_dir, self.JOURNAL_FILENAME)
         self._json_indent = 4 if pretty_printing else None
+        # dictionary of pkg id -> pkg info or None if the package is deleted,
+        # or None if not in a transaction
+        self._pending = None
+        self._recover_journal()
         self._load_pkgs()
 
     def _add_requirements(self, pkg, pkg_id):
+        self._invalidate_dependencies()
         for dep_pkg_id in pkg.pkg_info['depends']:
             self._requirement_map[dep_pkg_id].add(pkg_id)
 
     def _remove_requirements(self, pkg, pkg_id):
+        self._invalidate_dependencies()
         for dep_pkg_id in pkg.pkg_info['depends']:
             self._requirement_map[dep_pkg_id].discard(pkg_id)
 
     def _load_pkgs(self):
-        pkgs = {}
+        self._pkgs = {}
         self._requirement_map = collections.defaultdict(set)
+        # dictionary of pkg id -> file key of the pkg file
+        self._file_keys = {}
+        # dictionary of path -> set of pkg ids, loaded on first use
+        self._owner_index = None
+        self._update_pkgs()
+
+    def _update_pkgs(self):
+        # Load the packages whose file has been added or modified since the
+        # last call and remove the packages whose file has been removed
+        pkg_ids = set()
+        changed = False
         for pkg_id in os.listdir(self._db_dir):
-            if not pkg_id.startswith('.'):
+            if pkg_id.startswith('.'):
+                continue
+            pkg_ids.add(pkg_id)
+            key = catalog.file_key(os.stat(os.path.join(self._db_dir, pkg_id)))
+            if self._file_keys.get(pkg_id) != key:
+                changed = True
+                self._owner_index = None
                 pkg = InstalledPackage(self._load_pkg_info(pkg_id))
+                if pkg_id in self._pkgs:
+                    self._remove_requirements(self._pkgs[pkg_id], pkg_id)
                 self._add_requirements(pkg, pkg_id)
-                pkgs[pkg_id] = pkg
-        self._pkgs = pkgs
+                self._pkgs[pkg_id] = pkg
+                self._file_keys[pkg_id] = key
+        for pkg_id in set(self._pkgs).difference(pkg_ids):
+            changed = True
+            self._owner_index = None
+            self._remove_requirements(self._pkgs.pop(pkg_id), pkg_id)
+            del self._file_keys[pkg_id]
+        if changed:
+            self._check_dependencies()
+
+    def _get_owner_index(self):
+        if self._owner_index is None:
+            self._owner_index = self._read_owner_index()
+            if self._owner_index is None:
+                logger.info("Rebuilding owner index '%s'", self._owners_filename)
+                self._owner_index = self._build_owner_index()
+                self._write_owner_index()
+        return self._owner_index
+
+    def _read_owner_index(self):
+        # Return the owner index from the owners file, or None if the file
+        # is missing, invalid or out of date
+        try:
+            with open(self._owners_filename) as fobj:
+                data = json.load(fobj)
+            file_keys = {pkg_id: tuple(key) for pkg_id, key in data['packages'].items()}
+            if file_keys != self._file_keys:
+                return None
+            return {path: set(owners) for path, owners in data['owners'].items()}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.warning("Invalid owner index '%s': %s", self._owners_filename, e)
+            return None
+
+    def _build_owner_index(self):
+        owner_index = {}
+        for pkg_id, pkg in self._pkgs.items():
+            for path in pkg.pkg_info['files']:
+                owner_index.setdefault(path, set()).add(pkg_id)
+        return owner_index
+
+    def _update_owner_index(self, pkg_id, old_paths, new_paths):
+        owner_index = self._owner_index
+        for path in old_paths:
+            owners = owner_index.get(path)
+            if owners is not None:
+                owners.discard(pkg_id)
+                if not owners:
+                    del owner_index[path]
+        for path in new_paths:
+            owner_index.setdefault(path, set()).add(pkg_id)
+
+    def _write_owner_index(self):
+        data = {
+            'packages': self._file_keys,
+            'owners': {
+                path: sorted(owners) for path, owners in self._owner_index.items()
+            },
+        }
+        tmp_filename = self._owners_filename + '.tmp'
+        with open(tmp_filename, 'w') as fobj:
+            json.dump(data, fobj)
+        os.replace(tmp_filename, self._owners_filename)
+
+    def get_owners(self, path):
+        """Return the set of IDs of the packages owning path."""
+        return set(self._get_owner_index().get(path, ()))
 
     def _load_pkg_info(self, pkg_id):
         filename = os.path.join(self._db_dir, pkg_id)
@@ -519,16 +1136,33 @@ class DefaultInstalledPkgStorage(BasePkgStorage):
             #     great but config parser, used for the installable storage,
             #     doesn't support unicode...
             pkg_info = json.load(fobj)
-            return pkg_info
+        # packages written before manifests were introduced have their
+        # files in their pkg info
+        if 'files' not in pkg_info:
+            pkg_info['files'] = manifest.LazyManifest(
+                functools.partial(self._read_manifest, pkg_id)
+            )
+        return pkg_info
+
+    def _manifest_filename(self, pkg_id):
+        return os.path.join(self._manifests_dir, pkg_id)
+
+    def _read_manifest(self, pkg_id):
+        filename = self._manifest_filename(pkg_id)
+        try:
+            return manifest.read_manifest(filename)
+        except OSError as e:
+            raise StorageError(f"could not read manifest '{filename}': {e}")
 
     def insert_pkg(self, installed_pkg):
         pkg_info = installed_pkg.pkg_info
         pkg_id = pkg_info['id']
         if pkg_id in self._pkgs:
             raise ValueError(f'package is already installed: {pkg_id}')
-        self._write_pkg_info(pkg_id, pkg_info)
-        self._add_requirements(installed_pkg, pkg_id)
-        self._pkgs[pkg_id] = installed_pkg
+        with self.transaction():
+            self._write_pkg_info(pkg_id, pkg_info)
+            self._add_requirements(installed_pkg, pkg_id)
+            self._pkgs[pkg_id] = installed_pkg
 
     def update_pkg(self, installed_pkg):
         # Note that this is a replace operation
@@ -536,37 +1170,155 @@ class DefaultInstalledPkgStorage(BasePkgStorage):
         pkg_id = pkg_info['id']
         if pkg_id not in self._pkgs:
             raise ValueError(f'package is not installed: {pkg_id}')
-        self._remove_requirements(installed_pkg, pkg_id)
-        self._write_pkg_info(pkg_id, pkg_info)
-        self._add_requirements(installed_pkg, pkg_id)
-        self._pkgs[pkg_id] = installed_pkg
+        with self.transaction():
+            self._remove_requirements(self._pkgs[pkg_id], pkg_id)
+            self._write_pkg_info(pkg_id, pkg_info)
+            self._add_requirements(installed_pkg, pkg_id)
+            self._pkgs[pkg_id] = installed_pkg
 
     def upsert_pkg(self, installed_pkg):
         pkg_info = installed_pkg.pkg_info
         pkg_id = pkg_info['id']
-        if pkg_id in self._pkgs:
-            self._remove_requirements(installed_pkg, pkg_id)
-        self._write_pkg_info(pkg_id, pkg_info)
-        self._add_requirements(installed_pkg, pkg_id)
-        self._pkgs[pkg_id] = installed_pkg
+        with self.transaction():
+            if pkg_id in self._pkgs:
+                self._remove_requirements(self._pkgs[pkg_id], pkg_id)
+            self._write_pkg_info(pkg_id, pkg_info)
+            self._add_requirements(installed_pkg, pkg_id)
+            self._pkgs[pkg_id] = installed_pkg
 
     def _write_pkg_info(self, pkg_id, pkg_info):
-        if os.sep in pkg_id:
+        if os.sep in pkg_id or pkg_id.startswith('.'):
             raise ValueError(f'invalid pkg id: {pkg_id}')
-        filename = os.path.join(self._db_dir, pkg_id)
-        with open(filename, 'w') as fobj:
-            json.dump(pkg_info, fobj, indent=self._json_indent)
+        # the owner index must be loaded before the package file is modified
+        self._get_owner_index()
+        if pkg_id in self._pkgs:
+            old_paths = list(self._pkgs[pkg_id].pkg_info['files'])
+        else:
+            old_paths = []
+        new_paths = list(pkg_info['files'])
+        self._pending[pkg_id] = dict(pkg_info, files=new_paths)
+        self._update_owner_index(pkg_id, old_paths, new_paths)
 
     def delete_pkg(self, pkg_id):
         if pkg_id not in self._pkgs:
             raise ValueError(f'package is not installed: {pkg_id}')
-        self._remove_requirements(self._pkgs[pkg_id], pkg_id)
-        filename = os.path.join(self._db_dir, pkg_id)
-        os.remove(filename)
-        del self._pkgs[pkg_id]
+        with self.transaction():
+            self._get_owner_index()
+            old_paths = list(self._pkgs[pkg_id].pkg_info['files'])
+            self._remove_requirements(self._pkgs[pkg_id], pkg_id)
+            del self._pkgs[pkg_id]
+            self._pending[pkg_id] = None
+            self._update_owner_index(pkg_id, old_paths, [])
+
+    def begin(self):
+        """Begin a transaction."""
+        if self._pending is not None:
+            raise StorageError('a transaction is already in progress')
+        self._pending = {}
+
+    def commit(self):
+        """Commit the current transaction, writing its changes atomically."""
+        if self._pending is None:
+            raise StorageError('no transaction in progress')
+        pending, self._pending = self._pending, None
+        if not pending:
+            return
+        journal = {}
+        for pkg_id, pkg_info in pending.items():
+            if pkg_info is None:
+                journal[pkg_id] = None
+            else:
+                info = {key: value for key, value in pkg_info.items() if key != 'files'}
+                journal[pkg_id] = {'info': info, 'files': pkg_info['files']}
+        tmp_filename = self._journal_filename + '.tmp'
+        with open(tmp_filename, 'w') as fobj:
+            json.dump(journal, fobj)
+            fobj.flush()
+            os.fsync(fobj.fileno())
+        os.replace(tmp_filename, self._journal_filename)
+        _fsync_dir(self._db_dir)
+        # from this point, the transaction is committed
+        self._apply_journal(journal)
+        if self._owner_index is not None:
+            self._write_owner_index()
+        os.remove(self._journal_filename)
+
+    def rollback(self):
+        """Rollback the current transaction."""
+        if self._pending is None:
+            raise StorageError('no transaction in progress')
+        self._pending = None
+        # nothing has been written, so reloading the packages restores them
+        self._load_pkgs()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Return a context manager grouping every write done inside it in a
+        single transaction, which is rolled back if an exception is raised.
+
+        Transactions can be nested, in which case only the outermost one is
+        effective.
+
+        """
+        if self._pending is not None:
+            yield
+            return
+        self.begin()
+        try:
+            yield
+        except BaseException:
+            self.rollback()
+            raise
+        else:
+            self.commit()
+
+    def _apply_journal(self, journal):
+        for pkg_id, entry in journal.items():
+            filename = os.path.join(self._db_dir, pkg_id)
+            if entry is None:
+                for path in [filename, self._manifest_filename(pkg_id)]:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                self._file_keys.pop(pkg_id, None)
+            else:
+                if not os.path.isdir(self._manifests_dir):
+                    os.mkdir(self._manifests_dir)
+                manifest.write_manifest(
+                    self._manifest_filename(pkg_id), entry['files'], fsync=True
+                )
+                tmp_filename = os.path.join(self._db_dir, f'.{pkg_id}.tmp')
+                with open(tmp_filename, 'w') as fobj:
+                    json.dump(entry['info'], fobj, indent=self._json_indent)
+                    fobj.flush()
+                    os.fsync(fobj.fileno())
+                os.replace(tmp_filename, filename)
+                self._file_keys[pkg_id] = catalog.file_key(os.stat(filename))
+        # make the renames and removals durable before the journal is removed
+        _fsync_dir(self._db_dir)
+        if os.path.isdir(self._manifests_dir):
+            _fsync_dir(self._manifests_dir)
+
+    def _recover_journal(self):
+        # Apply the journal of a commit that has been interrupted
+        try:
+            with open(self._journal_filename) as fobj:
+                journal = json.load(fobj)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            raise StorageError(
+                f"could not read journal '{self._journal_filename}': {e}"
+            )
+        logger.warning("Applying journal '%s'", self._journal_filename)
+        self._file_keys = {}
+        self._apply_journal(journal)
+        os.remove(self._journal_filename)
 
     def reload(self):
-        self._load_pkgs()
+        """Reload the packages whose file has changed."""
+        self._update_pkgs()
 
     def get_requisites(self, pkg_id):
         """Return the set of direct requisites of pkg_id, i.e. the set of
@@ -580,9 +1332,221 @@ class DefaultInstalledPkgStorage(BasePkgStorage):
         return set(self._requirement_map[pkg_id])
 
 
-def new_installable_pkg_storage(db_dir, cache_dir, downloaders, global_vars):
-    remote_file_builder = DefaultRemoteFileBuilder(cache_dir, downloaders)
-    filter_builder = DefaultFilterBuilder()
+class SqliteInstalledPkgStorage(BaseInstalledPkgStorage):
+    """An installed package storage backed by a SQLite database in WAL mode.
+
+    Packages, their dependencies and their files are stored in indexed
+    tables. Every write is done in a transaction; use the transaction method
+    to group many writes in a single transaction.
+
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS packages (
+            id TEXT PRIMARY KEY,
+            info TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS dependencies (
+            pkg_id TEXT NOT NULL REFERENCES packages (id) ON DELETE CASCADE,
+            dep_pkg_id TEXT NOT NULL,
+            PRIMARY KEY (pkg_id, dep_pkg_id)
+        );
+        CREATE INDEX IF NOT EXISTS dependencies_dep_pkg_id
+            ON dependencies (dep_pkg_id);
+        CREATE TABLE IF NOT EXISTS files (
+            pkg_id TEXT NOT NULL REFERENCES packages (id) ON DELETE CASCADE,
+            path TEXT NOT NULL,
+            PRIMARY KEY (pkg_id, path)
+        );
+        CREATE INDEX IF NOT EXISTS files_path ON files (path);
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        try:
+            # the storage is used from other threads than the one creating it,
+            # for example by the daemon, which executes each request in its
+            # own thread; the callers serialize the accesses to the storage
+            self._conn = sqlite3.connect(
+                filename, isolation_level=None, check_same_thread=False
+            )
+            self._conn.execute('PRAGMA journal_mode = WAL')
+            self._conn.execute('PRAGMA foreign_keys = ON')
+            self._conn.executescript(self._SCHEMA)
+        except sqlite3.Error as e:
+            raise StorageError(f"could not open database '{filename}': {e}")
+        self._in_transaction = False
+        self._load_pkgs()
+
+    def _load_pkgs(self):
+        conn = self._conn
+        pkg_infos = {}
+        for pkg_id, info in conn.execute('SELECT id, info FROM packages'):
+            pkg_info = json.loads(info)
+            pkg_info['depends'] = []
+            pkg_info['files'] = manifest.LazyManifest(
+                functools.partial(self._load_files, pkg_id)
+            )
+            pkg_infos[pkg_id] = pkg_info
+        for pkg_id, dep_pkg_id in conn.execute(
+            'SELECT pkg_id, dep_pkg_id FROM dependencies ORDER BY rowid'
+        ):
+            pkg_infos[pkg_id]['depends'].append(dep_pkg_id)
+        self._pkgs = {
+            pkg_id: InstalledPackage(pkg_info) for pkg_id, pkg_info in pkg_infos.items()
+        }
+        self._invalidate_dependencies()
+        self._check_dependencies()
+
+    def _load_files(self, pkg_id):
+        cursor = self._conn.execute(
+            'SELECT path FROM files WHERE pkg_id = ? ORDER BY rowid', (pkg_id,)
+        )
+        return [row[0] for row in cursor]
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Return a context manager grouping every write done inside it in a
+        single transaction, which is rolled back if an exception is raised.
+
+        Transactions can be nested, in which case only the outermost one is
+        effective.
+
+        """
+        if self._in_transaction:
+            yield
+            return
+        self.begin()
+        try:
+            yield
+        except BaseException:
+            self.rollback()
+            raise
+        else:
+            self.commit()
+
+    def begin(self):
+        """Begin a transaction."""
+        if self._in_transaction:
+            raise StorageError('a transaction is already in progress')
+        self._conn.execute('BEGIN IMMEDIATE')
+        self._in_transaction = True
+
+    def commit(self):
+        """Commit the current transaction."""
+        if not self._in_transaction:
+            raise StorageError('no transaction in progress')
+        self._in_transaction = False
+        self._conn.execute('COMMIT')
+
+    def rollback(self):
+        """Rollback the current transaction."""
+        if not self._in_transaction:
+            raise StorageError('no transaction in progress')
+        self._in_transaction = False
+        self._conn.execute('ROLLBACK')
+        # the in-memory packages might not match the database anymore
+        self._load_pkgs()
+
+    def _write_pkg_info(self, pkg_id, pkg_info):
+        # the files must be read before the package is deleted
+        files = list(pkg_info['files'])
+        info = {
+            key: value
+            for key, value in pkg_info.items()
+            if key not in ('depends', 'files')
+        }
+        conn = self._conn
+        conn.execute('DELETE FROM packages WHERE id = ?', (pkg_id,))
+        conn.execute(
+            'INSERT INTO packages (id, info) VALUES (?, ?)',
+            (pkg_id, json.dumps(info)),
+        )
+        conn.executemany(
+            'INSERT OR IGNORE INTO dependencies (pkg_id, dep_pkg_id) VALUES (?, ?)',
+            ((pkg_id, dep_pkg_id) for dep_pkg_id in pkg_info['depends']),
+        )
+        conn.executemany(
+            'INSERT OR IGNORE INTO files (pkg_id, path) VALUES (?, ?)',
+            ((pkg_id, path) for path in files),
+        )
+
+    def insert_pkg(self, installed_pkg):
+        pkg_id = installed_pkg.pkg_info['id']
+        if pkg_id in self._pkgs:
+            raise ValueError(f'package is already installed: {pkg_id}')
+        self.upsert_pkg(installed_pkg)
+
+    def update_pkg(self, installed_pkg):
+        # Note that this is a replace operation
+        pkg_id = installed_pkg.pkg_info['id']
+        if pkg_id not in self._pkgs:
+            raise ValueError(f'package is not installed: {pkg_id}')
+        self.upsert_pkg(installed_pkg)
+
+    def upsert_pkg(self, installed_pkg):
+        pkg_info = installed_pkg.pkg_info
+        pkg_id = pkg_info['id']
+        with self.transaction():
+            self._write_pkg_info(pkg_id, pkg_info)
+            self._pkgs[pkg_id] = installed_pkg
+            self._invalidate_dependencies()
+
+    def delete_pkg(self, pkg_id):
+        if pkg_id not in self._pkgs:
+            raise ValueError(f'package is not installed: {pkg_id}')
+        with self.transaction():
+            self._conn.execute('DELETE FROM packages WHERE id = ?', (pkg_id,))
+            del self._pkgs[pkg_id]
+            self._invalidate_dependencies()
+
+    def reload(self):
+        self._load_pkgs()
+
+    def get_requisites(self, pkg_id):
+        """Return the set of direct requisites of pkg_id, i.e. the set of
+        package IDs which depends directly on pkg_id.
+
+        """
+        if pkg_id not in self._pkgs:
+            raise ValueError(f'package is not installed: {pkg_id}')
+        cursor = self._conn.execute(
+            'SELECT pkg_id FROM dependencies WHERE dep_pkg_id = ?', (pkg_id,)
+        )
+        return {row[0] for row in cursor}
+
+    def get_owners(self, path):
+        """Return the set of IDs of the packages owning path."""
+        cursor = self._conn.execute('SELECT pkg_id FROM files WHERE path = ?', (path,))
+        return {row[0] for row in cursor}
+
+    def close(self):
+        self._conn.close()
+
+
+def migrate_installed_pkg_storage(src_pkg_sto, dst_pkg_sto):
+    """Copy every package of src_pkg_sto in dst_pkg_sto, which must be a
+    SqliteInstalledPkgStorage, in a single transaction.
+
+    """
+    with dst_pkg_sto.transaction():
+        for installed_pkg in src_pkg_sto.values():
+            dst_pkg_sto.upsert_pkg(installed_pkg)
+
+
+def new_installable_pkg_storage(
+    db_dir,
+    cache_dir,
+    downloaders,
+    global_vars,
+    download_retries=0,
+    pipelined_downloads=False,
+    extract_workers=1,
+):
+    remote_file_builder = DefaultRemoteFileBuilder(
+        cache_dir, downloaders, download_retries, pipelined_downloads
+    )
+    filter_builder = DefaultFilterBuilder(extract_workers)
     install_mgr_factory_builder = DefaultInstallMgrFactoryBuilder(
         filter_builder, global_vars
     )
@@ -596,16 +1560,67 @@ def new_installed_pkg_storage(db_dir):
     return DefaultInstalledPkgStorage(db_dir)
 
 
-def new_pkg_storages(base_db_dir, cache_dir, downloaders, global_vars):
+def new_sqlite_installed_pkg_storage(filename, json_db_dir=None):
+    # Return a SqliteInstalledPkgStorage. If the database does not exist yet
+    # and json_db_dir is not None, the packages of the JSON storage in
+    # json_db_dir are migrated into the new database
+    migrate = json_db_dir is not None and not os.path.exists(filename)
+    if not migrate:
+        return SqliteInstalledPkgStorage(filename)
+    tmp_filename = filename + '.tmp'
+    for path in [tmp_filename, tmp_filename + '-wal', tmp_filename + '-shm']:
+        if os.path.exists(path):
+            os.remove(path)
+    tmp_pkg_sto = SqliteInstalledPkgStorage(tmp_filename)
+    try:
+        logger.info("Migrating installed packages from '%s'", json_db_dir)
+        migrate_installed_pkg_storage(
+            DefaultInstalledPkgStorage(json_db_dir), tmp_pkg_sto
+        )
+        # switch back to the rollback journal so that the database is
+        # contained in a single file before renaming it
+        tmp_pkg_sto._conn.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        tmp_pkg_sto.close()
+    os.rename(tmp_filename, filename)
+    return SqliteInstalledPkgStorage(filename)
+
+
+def new_pkg_storages(
+    base_db_dir,
+    cache_dir,
+    downloaders,
+    global_vars,
+    download_retries=0,
+    pipelined_downloads=False,
+    installed_backend='json',
+    extract_workers=1,
+):
     # Return a tuple (installable_pkg_storage, installed_pkg_storage) using
-    # base_db_dir as a common base directory for both package storage
+    # base_db_dir as a common base directory for both package storage.
+    # installed_backend is either 'json' or 'sqlite'; with 'sqlite', the
+    # packages of the JSON storage are migrated on first use. extract_workers
+    # is the maximum number of archives extracted concurrently by a filter
     able_db_dir = os.path.join(base_db_dir, 'installable')
     ed_db_dir = os.path.join(base_db_dir, 'installed')
     for dir in [able_db_dir, ed_db_dir]:
         if not os.path.isdir(dir):
             os.makedirs(dir)
     able_storage = new_installable_pkg_storage(
-        able_db_dir, cache_dir, downloaders, global_vars
+        able_db_dir,
+        cache_dir,
+        downloaders,
+        global_vars,
+        download_retries,
+        pipelined_downloads,
+        extract_workers,
     )
-    ed_storage = new_installed_pkg_storage(ed_db_dir)
+    if installed_backend == 'json':
+        ed_storage = new_installed_pkg_storage(ed_db_dir)
+    elif installed_backend == 'sqlite':
+        ed_storage = new_sqlite_installed_pkg_storage(
+            os.path.join(base_db_dir, 'installed.sqlite'), ed_db_dir
+        )
+    else:
+        raise ValueError(f'invalid installed backend: {installed_backend}')
     return able_storage, ed_storage
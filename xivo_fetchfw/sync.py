@@ -0,0 +1,264 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Synchronization of the installable catalog with remote repositories.
+
+A repository is a base URL under which are:
+- index -- a JSON document listing the catalog files of the repository,
+  for example {"version": 1, "files": {"foo.db": {"size": 42, "sha256": "..."}}}
+- index.sig -- a detached GnuPG signature of the index
+- <filename> -- the catalog files listed in the index
+
+The index is fetched with a conditional request, so that nothing but the
+response headers is transferred when it has not changed, and only the
+catalog files whose digest differs from the local file are downloaded.
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from urllib import request
+
+from xivo_fetchfw.download import NotModifiedError
+from xivo_fetchfw.util import FetchfwError
+
+logger = logging.getLogger(__name__)
+
+
+class SyncError(FetchfwError):
+    pass
+
+
+STATE_FILENAME = '.sync.state'
+INDEX_NAME = 'index'
+SIGNATURE_SUFFIX = '.sig'
+_INDEX_VERSION = 1
+_BLOCK_SIZE = 65536
+
+
+def _sha256_file(filename):
+    hash = hashlib.sha256()
+    try:
+        with open(filename, 'rb') as fobj:
+            for data in iter(lambda: fobj.read(_BLOCK_SIZE), b''):
+                hash.update(data)
+    except FileNotFoundError:
+        return None
+    return hash.hexdigest()
+
+
+def _read_remote(downloader, url, output=None):
+    # Download url and return its content, or write it to the file-like
+    # object output, and return the response headers
+    fobj = downloader.download(url)
+    try:
+        chunks = []
+        for data in iter(lambda: fobj.read(_BLOCK_SIZE), b''):
+            if output is None:
+                chunks.append(data)
+            else:
+                output.write(data)
+        return b''.join(chunks), getattr(fobj, 'headers', None)
+    finally:
+        fobj.close()
+
+
+def verify_signature(data_filename, signature_filename, keyring):
+    """Raise a SyncError if signature_filename is not a valid signature of
+    data_filename by one of the keys of keyring.
+
+    """
+    args = ['gpgv', '--keyring', keyring, signature_filename, data_filename]
+    try:
+        process = subprocess.run(args, capture_output=True)
+    except OSError as e:
+        raise SyncError(f'could not verify signature: {e}')
+    if process.returncode:
+        logger.debug('gpgv output: %s', process.stderr.decode('utf-8', 'replace'))
+        raise SyncError(f"invalid signature '{signature_filename}'")
+
+
+def _parse_index(data, url):
+    try:
+        index = json.loads(data)
+        if index['version'] != _INDEX_VERSION:
+            raise SyncError(f"unsupported index version in '{url}'")
+        files = {}
+        for filename, entry in index['files'].items():
+            if not filename or '/' in filename or filename.startswith('.'):
+                raise SyncError(f"invalid filename '{filename}' in '{url}'")
+            files[filename] = int(entry['size']), entry['sha256'].lower()
+        return files
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise SyncError(f"invalid index '{url}': {e}")
+
+
+class _RepositorySync:
+    # Fetch the changes of a repository in a staging directory
+
+    def __init__(self, base_url, repo_state, db_dir, staging_dir, downloader, keyring):
+        if not base_url.endswith('/'):
+            base_url += '/'
+        self._base_url = base_url
+        self._repo_state = repo_state
+        self._db_dir = db_dir
+        self._staging_dir = staging_dir
+        self._downloader = downloader
+        self._keyring = keyring
+        # dictionary of filename -> staged path
+        self.staged_files = {}
+        self.new_state = repo_state
+
+    def _local_files_are_intact(self):
+        for filename, sha256 in self._repo_state.get('files', {}).items():
+            if _sha256_file(os.path.join(self._db_dir, filename)) != sha256:
+                return False
+        return True
+
+    def _new_index_request(self, index_url):
+        index_request = request.Request(index_url)
+        # don't make a conditional request if a local file has been modified
+        # or removed, else it would never be restored
+        if self._local_files_are_intact():
+            if self._repo_state.get('etag'):
+                index_request.add_header('If-None-Match', self._repo_state['etag'])
+            if self._repo_state.get('last_modified'):
+                index_request.add_header(
+                    'If-Modified-Since', self._repo_state['last_modified']
+                )
+        return index_request
+
+    def fetch(self):
+        # Fetch the index and the changed catalog files
+        index_url = self._base_url + INDEX_NAME
+        try:
+            index_data, headers = _read_remote(
+                self._downloader, self._new_index_request(index_url)
+            )
+        except NotModifiedError:
+            logger.debug("Index '%s' not modified", index_url)
+            return
+        if self._keyring:
+            self._check_signature(index_url, index_data)
+        files = _parse_index(index_data, index_url)
+        for filename, (size, sha256) in files.items():
+            if _sha256_file(os.path.join(self._db_dir, filename)) != sha256:
+                self._fetch_file(filename, size, sha256)
+        self.new_state = {
+            'etag': headers.get('ETag') if headers else None,
+            'last_modified': headers.get('Last-Modified') if headers else None,
+            'files': {filename: sha256 for filename, (_, sha256) in files.items()},
+        }
+
+    def _check_signature(self, index_url, index_data):
+        index_path = os.path.join(self._staging_dir, INDEX_NAME)
+        signature_path = index_path + SIGNATURE_SUFFIX
+        with open(index_path, 'wb') as fobj:
+            fobj.write(index_data)
+        with open(signature_path, 'wb') as fobj:
+            _read_remote(self._downloader, index_url + SIGNATURE_SUFFIX, fobj)
+        try:
+            verify_signature(index_path, signature_path, self._keyring)
+        finally:
+            os.remove(index_path)
+            os.remove(signature_path)
+
+    def _fetch_file(self, filename, size, sha256):
+        url = self._base_url + filename
+        logger.info("Downloading catalog file '%s'", url)
+        staged_path = os.path.join(self._staging_dir, filename)
+        with open(staged_path, 'wb') as fobj:
+            _read_remote(self._downloader, url, fobj)
+        if os.path.getsize(staged_path) != size:
+            raise SyncError(f"invalid size for '{url}'")
+        if _sha256_file(staged_path) != sha256:
+            raise SyncError(f"invalid sha256 for '{url}'")
+        self.staged_files[filename] = staged_path
+
+    def removed_files(self):
+        old_files = self._repo_state.get('files', {})
+        return set(old_files).difference(self.new_state.get('files', {}))
+
+
+def _read_state(state_path):
+    try:
+        with open(state_path) as fobj:
+            return json.load(fobj)['repositories']
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning("Invalid sync state '%s': %s", state_path, e)
+        return {}
+
+
+def _write_state(state_path, repositories):
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as fobj:
+        json.dump({'repositories': repositories}, fobj)
+    os.replace(tmp_path, state_path)
+
+
+def sync_catalog(urls, db_dir, downloader, keyring=None):
+    """Synchronize the catalog files of db_dir with the repositories urls.
+
+    Every changed file of every repository is downloaded and verified
+    before any file of db_dir is replaced. Files that were synchronized from
+    a repository and that are no longer in its index, or whose repository
+    is no longer in urls, are removed; other files of db_dir are left
+    untouched.
+
+    keyring -- the GnuPG keyring used to check the signature of the
+      indexes, or None to not check them
+
+    Return a tuple (updated filenames, removed filenames).
+
+    """
+    state_path = os.path.join(db_dir, STATE_FILENAME)
+    repositories = _read_state(state_path)
+    staging_dir = tempfile.mkdtemp(prefix='.sync-', dir=db_dir)
+    try:
+        syncs = {}
+        for url in urls:
+            syncs[url] = sync = _RepositorySync(
+                url, repositories.get(url, {}), db_dir, staging_dir, downloader, keyring
+            )
+            sync.fetch()
+
+        owners = {}
+        for url, sync in syncs.items():
+            for filename in sync.new_state.get('files', {}):
+                other_url = owners.setdefault(filename, url)
+                if other_url != url:
+                    raise SyncError(
+                        f"file '{filename}' is in both '{other_url}' and '{url}'"
+                    )
+
+        updated = []
+        removed = []
+        removed_filenames = []
+        for url, sync in syncs.items():
+            for filename, staged_path in sync.staged_files.items():
+                os.replace(staged_path, os.path.join(db_dir, filename))
+                updated.append(filename)
+            removed_filenames.extend(sync.removed_files())
+        for url in set(repositories).difference(syncs):
+            logger.info("Removing the catalog files of repository '%s'", url)
+            removed_filenames.extend(repositories[url].get('files', {}))
+        for filename in removed_filenames:
+            if filename not in owners:
+                try:
+                    os.remove(os.path.join(db_dir, filename))
+                except FileNotFoundError:
+                    pass
+                removed.append(filename)
+        _write_state(state_path, {url: sync.new_state for url, sync in syncs.items()})
+    except OSError as e:
+        raise SyncError(f'could not synchronize catalog: {e}')
+    finally:
+        shutil.rmtree(staging_dir, True)
+    return sorted(updated), sorted(removed)
@@ -0,0 +1,143 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+import xivo_fetchfw.bundle as bundle
+import xivo_fetchfw.storage as storage
+
+CONTENT = b'firmware content'
+
+CATALOG = f"""
+[pkg_foo]
+description: Foo
+version: 1.0
+files: foofw
+depends: bar
+
+[pkg_bar]
+description: Bar
+version: 2.0
+
+[pkg_baz]
+description: Baz
+version: 3.0
+
+[file_foofw]
+url: http://example.org/foo.tar.gz
+size: {len(CONTENT)}
+sha1sum: {hashlib.sha1(CONTENT).hexdigest()}
+"""
+
+
+class TestBundle(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._db_dir = self._new_dir('db')
+        self._cache_dir = self._new_dir('cache')
+        self._bundle_filename = os.path.join(self._tmp_dir, 'test.bundle')
+        with open(os.path.join(self._db_dir, 'catalog.db'), 'w') as fobj:
+            fobj.write(CATALOG)
+        with open(os.path.join(self._cache_dir, 'foo.tar.gz'), 'wb') as fobj:
+            fobj.write(CONTENT)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _new_dir(self, name):
+        path = os.path.join(self._tmp_dir, name)
+        os.mkdir(path)
+        return path
+
+    def _new_pkg_sto(self, db_dir, cache_dir):
+        return storage.new_installable_pkg_storage(
+            db_dir, cache_dir, {'default': Mock()}, {}
+        )
+
+    def _export(self):
+        pkg_sto = self._new_pkg_sto(self._db_dir, self._cache_dir)
+        return bundle.export_bundle(
+            self._bundle_filename, ['foo'], pkg_sto, self._cache_dir
+        )
+
+    def test_export_includes_dependencies(self):
+        pkg_ids = self._export()
+        self.assertEqual(['foo', 'bar'], pkg_ids)
+
+    def test_import_after_export(self):
+        self._export()
+        db_dir = self._new_dir('db2')
+        cache_dir = self._new_dir('cache2')
+
+        pkg_ids = bundle.import_bundle(self._bundle_filename, db_dir, cache_dir)
+
+        self.assertEqual(['foo', 'bar'], pkg_ids)
+        self.assertEqual(1, len(os.listdir(db_dir)))
+        self.assertEqual(['foo.tar.gz'], os.listdir(cache_dir))
+        pkg_sto = self._new_pkg_sto(db_dir, cache_dir)
+        self.assertEqual(['bar', 'foo'], sorted(pkg_sto))
+
+    def test_import_keep_catalogs_of_other_bundles(self):
+        self._export()
+        db_dir = self._new_dir('db2')
+        cache_dir = self._new_dir('cache2')
+        with open(os.path.join(db_dir, 'site.db'), 'w') as fobj:
+            fobj.write('[pkg_bar]\ndescription: Site bar\nversion: 2.1\n')
+        with open(os.path.join(db_dir, 'bundle-000000000000.db'), 'w') as fobj:
+            fobj.write('[pkg_qux]\ndescription: Qux\nversion: 1.0\n')
+
+        bundle.import_bundle(self._bundle_filename, db_dir, cache_dir)
+        bundle.import_bundle(self._bundle_filename, db_dir, cache_dir)
+
+        catalog_filenames = [f for f in os.listdir(db_dir) if not f.startswith('.')]
+        self.assertEqual(3, len(catalog_filenames))
+        pkg_sto = self._new_pkg_sto(db_dir, cache_dir)
+        self.assertEqual(['bar', 'foo', 'qux'], sorted(pkg_sto))
+        self.assertEqual('2.1', pkg_sto['bar'].pkg_info['version'])
+
+    def test_import_invalid_manifest_raise_error(self):
+        with tarfile.open(self._bundle_filename, 'w') as tf:
+            tarinfo = tarfile.TarInfo('MANIFEST.json')
+            tarinfo.size = len(b'{"version": 1}')
+            tf.addfile(tarinfo, io.BytesIO(b'{"version": 1}'))
+
+        self.assertRaises(
+            bundle.BundleError,
+            bundle.import_bundle,
+            self._bundle_filename,
+            self._new_dir('db2'),
+            self._new_dir('cache2'),
+        )
+
+    def test_export_corrupted_cache_file_raise_error(self):
+        with open(os.path.join(self._cache_dir, 'foo.tar.gz'), 'wb') as fobj:
+            fobj.write(CONTENT.upper())
+
+        self.assertRaises(bundle.BundleError, self._export)
+        self.assertFalse(os.path.exists(self._bundle_filename))
+
+    def test_export_missing_cache_file_raise_error(self):
+        os.remove(os.path.join(self._cache_dir, 'foo.tar.gz'))
+
+        self.assertRaises(bundle.BundleError, self._export)
+
+    def test_import_corrupted_bundle_raise_error(self):
+        with tarfile.open(self._bundle_filename, 'w') as tf:
+            tf.add(os.path.join(self._cache_dir, 'foo.tar.gz'), 'cache/foo.tar.gz')
+        cache_dir = self._new_dir('cache2')
+
+        self.assertRaises(
+            bundle.BundleError,
+            bundle.import_bundle,
+            self._bundle_filename,
+            self._new_dir('db2'),
+            cache_dir,
+        )
+        self.assertEqual([], os.listdir(cache_dir))
@@ -0,0 +1,197 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import configparser
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import xivo_fetchfw.catalog as catalog
+
+
+class TestLoadCatalog(unittest.TestCase):
+    def setUp(self):
+        self._db_dir = tempfile.mkdtemp()
+        self._write_file('a.db', '[pkg_a]\nversion: 1.0\n')
+        self._write_file('b.db', '[pkg_b]\nversion: 2.0\nsize: 42\n')
+
+    def tearDown(self):
+        shutil.rmtree(self._db_dir)
+
+    def _write_file(self, filename, content, mtime_ns=None):
+        path = os.path.join(self._db_dir, filename)
+        with open(path, 'w') as fobj:
+            fobj.write(content)
+        if mtime_ns is not None:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def test_config_interface(self):
+        config = catalog.load_catalog(self._db_dir)
+
+        self.assertEqual(['pkg_a', 'pkg_b'], sorted(config.sections()))
+        self.assertEqual('1.0', config.get('pkg_a', 'version'))
+        self.assertEqual(42, config.getint('pkg_b', 'size'))
+        self.assertTrue(config.has_option('pkg_b', 'size'))
+        self.assertFalse(config.has_option('pkg_a', 'size'))
+        self.assertEqual([('version', '1.0')], config.items('pkg_a'))
+
+    def test_snapshot_is_written(self):
+        catalog.load_catalog(self._db_dir)
+
+        self.assertIn(catalog.SNAPSHOT_FILENAME, os.listdir(self._db_dir))
+
+    def test_unchanged_files_are_not_parsed(self):
+        catalog.load_catalog(self._db_dir)
+
+        with patch('xivo_fetchfw.catalog._parse_file') as parse_file:
+            config = catalog.load_catalog(self._db_dir)
+
+        parse_file.assert_not_called()
+        self.assertEqual('2.0', config.get('pkg_b', 'version'))
+
+    def test_changed_file_is_parsed(self):
+        catalog.load_catalog(self._db_dir)
+        self._write_file('b.db', '[pkg_b]\nversion: 3.0\n', mtime_ns=1)
+
+        config = catalog.load_catalog(self._db_dir)
+
+        self.assertEqual('3.0', config.get('pkg_b', 'version'))
+
+    def test_invalid_snapshot_is_ignored(self):
+        self._write_file(catalog.SNAPSHOT_FILENAME, 'garbage')
+
+        config = catalog.load_catalog(self._db_dir)
+
+        self.assertEqual('1.0', config.get('pkg_a', 'version'))
+
+    def test_section_in_many_files_is_merged(self):
+        self._write_file('c.db', '[pkg_a]\nversion: 1.1\ndescription: foo\n')
+
+        config = catalog.load_catalog(self._db_dir)
+
+        self.assertEqual(
+            {'version': '1.1', 'description': 'foo'}, dict(config.items('pkg_a'))
+        )
+
+    def test_default_section_apply_to_every_file(self):
+        self._write_file('c.db', '[DEFAULT]\nsize: 1\n')
+
+        config = catalog.load_catalog(self._db_dir)
+
+        self.assertEqual('1', config.get('pkg_a', 'size'))
+        self.assertEqual('42', config.get('pkg_b', 'size'))
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self._db_dir = tempfile.mkdtemp()
+        self._write_file('a.db', '[pkg_a]\nversion: 1.0\n\n[file_a]\nsize: 1\n')
+        self._catalog = catalog.Catalog(self._db_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self._db_dir)
+
+    def _write_file(self, filename, content):
+        with open(os.path.join(self._db_dir, filename), 'w') as fobj:
+            fobj.write(content)
+
+    def test_first_update_return_all_sections(self):
+        self.assertEqual({'pkg_a', 'file_a'}, self._catalog.update())
+
+    def test_update_return_changed_sections(self):
+        self._catalog.update()
+        self._write_file('a.db', '[pkg_a]\nversion: 1.1\n\n[file_a]\nsize: 1\n')
+        self._write_file('b.db', '[pkg_b]\nversion: 1.0\n')
+
+        self.assertEqual({'pkg_a', 'pkg_b'}, self._catalog.update())
+        self.assertEqual('1.1', self._catalog.config.get('pkg_a', 'version'))
+
+    def test_update_section_in_many_files(self):
+        self._catalog.update()
+        self._write_file('b.db', '[pkg_a]\nversion: 1.1\n')
+
+        self.assertEqual({'pkg_a'}, self._catalog.update())
+        self.assertEqual('1.1', self._catalog.config.get('pkg_a', 'version'))
+
+        os.remove(os.path.join(self._db_dir, 'b.db'))
+
+        self.assertEqual({'pkg_a'}, self._catalog.update())
+        self.assertEqual('1.0', self._catalog.config.get('pkg_a', 'version'))
+
+    def test_update_return_removed_sections(self):
+        self._catalog.update()
+        os.remove(os.path.join(self._db_dir, 'a.db'))
+
+        self.assertEqual({'pkg_a', 'file_a'}, self._catalog.update())
+        self.assertEqual([], self._catalog.config.sections())
+
+    def test_read_update_doesnt_change_catalog(self):
+        self._catalog.update()
+        self._write_file('a.db', '[pkg_a]\nversion: 1.1\n')
+        self._write_file('b.db', '[pkg_b]\nversion: 1.0\n')
+
+        update = self._catalog.read_update()
+
+        self.assertEqual({'pkg_a', 'file_a', 'pkg_b'}, update.changed_sections)
+        self.assertEqual(['pkg_a', 'pkg_b'], sorted(update.config.sections()))
+        self.assertEqual('1.1', update.config.get('pkg_a', 'version'))
+        self.assertEqual(['file_a', 'pkg_a'], sorted(self._catalog.config.sections()))
+        self.assertEqual('1.0', self._catalog.config.get('pkg_a', 'version'))
+        self.assertEqual(
+            update.changed_sections, self._catalog.read_update().changed_sections
+        )
+
+        self.assertEqual(update.changed_sections, self._catalog.apply_update(update))
+        self.assertEqual('1.1', self._catalog.config.get('pkg_a', 'version'))
+        self.assertEqual(set(), self._catalog.update())
+
+
+class TestParseCatalog(unittest.TestCase):
+    def _parse(self, content):
+        return catalog.parse_catalog(content.splitlines(True), 'a.db')
+
+    def test_same_result_as_config_parser(self):
+        content = (
+            '# comment\n'
+            '[pkg_a]\n'
+            'Version = 1.0\n'
+            '; comment\n'
+            'url: http://example.org/a=b\n'
+            '    http://example.org/c\n'
+            '\n'
+            '    http://example.org/d\n'
+            '\n'
+            'empty:\n'
+            '[file_a]\n'
+            'size :42\n'
+        )
+        config = configparser.RawConfigParser()
+        config.read_string(content)
+        expected = [
+            (section, dict(config.items(section))) for section in config.sections()
+        ]
+
+        self.assertEqual(expected, self._parse(content))
+
+    def test_default_section(self):
+        sections = self._parse('[DEFAULT]\na: 1\nb: 2\n[pkg_a]\nb: 3\n')
+
+        self.assertEqual([('pkg_a', {'a': '1', 'b': '3'})], sections)
+
+    def test_missing_section_header_raise_error(self):
+        with self.assertRaisesRegex(catalog.CatalogError, r'^a\.db:2: '):
+            self._parse('# comment\nversion: 1.0\n')
+
+    def test_invalid_line_raise_error(self):
+        with self.assertRaisesRegex(catalog.CatalogError, r'^a\.db:3: '):
+            self._parse('[pkg_a]\nversion: 1.0\nfoo\n')
+
+    def test_duplicate_option_raise_error(self):
+        with self.assertRaisesRegex(catalog.CatalogError, r'^a\.db:3: '):
+            self._parse('[pkg_a]\nversion: 1.0\nVERSION: 2.0\n')
+
+    def test_duplicate_section_raise_error(self):
+        with self.assertRaisesRegex(catalog.CatalogError, r'^a\.db:3: '):
+            self._parse('[pkg_a]\n\n[pkg_a]\n')
@@ -0,0 +1,209 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, Mock
+
+from xivo_fetchfw import cli, daemon, storage
+
+
+class _RecordingUserInterface(cli.ConsoleUserInterface):
+    def __init__(self, answer):
+        self.answer = answer
+        self.messages = []
+        self.questions = []
+
+    def message(self, text=''):
+        self.messages.append(text)
+
+    def confirm(self, question):
+        self.questions.append(question)
+        return self.answer
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._socket_path = os.path.join(self._tmp_dir, 'fetchfwd.sock')
+        self._pkg_mgr = MagicMock()
+        self._pkg_mgr.installable_pkg_sto.__len__.return_value = 3
+        self._pkg_mgr.installed_pkg_sto.__len__.return_value = 1
+        self._pkg_mgr.get_reinstalled_pkgs.return_value = []
+        config_dict = {
+            'general.db_dir': self._tmp_dir,
+            'general.root_dir': '/',
+            'general.download_windows': '',
+        }
+        self._deadline = Mock()
+        self._config_filename = os.path.join(self._tmp_dir, 'xivo-fetchfw.conf')
+        self._server = daemon.DaemonServer(
+            self._socket_path,
+            self._pkg_mgr,
+            config_dict,
+            self._deadline,
+            self._config_filename,
+        )
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+        self._client = daemon.DaemonClient(self._socket_path)
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        shutil.rmtree(self._tmp_dir)
+
+    def _install_calling_pre_download(self, pkg_ids, root_dir, ctrl_factory):
+        ctrl = ctrl_factory(
+            self._pkg_mgr.installable_pkg_sto, self._pkg_mgr.installed_pkg_sto
+        )
+        ctrl.pre_download([Mock(size=2 * 1000**2)])
+        ctrl.pre_install_pkg(Mock(pkg_info={'id': pkg_ids[0]}))
+
+    def test_status(self):
+        result = self._client.call('status')
+
+        self.assertEqual({'pid': os.getpid(), 'installable': 3, 'installed': 1}, result)
+        self._pkg_mgr.installable_pkg_sto.reload.assert_called_once_with()
+        self._pkg_mgr.installed_pkg_sto.reload.assert_called_once_with()
+
+    def test_deadline_is_reset_on_each_request(self):
+        self._client.call('status')
+        self._client.call('status')
+
+        self.assertEqual(2, self._deadline.reset.call_count)
+
+    def test_unknown_method_raise_error(self):
+        self.assertRaises(daemon.DaemonError, self._client.call, 'foo')
+
+    def test_install_confirmed(self):
+        self._pkg_mgr.install.side_effect = self._install_calling_pre_download
+        ui = _RecordingUserInterface(True)
+
+        self._client.call('install', {'packages': ['foo'], 'root': '/tmp/root'}, ui)
+
+        self.assertEqual(['Proceed with installation? [Y/n] '], ui.questions)
+        self.assertEqual(
+            ['Total Download Size:    2.00 MB', '', 'Installing foo...'], ui.messages
+        )
+        self.assertEqual(['foo'], self._pkg_mgr.install.call_args[0][0])
+        self.assertEqual('/tmp/root', self._pkg_mgr.install.call_args[0][1])
+
+    def test_install_cancelled(self):
+        self._pkg_mgr.install.side_effect = self._install_calling_pre_download
+        ui = _RecordingUserInterface(False)
+
+        self.assertRaises(
+            cli.UserCancellationError,
+            self._client.call,
+            'install',
+            {'packages': ['foo']},
+            ui,
+        )
+        self.assertNotIn('Installing foo...', ui.messages)
+
+    def test_install_unanswered_question_is_answered_no(self):
+        self._pkg_mgr.install.side_effect = self._install_calling_pre_download
+        self._server.confirm_timeout = 0.1
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self._socket_path)
+        with sock, sock.makefile('rb') as rfile, sock.makefile('wb') as wfile:
+            connection = daemon._Connection(rfile, wfile)
+            connection.send({'method': 'install', 'params': {'packages': ['foo']}})
+            message = connection.receive()
+            while 'event' in message:
+                # the question is never answered
+                message = connection.receive()
+
+        self.assertTrue(message['error']['cancelled'])
+
+    def test_other_config_file_raise_error(self):
+        client = daemon.DaemonClient(self._socket_path, '/etc/other.conf')
+
+        self.assertRaises(daemon.DaemonError, client.call, 'status')
+
+    def test_same_config_file(self):
+        client = daemon.DaemonClient(self._socket_path, self._config_filename)
+
+        self.assertEqual(3, client.call('status')['installable'])
+
+    def test_debug_logs_are_forwarded(self):
+        def install(pkg_ids, root_dir, ctrl_factory):
+            logging.getLogger('xivo_fetchfw.test').debug('installing %s', pkg_ids[0])
+
+        self._pkg_mgr.install.side_effect = install
+        client = daemon.DaemonClient(self._socket_path, debug=True)
+
+        with self.assertLogs(daemon.logger, logging.DEBUG) as cm:
+            client.call('install', {'packages': ['foo']})
+
+        self.assertIn('installing foo', [record.getMessage() for record in cm.records])
+
+    def test_debug_logs_of_other_threads_are_not_forwarded(self):
+        def install(pkg_ids, root_dir, ctrl_factory):
+            thread = threading.Thread(
+                target=logging.getLogger('xivo_fetchfw.test').debug,
+                args=('other thread',),
+            )
+            thread.start()
+            thread.join()
+
+        self._pkg_mgr.install.side_effect = install
+        client = daemon.DaemonClient(self._socket_path, debug=True)
+
+        with self.assertLogs(daemon.logger, logging.DEBUG) as cm:
+            client.call('install', {'packages': ['foo']})
+
+        messages = [record.getMessage() for record in cm.records]
+        self.assertNotIn('other thread', messages)
+
+    def test_install_relative_root_raise_error(self):
+        self.assertRaises(
+            daemon.DaemonError,
+            self._client.call,
+            'install',
+            {'packages': ['foo'], 'root': 'root'},
+        )
+        self.assertFalse(self._pkg_mgr.install.called)
+
+    def test_socket_is_private(self):
+        self.assertEqual(0o600, os.stat(self._socket_path).st_mode & 0o777)
+
+    def test_status_with_sqlite_installed_storage(self):
+        # the storage is created in this thread and used in the request one
+        self._pkg_mgr.installed_pkg_sto = storage.new_sqlite_installed_pkg_storage(
+            os.path.join(self._tmp_dir, 'installed.sqlite')
+        )
+        self.addCleanup(self._pkg_mgr.installed_pkg_sto.close)
+
+        result = self._client.call('status')
+
+        self.assertEqual(0, result['installed'])
+
+
+class TestDaemonServer(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._socket_path = os.path.join(self._tmp_dir, 'fetchfwd.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_stale_socket_is_removed(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self._socket_path)
+        sock.close()
+        self.assertFalse(daemon.is_running(self._socket_path))
+
+        server = daemon.DaemonServer(self._socket_path, MagicMock(), {})
+        try:
+            self.assertTrue(daemon.is_running(self._socket_path))
+        finally:
+            server.server_close()
+        self.assertFalse(os.path.exists(self._socket_path))
@@ -0,0 +1,69 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import bz2
+import unittest
+
+import xivo_fetchfw.delta as delta
+
+
+def _offtout(value):
+    if value < 0:
+        return ((-value) | (1 << 63)).to_bytes(8, 'little')
+    return value.to_bytes(8, 'little')
+
+
+def new_patch(controls, diff, extra, new_size):
+    # Return a bsdiff patch from its (uncompressed) blocks
+    ctrl_block = bz2.compress(b''.join(_offtout(v) for ctrl in controls for v in ctrl))
+    diff_block = bz2.compress(diff)
+    extra_block = bz2.compress(extra)
+    header = (
+        b'BSDIFF40'
+        + _offtout(len(ctrl_block))
+        + _offtout(len(diff_block))
+        + _offtout(new_size)
+    )
+    return header + ctrl_block + diff_block + extra_block
+
+
+def new_simple_patch(old_data, new_data):
+    # Return a patch containing a single diff of old_data and new_data
+    diff = bytes(
+        (n - (old_data[i] if i < len(old_data) else 0)) & 0xFF
+        for i, n in enumerate(new_data)
+    )
+    return new_patch([(len(new_data), 0, 0)], diff, b'', len(new_data))
+
+
+class TestApplyPatch(unittest.TestCase):
+    def test_simple_diff(self):
+        old_data = b'firmware version 1.0'
+        new_data = b'firmware version 1.1'
+        patch = new_simple_patch(old_data, new_data)
+        self.assertEqual(new_data, delta.apply_patch(old_data, patch))
+
+    def test_new_data_longer_than_old_data(self):
+        old_data = b'abc'
+        new_data = b'abcdef'
+        patch = new_simple_patch(old_data, new_data)
+        self.assertEqual(new_data, delta.apply_patch(old_data, patch))
+
+    def test_diff_extra_and_seek(self):
+        old_data = b'0123456789'
+        controls = [(2, 3, 4), (2, 0, 0)]
+        diff = b'\x00\x01\x00\x00'
+        extra = b'xyz'
+        patch = new_patch(controls, diff, extra, 7)
+        self.assertEqual(b'02xyz67', delta.apply_patch(old_data, patch))
+
+    def test_invalid_header_raise_error(self):
+        self.assertRaises(delta.DeltaError, delta.apply_patch, b'', b'foobar')
+
+    def test_truncated_control_block_raise_error(self):
+        patch = new_patch([], b'', b'', 10)
+        self.assertRaises(delta.DeltaError, delta.apply_patch, b'', patch)
+
+    def test_corrupted_block_raise_error(self):
+        patch = new_simple_patch(b'abc', b'abd')
+        self.assertRaises(delta.DeltaError, delta.apply_patch, b'abc', patch[:-4])
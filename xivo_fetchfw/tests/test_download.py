@@ -1,14 +1,16 @@
-# Copyright 2013-2023 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2013-2026 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import hashlib
+import io
 import os
 import shutil
 import tempfile
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 import xivo_fetchfw.download as download
+from xivo_fetchfw.tests.test_delta import new_simple_patch
 
 CONTENT = b'foobar'
 CORRUPTED_CONTENT = b'barfoo'
@@ -82,6 +84,146 @@ class TestBaseRemoteFile(unittest.TestCase):
         self._hook.stop.method_calls = []
 
 
+class TestBaseRemoteFilePipelined(unittest.TestCase):
+    URL = 'dummy_url'
+
+    def setUp(self):
+        self._downloader = Mock()
+        self._downloader.download.return_value = io.BytesIO(CONTENT * 50000)
+        self._hook = Mock()
+
+    def _new_remote_file(self):
+        return download.BaseRemoteFile(self.URL, self._downloader, pipelined=True)
+
+    def test_hooks_receive_all_data_in_order(self):
+        hook = download._BufferHook()
+        self._new_remote_file().download([hook])
+        self.assertEqual(CONTENT * 50000, hook.getvalue())
+
+    def test_hook_complete_and_stop_called_on_success(self):
+        self._new_remote_file().download([self._hook])
+        self._hook.start.assert_called_once_with()
+        self._hook.complete.assert_called_once_with()
+        self._hook.stop.assert_called_once_with()
+        self._hook.fail.assert_not_called()
+
+    def test_hook_fail_called_on_update_failure(self):
+        dummy_exception = Exception('dummy')
+        self._hook.update.side_effect = dummy_exception
+        other_hook = Mock()
+
+        self.assertRaises(
+            Exception, self._new_remote_file().download, [self._hook, other_hook]
+        )
+        self._hook.complete.assert_not_called()
+        self._hook.fail.assert_called_once_with(dummy_exception)
+        other_hook.fail.assert_called_once_with(dummy_exception)
+        self._hook.stop.assert_called_once_with()
+
+
+class TestBaseRemoteFileRetry(unittest.TestCase):
+    def test_mirror_is_tried_on_download_error(self):
+        downloader = Mock()
+        downloader.download.side_effect = [
+            download.DownloadError(),
+            io.BytesIO(CONTENT),
+        ]
+        hook = Mock()
+        rfile = download.BaseRemoteFile('url', downloader, mirror_urls=['mirror_url'])
+
+        rfile.download([hook])
+
+        downloader.download.assert_called_with('mirror_url')
+        hook.update.assert_called_once_with(CONTENT)
+        hook.fail.assert_called_once()
+        hook.complete.assert_called_once_with()
+
+    def test_url_is_retried(self):
+        downloader = Mock()
+        downloader.download.side_effect = [
+            download.DownloadError(),
+            io.BytesIO(CONTENT),
+        ]
+        rfile = download.BaseRemoteFile('url', downloader, retries=1)
+
+        rfile.download()
+
+        self.assertEqual(2, downloader.download.call_count)
+
+    def test_last_error_is_raised(self):
+        downloader = Mock()
+        downloader.download.side_effect = download.StalledDownloadError()
+        rfile = download.BaseRemoteFile('url', downloader, mirror_urls=['mirror_url'])
+
+        self.assertRaises(download.StalledDownloadError, rfile.download)
+        self.assertEqual(2, downloader.download.call_count)
+
+    def test_deadline_exceeded_is_not_retried(self):
+        downloader = Mock()
+        downloader.download.side_effect = download.DeadlineExceededError()
+        rfile = download.BaseRemoteFile('url', downloader, mirror_urls=['mirror_url'])
+
+        self.assertRaises(download.DeadlineExceededError, rfile.download)
+        downloader.download.assert_called_once_with('url')
+
+
+class TestMonitoredFile(unittest.TestCase):
+    def _new_fobj(self, chunks):
+        fobj = Mock()
+        fobj.read.side_effect = chunks
+        return fobj
+
+    @patch('xivo_fetchfw.download.time.monotonic')
+    def test_low_speed_raise_error(self, monotonic):
+        monotonic.side_effect = [0, 31]
+        fobj = self._new_fobj([b'foo'])
+        mfile = download._MonitoredFile(fobj, 0, 1024, 30, None)
+
+        self.assertRaises(download.StalledDownloadError, mfile.read, 4096)
+
+    @patch('xivo_fetchfw.download.time.monotonic')
+    def test_high_speed_is_ok(self, monotonic):
+        monotonic.side_effect = [0, 31]
+        fobj = self._new_fobj([b'x' * 40000])
+        mfile = download._MonitoredFile(fobj, 0, 1024, 30, None)
+
+        self.assertEqual(40000, len(mfile.read(40000)))
+
+    @patch('xivo_fetchfw.download.time.monotonic')
+    def test_file_timeout_raise_error(self, monotonic):
+        monotonic.side_effect = [0, 1, 11]
+        fobj = self._new_fobj([b'foo'])
+        mfile = download._MonitoredFile(fobj, 10, 0, 0, None)
+
+        self.assertRaises(download.StalledDownloadError, mfile.read, 4096)
+
+    def test_socket_timeout_raise_error(self):
+        fobj = self._new_fobj(TimeoutError())
+        mfile = download._MonitoredFile(fobj, 0, 1024, 30, None)
+
+        self.assertRaises(download.StalledDownloadError, mfile.read, 4096)
+
+    def test_exceeded_deadline_raise_error(self):
+        fobj = self._new_fobj([b'foo'])
+        mfile = download._MonitoredFile(fobj, 0, 0, 0, download.Deadline(0))
+
+        self.assertRaises(download.DeadlineExceededError, mfile.read, 4096)
+
+
+class TestDeadline(unittest.TestCase):
+    @patch('time.monotonic')
+    def test_reset_restart_deadline(self, monotonic):
+        monotonic.return_value = 100.0
+        deadline = download.Deadline(10)
+        deadline.remaining()
+        monotonic.return_value = 120.0
+        self.assertRaises(download.DeadlineExceededError, deadline.check)
+
+        deadline.reset()
+
+        self.assertEqual(10.0, deadline.remaining())
+
+
 class TestWriteToFileHook(unittest.TestCase):
     FILENAME = 'file.bin'
 
@@ -116,6 +258,12 @@ class TestWriteToFileHook(unittest.TestCase):
         self._hook.stop()
         self.assertEqual([], os.listdir(self._tmp_dir))
 
+    def test_partial_file_kept_on_pause(self):
+        self._hook.update(CONTENT)
+        self._hook.fail(download.DownloadPausedError())
+        self._hook.stop()
+        self.assertEqual([self.FILENAME + '.part'], os.listdir(self._tmp_dir))
+
     def test_factory_class(self):
         # this test look into private attribute of the instance, so if it
         # breaks, check if the private attribute have not changed
@@ -177,6 +325,143 @@ class TestAbortHook(unittest.TestCase):
         self._hook.fail(Exception('dummy'))
 
 
+class TestRemoteFileDelta(unittest.TestCase):
+    OLD_CONTENT = b'firmware 1.0'
+    NEW_CONTENT = b'firmware 1.1'
+
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._base_path = os.path.join(self._tmp_dir, 'fw-1.0.bin')
+        self._path = os.path.join(self._tmp_dir, 'fw-1.1.bin')
+        with open(self._base_path, 'wb') as fobj:
+            fobj.write(self.OLD_CONTENT)
+        self._patch = new_simple_patch(self.OLD_CONTENT, self.NEW_CONTENT)
+        self._downloader = Mock()
+        self._downloader.download.side_effect = self._download
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _download(self, url):
+        if url == 'patch_url':
+            return io.BytesIO(self._patch)
+        return io.BytesIO(self.NEW_CONTENT)
+
+    def _new_remote_file(self, base_sha1sum=None):
+        if base_sha1sum is None:
+            base_sha1sum = hashlib.sha1(self.OLD_CONTENT).digest()
+        delta = download.DeltaPatch.new_delta_patch(
+            self._base_path,
+            base_sha1sum,
+            'patch_url',
+            hashlib.sha1(self._patch).digest(),
+            self._downloader,
+        )
+        return download.RemoteFile.new_remote_file(
+            self._path,
+            len(self.NEW_CONTENT),
+            'url',
+            self._downloader,
+            [download.SHA1Hook.create_factory(hashlib.sha1(self.NEW_CONTENT).digest())],
+            [delta],
+        )
+
+    def _read_file_content(self):
+        with open(self._path, 'rb') as fobj:
+            return fobj.read()
+
+    def test_delta_is_used_when_base_is_present(self):
+        rfile = self._new_remote_file()
+        rfile.download(use_deltas=True)
+        self.assertEqual(self.NEW_CONTENT, self._read_file_content())
+        self._downloader.download.assert_called_once_with('patch_url')
+
+    def test_delta_not_used_by_default(self):
+        rfile = self._new_remote_file()
+        rfile.download()
+        self.assertEqual(self.NEW_CONTENT, self._read_file_content())
+        self._downloader.download.assert_called_once_with('url')
+
+    def test_full_download_when_base_sha1sum_differ(self):
+        rfile = self._new_remote_file(base_sha1sum=b'\x00' * 20)
+        rfile.download(use_deltas=True)
+        self.assertEqual(self.NEW_CONTENT, self._read_file_content())
+        self._downloader.download.assert_called_once_with('url')
+
+    def test_full_download_when_rebuilt_file_is_corrupted(self):
+        self._patch = new_simple_patch(self.OLD_CONTENT, b'firmware 6.6')
+        rfile = self._new_remote_file()
+        rfile.download(use_deltas=True)
+        self.assertEqual(self.NEW_CONTENT, self._read_file_content())
+        self.assertEqual(2, self._downloader.download.call_count)
+
+
+class _PauseHook(download.DownloadHook):
+    def __init__(self, size):
+        self._size = size
+
+    def update(self, arg):
+        self._size -= len(arg)
+        if self._size <= 0:
+            raise download.DownloadPausedError()
+
+
+class TestRemoteFileResume(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._tmp_dir, 'fw.bin')
+        self._downloader = Mock()
+        self._downloader.download.side_effect = self._download
+        self._rfile = download.RemoteFile.new_remote_file(
+            self._path, len(CONTENT), 'url', self._downloader
+        )
+        block_size_patcher = patch.object(download.BaseRemoteFile, '_BLOCK_SIZE', 2)
+        block_size_patcher.start()
+        self.addCleanup(block_size_patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _download(self, url, offset=0):
+        return io.BytesIO(CONTENT[offset:])
+
+    def test_paused_download_is_resumed(self):
+        self.assertRaises(
+            download.DownloadPausedError, self._rfile.download, [_PauseHook(4)]
+        )
+        self.assertEqual(['fw.bin.part'], os.listdir(self._tmp_dir))
+
+        self._rfile.download()
+
+        with open(self._path, 'rb') as fobj:
+            self.assertEqual(CONTENT, fobj.read())
+        self.assertEqual(['fw.bin'], os.listdir(self._tmp_dir))
+        self._downloader.download.assert_called_with('url', offset=2)
+
+    def test_partial_file_kept_when_paused_during_resume(self):
+        self.assertRaises(
+            download.DownloadPausedError, self._rfile.download, [_PauseHook(6)]
+        )
+        self.assertRaises(
+            download.DownloadPausedError, self._rfile.download, [_PauseHook(2)]
+        )
+        self.assertEqual(4, os.path.getsize(self._rfile.partial_path))
+
+        self._rfile.download()
+
+        with open(self._path, 'rb') as fobj:
+            self.assertEqual(CONTENT, fobj.read())
+        self._downloader.download.assert_called_with('url', offset=4)
+
+    def test_partial_file_removed_on_error(self):
+        with open(self._rfile.partial_path, 'wb') as fobj:
+            fobj.write(CONTENT[:4])
+        self._downloader.download.side_effect = download.DownloadError()
+
+        self.assertRaises(download.DownloadError, self._rfile.download)
+        self.assertEqual([], os.listdir(self._tmp_dir))
+
+
 class TestHelperFunctions(unittest.TestCase):
     def test_new_downloaders_has_correct_keys(self):
         dlers = download.new_downloaders()
@@ -0,0 +1,88 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import errno
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from xivo_fetchfw import fastcopy
+
+
+def _unsupported(*args):
+    raise OSError(errno.EOPNOTSUPP, 'not supported')
+
+
+class TestCopyFile(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._src = os.path.join(self._tmp_dir, 'src')
+        self._dst = os.path.join(self._tmp_dir, 'dst')
+        with open(self._src, 'wb') as fobj:
+            fobj.write(b'foobar')
+        os.chmod(self._src, 0o640)
+        patcher = patch.dict(fastcopy._unsupported_methods, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(fastcopy, 'stats', fastcopy.CopyStats())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _assert_copied(self):
+        with open(self._dst, 'rb') as fobj:
+            self.assertEqual(b'foobar', fobj.read())
+        self.assertEqual(0o640, stat.S_IMODE(os.stat(self._dst).st_mode))
+        self.assertFalse(os.path.samefile(self._src, self._dst))
+
+    def test_copy_file(self):
+        method = fastcopy.copy_file(self._src, self._dst)
+
+        self._assert_copied()
+        self.assertIn(method, [fastcopy.REFLINK, fastcopy.COPY_FILE_RANGE])
+        self.assertEqual(6, fastcopy.stats.get(method))
+
+    def test_copy_file_allow_link(self):
+        with open(self._dst, 'wb') as fobj:
+            fobj.write(b'old')
+
+        method = fastcopy.copy_file(self._src, self._dst, allow_link=True)
+
+        self.assertEqual(fastcopy.HARDLINK, method)
+        self.assertTrue(os.path.samefile(self._src, self._dst))
+        self.assertEqual(6, fastcopy.stats.linked_bytes)
+        self.assertEqual(0, fastcopy.stats.copied_bytes)
+
+    @patch('xivo_fetchfw.fastcopy._FD_METHODS', [('reflink', _unsupported)])
+    def test_unsupported_method_fall_back_and_is_remembered(self):
+        method = fastcopy.copy_file(self._src, self._dst)
+
+        self._assert_copied()
+        self.assertEqual(fastcopy.COPY, method)
+        with patch('xivo_fetchfw.fastcopy._FD_METHODS', []) as fd_methods:
+            fd_methods.append(('reflink', self.fail))
+            fastcopy.copy_file(self._src, self._dst)
+        self.assertEqual(12, fastcopy.stats.copied_bytes)
+
+    def test_link_not_permitted_fall_back_for_file_only(self):
+        with patch('os.link', side_effect=OSError(errno.EPERM, 'not permitted')):
+            method = fastcopy.copy_file(self._src, self._dst, allow_link=True)
+
+        self._assert_copied()
+        self.assertNotEqual(fastcopy.HARDLINK, method)
+        method = fastcopy.copy_file(self._src, self._dst, allow_link=True)
+        self.assertEqual(fastcopy.HARDLINK, method)
+
+    def test_copy_to_directory(self):
+        dst_dir = os.path.join(self._tmp_dir, 'dir')
+        os.mkdir(dst_dir)
+
+        dst = fastcopy.copy(self._src, dst_dir)
+
+        self.assertEqual(os.path.join(dst_dir, 'src'), dst)
+        self.assertTrue(os.path.isfile(dst))
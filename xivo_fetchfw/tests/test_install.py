@@ -1,10 +1,14 @@
-# Copyright 2013-2023 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2013-2026 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import io
 import os
 import shutil
+import tarfile
 import tempfile
+import threading
 import unittest
+import zipfile
 
 import xivo_fetchfw.install as install
 from xivo_fetchfw.util import list_paths
@@ -79,6 +83,149 @@ class TestTbz2Filter(_TestStandardExtractFilter, unittest.TestCase):
     _FILTER = install.TarFilter
 
 
+class TestMultipleArchivesExtractFilter(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._src_dir = os.path.join(self._tmp_dir, 'src')
+        self._dst_dir = os.path.join(self._tmp_dir, 'dst')
+        os.mkdir(self._src_dir)
+        os.mkdir(self._dst_dir)
+        self._add_zip('a.zip', {'common.txt': 'a\n', 'dir/a.txt': 'a\n'})
+        self._add_zip('b.zip', {'common.txt': 'b\n', 'dir/b.txt': 'b\n'})
+        self._add_zip('c.zip', {'common.txt': 'c\n', 'dir/c.txt': 'c\n'})
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _add_zip(self, filename, files):
+        with zipfile.ZipFile(os.path.join(self._src_dir, filename), 'w') as zf:
+            for name, content in files.items():
+                zf.writestr(name, content)
+
+    def _read_file(self, filename):
+        with open(os.path.join(self._dst_dir, filename)) as fobj:
+            return fobj.read()
+
+    def test_later_archive_wins(self):
+        filter = install.ZipFilter(['a.zip', 'b.zip'], max_workers=2)
+        filter.apply(self._src_dir, self._dst_dir)
+
+        self.assertEqual(
+            ['common.txt', 'dir/', 'dir/a.txt', 'dir/b.txt'],
+            sorted(list_paths(self._dst_dir)),
+        )
+        self.assertEqual('b\n', self._read_file('common.txt'))
+
+    def test_same_result_as_sequential_extraction(self):
+        filter = install.ZipFilter('*.zip', max_workers=3)
+        filter.apply(self._src_dir, self._dst_dir)
+        seq_dst_dir = os.path.join(self._tmp_dir, 'seq')
+        os.mkdir(seq_dst_dir)
+        seq_filter = install.ZipFilter('*.zip', max_workers=1)
+        seq_filter.apply(self._src_dir, seq_dst_dir)
+
+        self.assertEqual(
+            sorted(list_paths(seq_dst_dir)), sorted(list_paths(self._dst_dir))
+        )
+        self.assertEqual('c\n', self._read_file('common.txt'))
+
+    def test_invalid_archive_raise_error(self):
+        _create_file(self._src_dir, 'b.zip', 'not a zip\n')
+        filter = install.ZipFilter('*.zip', max_workers=3)
+
+        self.assertRaises(
+            zipfile.BadZipFile, filter.apply, self._src_dir, self._dst_dir
+        )
+        self.assertEqual([], os.listdir(self._dst_dir))
+
+
+class TestSelectiveExtractFilter(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._src_dir = os.path.join(self._tmp_dir, 'src')
+        self._dst_dir = os.path.join(self._tmp_dir, 'dst')
+        os.mkdir(self._src_dir)
+        os.mkdir(self._dst_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _add_tar(self, filename, files, links=None):
+        with tarfile.open(os.path.join(self._src_dir, filename), 'w:gz') as tf:
+            for name, content in files.items():
+                data = content.encode('utf-8')
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.size = len(data)
+                tf.addfile(tarinfo, io.BytesIO(data))
+            for name, target in (links or {}).items():
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.type = tarfile.SYMTYPE
+                tarinfo.linkname = target
+                tf.addfile(tarinfo)
+
+    def test_zip_filter(self):
+        with zipfile.ZipFile(os.path.join(self._src_dir, 'a.zip'), 'w') as zf:
+            for name in ['a.txt', 'dir1/b.txt', 'dir1/c.bin', 'dir2/d.bin']:
+                zf.writestr(name, 'test\n')
+        filter = install.ZipFilter('a.zip')
+        filter.apply_selected(
+            self._src_dir, self._dst_dir, install._PathPredicate(['dir1/*.txt'])
+        )
+
+        self.assertEqual(
+            ['dir1/', 'dir1/b.txt', 'dir2/'], sorted(list_paths(self._dst_dir))
+        )
+
+    def test_tar_filter(self):
+        self._add_tar('a.tgz', {'a.txt': 'a\n', 'dir1/b.txt': 'b\n', 'c.txt': 'c\n'})
+        filter = install.TarFilter('a.tgz')
+        filter.apply_selected(
+            self._src_dir, self._dst_dir, install._PathPredicate(['dir1'])
+        )
+
+        self.assertEqual(['dir1/', 'dir1/b.txt'], sorted(list_paths(self._dst_dir)))
+
+    def test_tar_filter_extract_everything_when_link_is_selected(self):
+        self._add_tar(
+            'a.tgz', {'a.txt': 'a\n', 'b.txt': 'b\n'}, links={'link': 'a.txt'}
+        )
+        filter = install.TarFilter('a.tgz')
+        filter.apply_selected(
+            self._src_dir, self._dst_dir, install._PathPredicate(['link'])
+        )
+
+        self.assertEqual(['a.txt', 'b.txt', 'link'], sorted(list_paths(self._dst_dir)))
+        with open(os.path.join(self._dst_dir, 'link')) as fobj:
+            self.assertEqual('a\n', fobj.read())
+
+    def test_tar_filter_extract_target_of_link_to_parent_directory(self):
+        self._add_tar(
+            'a.tgz',
+            {'fw_v2/a.bin': 'a\n', 'fw_v2/b.txt': 'b\n'},
+            links={'firmware': 'fw_v2'},
+        )
+        filter = install.TarFilter('a.tgz')
+        filter.apply_selected(
+            self._src_dir, self._dst_dir, install._PathPredicate(['firmware/*.bin'])
+        )
+
+        with open(os.path.join(self._dst_dir, 'firmware', 'a.bin')) as fobj:
+            self.assertEqual('a\n', fobj.read())
+
+    def test_cp_through_link_to_parent_directory(self):
+        self._add_tar('a.tgz', {'fw_v2/a.bin': 'a\n'}, links={'firmware': 'fw_v2'})
+        untar_filter = install.TarFilter('a.tgz')
+        cp_filter = install.CopyFilter(['firmware/*.bin'], 'out/')
+        extract_dir = os.path.join(self._tmp_dir, 'extract')
+        os.mkdir(extract_dir)
+        untar_filter.apply_selected(
+            self._src_dir, extract_dir, cp_filter.input_predicate()
+        )
+        cp_filter.apply(extract_dir, self._dst_dir)
+
+        self.assertEqual(['out/', 'out/a.bin'], sorted(list_paths(self._dst_dir)))
+
+
 class TestCiscoUnsignFilter(_TestStandardExtractFilter, unittest.TestCase):
     def test_filter(self):
         filter = install.CiscoUnsignFilter('test-fake.sgn', 'test-fake.gz')
@@ -108,6 +255,17 @@ class TestExcludeFilter(unittest.TestCase):
         filter.apply(self._tmp_src_dir, self._tmp_dst_dir)
         self.assertEqual(['file2'], sorted(list_paths(self._tmp_dst_dir)))
 
+    def test_link_files(self):
+        self._create_file('file1')
+        filter = install.ExcludeFilter(['file2'], link_files=True)
+        filter.apply(self._tmp_src_dir, self._tmp_dst_dir)
+        self.assertTrue(
+            os.path.samefile(
+                os.path.join(self._tmp_src_dir, 'file1'),
+                os.path.join(self._tmp_dst_dir, 'file1'),
+            )
+        )
+
     def test_exclude_files_inside_directory(self):
         self._create_dir('dir1')
         self._create_file('dir1/file1')
@@ -196,6 +354,43 @@ class TestCopyFilter(unittest.TestCase):
             ['dir/', 'dir/dir1/', 'dir/dir2/'], sorted(list_paths(self._tmp_dst_dir))
         )
 
+    def test_link_files_links_files_of_src_directory(self):
+        self._create_dir('dir1')
+        self._create_file('dir1/file1')
+        self._create_file('file2')
+        filter = install.CopyFilter(['dir1', 'file2'], 'dir/', link_files=True)
+        filter.apply(self._tmp_src_dir, self._tmp_dst_dir)
+        for path in ['dir1/file1', 'file2']:
+            self.assertTrue(
+                os.path.samefile(
+                    os.path.join(self._tmp_src_dir, path),
+                    os.path.join(self._tmp_dst_dir, 'dir', path),
+                )
+            )
+
+    def test_link_files_copies_files_outside_src_directory(self):
+        outside_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outside_dir)
+        _create_file(outside_dir, 'file1')
+        os.symlink(
+            os.path.join(outside_dir, 'file1'), os.path.join(self._tmp_src_dir, 'file1')
+        )
+        filter = install.CopyFilter('file1', 'file', link_files=True)
+        filter.apply(self._tmp_src_dir, self._tmp_dst_dir)
+        dst_file = os.path.join(self._tmp_dst_dir, 'file')
+        self.assertFalse(os.path.islink(dst_file))
+        self.assertFalse(os.path.samefile(os.path.join(outside_dir, 'file1'), dst_file))
+
+    def test_linked_file_is_replaced_not_overwritten(self):
+        self._create_file('file1', 'foo\n')
+        filter = install.CopyFilter('file1', 'file', link_files=True)
+        filter.apply(self._tmp_src_dir, self._tmp_dst_dir)
+        _create_file(self._tmp_src_dir, 'file2', 'bar\n')
+        filter = install.CopyFilter('file2', 'file')
+        filter.apply(self._tmp_src_dir, self._tmp_dst_dir)
+        with open(os.path.join(self._tmp_src_dir, 'file1')) as fobj:
+            self.assertEqual('foo\n', fobj.read())
+
     def test_copy_dir_into_file_raise_error(self):
         self._create_dir('dir1')
         filter = install.CopyFilter('dir1', 'file1')
@@ -206,3 +401,127 @@ class TestCopyFilter(unittest.TestCase):
         self._create_dir('dir2')
         filter = install.CopyFilter(['dir1', 'dir2'], 'file')
         self.assertRaises(Exception, filter.apply, self._tmp_src_dir, self._tmp_dst_dir)
+
+
+class _BarrierFilter:
+    # Create a file in the destination directory once every _BarrierFilter
+    # sharing the same barrier is being applied
+
+    def __init__(self, barrier, filename):
+        self._barrier = barrier
+        self._filename = filename
+
+    def apply(self, src_directory, dst_directory):
+        self._barrier.wait()
+        _create_file(dst_directory, self._filename)
+
+
+class _FailingFilter:
+    def apply(self, src_directory, dst_directory):
+        raise install.InstallationError('failed')
+
+
+class _RecordingFilter:
+    def __init__(self):
+        self.applied = False
+
+    def apply(self, src_directory, dst_directory):
+        self.applied = True
+
+
+class _SelectiveRecordingFilter(_RecordingFilter):
+    def __init__(self):
+        super().__init__()
+        self.predicate = None
+
+    def apply_selected(self, src_directory, dst_directory, predicate):
+        self.predicate = predicate
+        _create_dir(dst_directory, 'd')
+        _create_file(dst_directory, os.path.join('d', 'file.txt'))
+
+
+class TestInstallationProcess(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_independent_branches_are_executed_in_parallel(self):
+        barrier = threading.Barrier(2, timeout=5)
+        install_mgr = install.InstallationManager(
+            {
+                'sources': {'src': install.NullSource()},
+                'filters': {
+                    'a': (_BarrierFilter(barrier, 'a'), 'src'),
+                    'b': (_BarrierFilter(barrier, 'b'), 'src'),
+                    'cp_a': (install.CopyFilter('a', 'a'), 'a'),
+                    'cp_b': (install.CopyFilter('b', 'b'), 'b'),
+                },
+            }
+        )
+        install_process = install_mgr.new_installation_process(
+            self._tmp_dir, max_workers=2
+        )
+
+        result_dir = install_process.execute()
+
+        self.assertEqual(['a', 'b'], sorted(os.listdir(result_dir)))
+        install_process.cleanup()
+        self.assertEqual([], os.listdir(self._tmp_dir))
+
+    def test_failure_cancels_pending_nodes(self):
+        recording_filter = _RecordingFilter()
+        install_mgr = install.InstallationManager(
+            {
+                'sources': {'src': install.NullSource()},
+                'filters': {
+                    'fail': (_FailingFilter(), 'src'),
+                    'next': (recording_filter, 'fail'),
+                },
+            }
+        )
+        install_process = install_mgr.new_installation_process(
+            self._tmp_dir, max_workers=2
+        )
+
+        self.assertRaises(install.InstallationError, install_process.execute)
+        self.assertFalse(recording_filter.applied)
+        self.assertEqual([], os.listdir(self._tmp_dir))
+
+    def _execute_selective_filter(self, children):
+        selective_filter = _SelectiveRecordingFilter()
+        filters = {'sel': (selective_filter, 'src')}
+        for i, child in enumerate(children):
+            filters[f'child{i}'] = (child, 'sel')
+        install_mgr = install.InstallationManager(
+            {'sources': {'src': install.NullSource()}, 'filters': filters}
+        )
+        install_process = install_mgr.new_installation_process(self._tmp_dir)
+        install_process.execute()
+        install_process.cleanup()
+        return selective_filter
+
+    def test_predicates_are_pushed_down(self):
+        selective_filter = self._execute_selective_filter(
+            [
+                install.IncludeFilter('a*'),
+                install.ExcludeFilter(['b', 'a*']),
+                install.CopyFilter('d/*.txt', 'dir/'),
+            ]
+        )
+
+        predicate = selective_filter.predicate
+        self.assertFalse(selective_filter.applied)
+        self.assertTrue(predicate(os.path.join('a', 'file')))
+        self.assertFalse(predicate(os.path.join('b', 'file')))
+        self.assertTrue(predicate('c'))
+        self.assertTrue(predicate(os.path.join('d', 'file.txt')))
+
+    def test_predicates_are_not_pushed_down_if_unknown(self):
+        selective_filter = self._execute_selective_filter(
+            [install.IncludeFilter('a*'), install.NullFilter()]
+        )
+
+        self.assertTrue(selective_filter.applied)
+        self.assertIsNone(selective_filter.predicate)
@@ -0,0 +1,40 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+from unittest.mock import Mock
+
+import xivo_fetchfw.manifest as manifest
+
+
+class TestManifestEncoding(unittest.TestCase):
+    PATHS = ['lib/firmware/', 'lib/firmware/b.bin', 'lib/firmware/a.bin', 'été']
+
+    def test_decode_encoded_manifest(self):
+        data = manifest.encode_manifest(self.PATHS)
+        self.assertEqual(sorted(self.PATHS), manifest.decode_manifest(data))
+
+    def test_empty_manifest(self):
+        data = manifest.encode_manifest([])
+        self.assertEqual([], manifest.decode_manifest(data))
+
+    def test_common_prefixes_are_not_repeated(self):
+        paths = [f'usr/share/firmware/vendor/model/file{i}.bin' for i in range(100)]
+        data = manifest.encode_manifest(paths)
+        self.assertLess(len(data), sum(len(path) for path in paths) // 4)
+
+    def test_invalid_manifest_raise_error(self):
+        data = manifest.encode_manifest(self.PATHS)
+        self.assertRaises(manifest.ManifestError, manifest.decode_manifest, b'foo')
+        self.assertRaises(manifest.ManifestError, manifest.decode_manifest, data[:-4])
+
+
+class TestLazyManifest(unittest.TestCase):
+    def test_paths_are_loaded_once_on_first_access(self):
+        load_fun = Mock(return_value=['a', 'b'])
+        lazy_manifest = manifest.LazyManifest(load_fun)
+
+        self.assertFalse(lazy_manifest.loaded)
+        self.assertEqual(['a', 'b'], list(lazy_manifest))
+        self.assertEqual(2, len(lazy_manifest))
+        load_fun.assert_called_once_with()
@@ -1,9 +1,14 @@
-# Copyright 2013-2023 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2013-2026 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import os
+import shutil
+import tempfile
 from unittest import TestCase
+from unittest.mock import Mock
 
 import xivo_fetchfw.package as package
+import xivo_fetchfw.storage as storage
 
 
 class TestInstalledPackage(TestCase):
@@ -35,3 +40,76 @@ class TestInstallablePackage(TestCase):
     def test_raise_error_on_missing_mandatory_key(self):
         pkg_info = {'id': 'foo', 'description': 'Foo'}
         self.assertRaises(Exception, package.InstallablePackage, pkg_info, [], None)
+
+
+class TestPackageManagerFileOwnership(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._root_dir = self._new_dir('root')
+        self._installed_pkg_sto = storage.DefaultInstalledPkgStorage(
+            self._new_dir('db')
+        )
+        self._pkg_mgr = package.PackageManager(Mock(), self._installed_pkg_sto)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _new_dir(self, name):
+        path = os.path.join(self._tmp_dir, name)
+        os.mkdir(path)
+        return path
+
+    def _new_installable_pkg(self, pkg_id, filenames):
+        result_dir = self._new_dir(f'result-{pkg_id}')
+        os.mkdir(os.path.join(result_dir, 'lib'))
+        for filename in filenames:
+            with open(os.path.join(result_dir, 'lib', filename), 'w') as fobj:
+                fobj.write(pkg_id)
+        install_mgr = Mock()
+        install_mgr.new_installation_process.return_value.execute.return_value = (
+            result_dir
+        )
+        pkg_info = {'id': pkg_id, 'version': '1', 'description': pkg_id}
+        pkg = package.InstallablePackage(pkg_info, [], install_mgr)
+        pkg.pkg_info['explicit_install'] = True
+        return pkg
+
+    def test_install_conflicting_file_raise_error(self):
+        self._pkg_mgr._install_pkg(
+            self._new_installable_pkg('foo', ['a']), self._root_dir
+        )
+
+        self.assertRaises(
+            package.FileConflictError,
+            self._pkg_mgr._install_pkg,
+            self._new_installable_pkg('bar', ['a', 'b']),
+            self._root_dir,
+        )
+        self.assertEqual(['a'], os.listdir(os.path.join(self._root_dir, 'lib')))
+        self.assertNotIn('bar', self._installed_pkg_sto)
+
+    def test_uninstall_keep_shared_directories(self):
+        self._pkg_mgr._install_pkg(
+            self._new_installable_pkg('foo', ['a']), self._root_dir
+        )
+        self._pkg_mgr._install_pkg(
+            self._new_installable_pkg('bar', ['b']), self._root_dir
+        )
+
+        self._pkg_mgr._uninstall_pkg(self._installed_pkg_sto['foo'], self._root_dir)
+
+        self.assertEqual(['b'], os.listdir(os.path.join(self._root_dir, 'lib')))
+        self.assertEqual({'bar'}, self._installed_pkg_sto.get_owners('lib/'))
+
+    def test_failed_install_remove_installed_pkgs(self):
+        pkgs = [
+            self._new_installable_pkg('foo', ['a']),
+            self._new_installable_pkg('bar', ['b']),
+        ]
+        pkgs[1].install_mgr.new_installation_process.side_effect = Exception()
+
+        self.assertRaises(
+            Exception, self._pkg_mgr._install_pkgs, pkgs, self._root_dir, Mock()
+        )
+        self.assertEqual([], os.listdir(self._root_dir))
+        self.assertNotIn('foo', self._installed_pkg_sto)
@@ -0,0 +1,55 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import datetime
+import unittest
+from unittest.mock import Mock
+
+import xivo_fetchfw.download as download
+import xivo_fetchfw.schedule as schedule
+
+
+def _new_windows(raw_windows, hour, minute=0):
+    now = datetime.datetime(2026, 1, 1, hour, minute)
+    return schedule.DownloadWindows(raw_windows, now_fun=lambda: now)
+
+
+class TestDownloadWindows(unittest.TestCase):
+    def test_is_open(self):
+        self.assertTrue(_new_windows('01:00-06:00', 1).is_open())
+        self.assertFalse(_new_windows('01:00-06:00', 6).is_open())
+
+    def test_window_spanning_midnight(self):
+        self.assertTrue(_new_windows('22:00-06:00', 23).is_open())
+        self.assertTrue(_new_windows('22:00-06:00', 2).is_open())
+        self.assertFalse(_new_windows('22:00-06:00', 12).is_open())
+
+    def test_seconds_until_open(self):
+        self.assertEqual(0, _new_windows('01:00-06:00', 2).seconds_until_open())
+        self.assertEqual(
+            3600, _new_windows('01:00-06:00 22:00-23:00', 21).seconds_until_open()
+        )
+        self.assertEqual(2 * 3600, _new_windows('01:00-06:00', 23).seconds_until_open())
+
+    def test_invalid_windows_raise_error(self):
+        for raw_windows in ['', '1:00-2:00', '01:00-01:00', '25:00-26:00']:
+            self.assertRaises(
+                schedule.ScheduleError, schedule.DownloadWindows, raw_windows
+            )
+
+
+class TestDownloadInWindows(unittest.TestCase):
+    def test_download_is_retried_after_pause(self):
+        windows = _new_windows('01:00-06:00', 23)
+        remote_file = Mock()
+        remote_file.download.side_effect = [download.DownloadPausedError(), None]
+        sleep_fun = Mock()
+
+        schedule.download_in_windows(remote_file, windows, sleep_fun=sleep_fun)
+
+        self.assertEqual(2, remote_file.download.call_count)
+        sleep_fun.assert_called_with(2 * 3600)
+
+    def test_hook_pause_download_when_closed(self):
+        hook = schedule.DownloadWindowHook(_new_windows('01:00-06:00', 23))
+        self.assertRaises(download.DownloadPausedError, hook.update, b'foo')
@@ -0,0 +1,104 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import xivo_fetchfw.catalog as catalog
+import xivo_fetchfw.search as search
+
+CATALOG = """
+[pkg_aastra-fw]
+description: Firmware for Aastra phones
+description_fr: Micrologiciel pour les téléphones Aastra
+version: 3.2
+
+[pkg_aastra-lang]
+description: Language files for Aastra phones
+version: 1.0
+
+[pkg_snom-fw]
+description: Firmware for Snom phones, also for aastra-like devices
+version: 8.7
+
+[file_foo]
+url: http://example.org/foo.zip
+"""
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        with open(os.path.join(self._tmp_dir, 'test.db'), 'w') as fobj:
+            fobj.write(CATALOG)
+        self._catalog = catalog.Catalog(self._tmp_dir)
+        self._catalog.update()
+        self._index = search.SearchIndex.build(self._catalog.config)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _search(self, query, filter_fun=None):
+        return [result.pkg_id for result in self._index.search(query, filter_fun)]
+
+    def test_empty_query_return_all_pkgs(self):
+        self.assertEqual(['aastra-fw', 'aastra-lang', 'snom-fw'], self._search(''))
+
+    def test_ranking(self):
+        self.assertEqual(
+            ['aastra-fw', 'aastra-lang', 'snom-fw'], self._search('aastra')
+        )
+        self.assertEqual(['snom-fw'], self._search('SNOM'))
+
+    def test_every_term_must_match(self):
+        self.assertEqual(['aastra-fw', 'snom-fw'], self._search('firmware aastra'))
+        self.assertEqual([], self._search('firmware polycom'))
+
+    def test_localized_description(self):
+        self.assertEqual(['aastra-fw'], self._search('téléphones'))
+
+    def test_short_term(self):
+        self.assertEqual(['aastra-fw', 'snom-fw'], self._search('fw'))
+
+    def test_filter_fun(self):
+        def filter_fun(pkg_id, version):
+            return version == '1.0'
+
+        self.assertEqual(['aastra-lang'], self._search('aastra', filter_fun))
+
+
+class TestLoadSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._tmp_dir, 'test.db')
+        with open(self._path, 'w') as fobj:
+            fobj.write(CATALOG)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _load(self):
+        catalog_ = catalog.Catalog(self._tmp_dir)
+        catalog_.update()
+        return search.load_search_index(self._tmp_dir, catalog_)
+
+    def test_saved_index_is_reused(self):
+        self._load()
+
+        with patch.object(search.SearchIndex, 'build') as build:
+            index = self._load()
+
+        build.assert_not_called()
+        self.assertEqual(3, len(index.search('')))
+
+    def test_saved_index_is_rebuilt_when_catalog_change(self):
+        self._load()
+        with open(self._path, 'a') as fobj:
+            fobj.write('[pkg_new]\ndescription: New\nversion: 1\n')
+
+        index = self._load()
+
+        self.assertEqual(['new'], [result.pkg_id for result in index.search('new')])
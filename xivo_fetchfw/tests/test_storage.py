@@ -1,13 +1,16 @@
-# Copyright 2013-2023 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2013-2026 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import json
 import os
+import shutil
 import tempfile
 import unittest
 from configparser import RawConfigParser
-from unittest.mock import MagicMock, Mock
+from unittest.mock import MagicMock, Mock, patch
 
 import xivo_fetchfw.storage as storage
+from xivo_fetchfw.package import InstalledPackage
 
 TEST_RES_DIR = os.path.join(os.path.dirname(__file__), 'storage')
 
@@ -99,6 +102,38 @@ class TestDefaultRemoteFileBuilder(unittest.TestCase):
         builder.build_remote_file(config, self.SECTION)
         downloaders.__getitem__.assert_called_once_with('default')
 
+    def test_deltas_are_built(self):
+        builder = storage.DefaultRemoteFileBuilder(self._cache_dir, self._downloaders)
+        config = RawConfigParser()
+        config.add_section(self.SECTION)
+        config.set(self.SECTION, 'url', 'http://example.org/foo.zip')
+        config.set(self.SECTION, 'size', '1')
+        config.set(self.SECTION, 'sha1sum', self.SHA1SUM)
+        config.set(
+            self.SECTION,
+            'deltas',
+            f'foo-1.zip {self.SHA1SUM} http://example.org/foo.bsdiff {self.SHA1SUM}',
+        )
+
+        xfile = builder.build_remote_file(config, self.SECTION)
+        self.assertEqual(1, len(xfile.deltas))
+        self.assertEqual(
+            os.path.join(self._cache_dir, 'foo-1.zip'), xfile.deltas[0].base_path
+        )
+
+    def test_invalid_deltas_raise_error(self):
+        builder = storage.DefaultRemoteFileBuilder(self._cache_dir, self._downloaders)
+        config = RawConfigParser()
+        config.add_section(self.SECTION)
+        config.set(self.SECTION, 'url', 'http://example.org/foo.zip')
+        config.set(self.SECTION, 'size', '1')
+        config.set(self.SECTION, 'sha1sum', self.SHA1SUM)
+        config.set(self.SECTION, 'deltas', 'foo-1.zip')
+
+        self.assertRaises(
+            storage.ParsingError, builder.build_remote_file, config, self.SECTION
+        )
+
 
 class TestDefaultFilterBuilder(unittest.TestCase):
     def setUp(self):
@@ -107,6 +142,18 @@ class TestDefaultFilterBuilder(unittest.TestCase):
     def test_build_null_filter_ok(self):
         self._builder.build_node(['null'])
 
+    def test_archive_filters_are_sequential_by_default(self):
+        filter = self._builder.build_node(['unzip', '*.zip'])
+
+        self.assertEqual(1, filter._max_workers)
+
+    def test_archive_filters_use_extract_workers(self):
+        builder = storage.DefaultFilterBuilder(extract_workers=4)
+
+        filter = builder.build_node(['untar', '*.tar'])
+
+        self.assertEqual(4, filter._max_workers)
+
     def test_invalid_argument_null_filter_raise_error(self):
         self.assertRaises(Exception, self._builder.build_node, ['null', 'foo'])
 
@@ -129,8 +176,54 @@ class TestDefaultInstallMgrFactory(unittest.TestCase):
         config.add_section(self.SECTION)
         config.set(self.SECTION, 'a-b', 'null')
         config.set(self.SECTION, 'b-a', 'null')
-        mgr_factory = storage.DefaultInstallMgrFactory(config, self.SECTION, Mock(), {})
-        self.assertRaises(Exception, mgr_factory.new_install_mgr, Mock(), {})
+        self.assertRaises(
+            storage.ParsingError,
+            storage.DefaultInstallMgrFactory,
+            config,
+            self.SECTION,
+            Mock(),
+            {},
+        )
+
+    def test_raise_error_on_reserved_dst(self):
+        config = RawConfigParser()
+        config.add_section(self.SECTION)
+        config.set(self.SECTION, 'b-a', 'null')
+        self.assertRaises(
+            storage.ParsingError,
+            storage.DefaultInstallMgrFactory,
+            config,
+            self.SECTION,
+            Mock(),
+            {},
+        )
+
+    def test_raise_error_on_undefined_variable(self):
+        config = RawConfigParser()
+        config.add_section(self.SECTION)
+        config.set(self.SECTION, 'a-b', 'untar $FOO')
+        self.assertRaises(
+            storage.ParsingError,
+            storage.DefaultInstallMgrFactory,
+            config,
+            self.SECTION,
+            Mock(),
+            {},
+        )
+
+    def test_section_is_compiled_once(self):
+        config = Mock()
+        config.items.return_value = [('a-b', 'untar $FILE1'), ('b-c', 'exclude $V')]
+        filter_builder = Mock()
+        mgr_factory = storage.DefaultInstallMgrFactory(
+            config, self.SECTION, filter_builder, {'V': 'foo'}
+        )
+        mgr_factory.new_install_mgr(Mock(), {'FILE1': 'foo.tar'})
+        mgr_factory.new_install_mgr(Mock(), {'FILE1': 'bar.tar'})
+
+        config.items.assert_called_once_with(self.SECTION)
+        filter_builder.build_node.assert_any_call(['untar', 'bar.tar'])
+        filter_builder.build_node.assert_any_call(['exclude', 'foo'])
 
 
 class TestDefaultInstallMgrFactoryBuilder(unittest.TestCase):
@@ -148,19 +241,143 @@ class TestDefaultInstallMgrFactoryBuilder(unittest.TestCase):
 
 class TestDefaultInstallablePkgStorage(unittest.TestCase):
     def setUp(self):
-        self._cache_dir = tempfile.mkdtemp()
+        self._tmp_dir = tempfile.mkdtemp()
+        self._cache_dir = os.path.join(self._tmp_dir, 'cache')
+        os.mkdir(self._cache_dir)
+        # the db dir is copied since the storage writes its catalog snapshot in it
+        self._db_dir = os.path.join(self._tmp_dir, 'installable')
+        shutil.copytree(os.path.join(TEST_RES_DIR, 'installable'), self._db_dir)
 
     def tearDown(self):
-        os.rmdir(self._cache_dir)
+        shutil.rmtree(self._tmp_dir)
 
-    def test_ok_on_valid_db(self):
-        db_dir = os.path.join(TEST_RES_DIR, 'installable')
-        installable_pkg_sto = storage.new_installable_pkg_storage(
-            db_dir, self._cache_dir, {'default': 'default dler'}, {}
+    def _new_installable_pkg_sto(self):
+        return storage.new_installable_pkg_storage(
+            self._db_dir, self._cache_dir, {'default': 'default dler'}, {}
         )
+
+    def test_ok_on_valid_db(self):
+        installable_pkg_sto = self._new_installable_pkg_sto()
         self.assertTrue('simple1' in installable_pkg_sto)
         self.assertTrue('simple2' in installable_pkg_sto)
 
+    def test_pkgs_are_built_on_first_access(self):
+        installable_pkg_sto = self._new_installable_pkg_sto()
+        with patch.object(
+            storage.DefaultPkgBuilder, 'build_installable_pkg'
+        ) as build_installable_pkg:
+            self.assertEqual(['simple1', 'simple2'], sorted(installable_pkg_sto))
+            self.assertEqual(
+                {'pkg_simple1'},
+                installable_pkg_sto.get_dependencies('simple2', ignore_missing=True),
+            )
+            build_installable_pkg.assert_not_called()
+
+            installable_pkg_sto['simple1']
+            installable_pkg_sto['simple1']
+
+            build_installable_pkg.assert_called_once()
+
+    def test_pkg_with_invalid_install_raise_error_on_access(self):
+        with open(os.path.join(self._db_dir, 'invalid.db'), 'w') as fobj:
+            fobj.write('[pkg_invalid]\ndescription: foo\nversion: 1\ninstall: foo\n')
+        installable_pkg_sto = self._new_installable_pkg_sto()
+
+        self.assertEqual('1', installable_pkg_sto['simple2'].pkg_info['version'])
+        self.assertRaises(
+            storage.ParsingError, installable_pkg_sto.__getitem__, 'invalid'
+        )
+
+    def test_build_error_raise_parsing_error(self):
+        installable_pkg_sto = self._new_installable_pkg_sto()
+        with patch.object(
+            storage.DefaultPkgBuilder,
+            'build_installable_pkg',
+            side_effect=KeyError('FILE2'),
+        ):
+            self.assertRaises(
+                storage.ParsingError, installable_pkg_sto.__getitem__, 'simple1'
+            )
+            self.assertRaises(storage.ParsingError, installable_pkg_sto.get, 'simple1')
+
+    def test_remote_files_with_same_path_raise_error_on_load(self):
+        with open(os.path.join(self._db_dir, 'invalid.db'), 'w') as fobj:
+            fobj.write('[file_file2]\nurl: http://example.com/foo.zip\nsize: 1\n')
+
+        self.assertRaises(storage.ParsingError, self._new_installable_pkg_sto)
+
+    def test_invalid_install_raise_error_on_load(self):
+        with open(os.path.join(self._db_dir, 'invalid.db'), 'w') as fobj:
+            fobj.write('[install_invalid]\na-b: null\nc-d: null\nd-c: null\n')
+
+        self.assertRaises(storage.ParsingError, self._new_installable_pkg_sto)
+
+    def test_failed_reload_leave_storage_unchanged(self):
+        installable_pkg_sto = self._new_installable_pkg_sto()
+        with open(os.path.join(self._db_dir, 'new.db'), 'w') as fobj:
+            fobj.write(
+                '[install_bad]\na: null\n\n'
+                '[pkg_c]\ndescription: c\nversion: 1\ndepends: simple1\n'
+            )
+
+        self.assertRaises(storage.ParsingError, installable_pkg_sto.reload)
+        self.assertNotIn('c', installable_pkg_sto)
+        self.assertRaises(storage.ParsingError, installable_pkg_sto.reload)
+
+        with open(os.path.join(self._db_dir, 'new.db'), 'w') as fobj:
+            fobj.write('[pkg_c]\ndescription: c\nversion: 1\ndepends: simple1\n')
+        installable_pkg_sto.reload()
+
+        self.assertEqual({'simple1'}, installable_pkg_sto.get_dependencies('c'))
+
+    def test_reload_remote_file_path_moved_to_another_file(self):
+        installable_pkg_sto = self._new_installable_pkg_sto()
+        path = os.path.join(self._db_dir, 'test.db')
+        with open(path) as fobj:
+            content = fobj.read()
+        with open(path, 'w') as fobj:
+            fobj.write(content.replace('foo.zip', 'bar.zip'))
+        with open(os.path.join(self._db_dir, 'new.db'), 'w') as fobj:
+            fobj.write('[file_file3]\nurl: http://example.com/foo.zip\nsize: 1\n')
+
+        installable_pkg_sto.reload()
+
+        self.assertIn('file3', installable_pkg_sto._remote_files)
+
+    def test_reload_remote_file_with_path_of_unchanged_file_raise_error(self):
+        installable_pkg_sto = self._new_installable_pkg_sto()
+        with open(os.path.join(self._db_dir, 'new.db'), 'w') as fobj:
+            fobj.write('[file_file3]\nurl: http://example.org/foo.zip\nsize: 1\n')
+
+        self.assertRaises(storage.ParsingError, installable_pkg_sto.reload)
+
+    def test_reload_only_rebuild_changed_pkgs(self):
+        installable_pkg_sto = self._new_installable_pkg_sto()
+        simple1 = installable_pkg_sto['simple1']
+        simple2 = installable_pkg_sto['simple2']
+        with open(os.path.join(self._db_dir, 'new.db'), 'w') as fobj:
+            fobj.write('[pkg_simple3]\ndescription: foo\nversion: 1\n')
+
+        installable_pkg_sto.reload()
+
+        self.assertIs(simple1, installable_pkg_sto['simple1'])
+        self.assertIs(simple2, installable_pkg_sto['simple2'])
+        self.assertIn('simple3', installable_pkg_sto)
+
+    def test_reload_rebuild_pkgs_referencing_changed_file(self):
+        installable_pkg_sto = self._new_installable_pkg_sto()
+        simple1 = installable_pkg_sto['simple1']
+        path = os.path.join(self._db_dir, 'test.db')
+        with open(path) as fobj:
+            content = fobj.read()
+        with open(path, 'w') as fobj:
+            fobj.write(content.replace('size: 1', 'size: 22'))
+
+        installable_pkg_sto.reload()
+
+        self.assertIsNot(simple1, installable_pkg_sto['simple1'])
+        self.assertEqual(22, installable_pkg_sto['simple1'].remote_files[0].size)
+
 
 class TestDefaultInstalledPkgStorage(unittest.TestCase):
     def test_ok_on_valid_db(self):
@@ -168,6 +385,265 @@ class TestDefaultInstalledPkgStorage(unittest.TestCase):
         installed_pkg_sto = storage.new_installed_pkg_storage(db_dir)
         self.assertTrue('simple1' in installed_pkg_sto)
 
+    def test_reload_update_changed_pkgs(self):
+        db_dir = tempfile.mkdtemp()
+        try:
+            installed_pkg_sto = storage.new_installed_pkg_storage(db_dir)
+            pkg_info = {
+                'id': 'foo',
+                'version': '1',
+                'description': 'foo',
+                'files': [],
+                'explicit_install': True,
+                'depends': ['bar'],
+            }
+            installed_pkg_sto.insert_pkg(InstalledPackage(pkg_info))
+            foo = installed_pkg_sto['foo']
+            with open(os.path.join(db_dir, 'bar'), 'w') as fobj:
+                json.dump(dict(pkg_info, id='bar', depends=[]), fobj)
+
+            installed_pkg_sto.reload()
+
+            self.assertIs(foo, installed_pkg_sto['foo'])
+            self.assertEqual({'foo'}, installed_pkg_sto.get_requisites('bar'))
+
+            self.assertEqual({'bar'}, installed_pkg_sto.get_dependencies('foo'))
+
+            os.remove(os.path.join(db_dir, 'foo'))
+            installed_pkg_sto.reload()
+
+            self.assertNotIn('foo', installed_pkg_sto)
+            self.assertEqual(set(), installed_pkg_sto.get_requisites('bar'))
+            self.assertRaises(KeyError, installed_pkg_sto.get_dependencies, 'foo')
+        finally:
+            shutil.rmtree(db_dir)
+
+
+def _new_installed_pkg(pkg_id, depends=[], files=[]):
+    return InstalledPackage(
+        {
+            'id': pkg_id,
+            'version': '1',
+            'description': pkg_id,
+            'files': list(files),
+            'explicit_install': True,
+            'depends': list(depends),
+        }
+    )
+
+
+class TestDefaultInstalledPkgStorageManifests(unittest.TestCase):
+    def setUp(self):
+        self._db_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._db_dir)
+
+    def test_files_are_loaded_lazily(self):
+        pkg_sto = storage.DefaultInstalledPkgStorage(self._db_dir)
+        pkg_sto.insert_pkg(_new_installed_pkg('foo', files=['b', 'a/']))
+
+        pkg_sto = storage.DefaultInstalledPkgStorage(self._db_dir)
+        files = pkg_sto['foo'].pkg_info['files']
+
+        self.assertFalse(files.loaded)
+        self.assertEqual(['a/', 'b'], list(files))
+
+    def test_manifest_is_removed_on_delete(self):
+        pkg_sto = storage.DefaultInstalledPkgStorage(self._db_dir)
+        pkg_sto.insert_pkg(_new_installed_pkg('foo', files=['a']))
+        pkg_sto.delete_pkg('foo')
+
+        manifests_dir = os.path.join(self._db_dir, pkg_sto.MANIFESTS_DIR)
+        self.assertEqual([], os.listdir(manifests_dir))
+
+
+class TestDefaultInstalledPkgStorageOwners(unittest.TestCase):
+    def setUp(self):
+        self._db_dir = tempfile.mkdtemp()
+        self._pkg_sto = storage.DefaultInstalledPkgStorage(self._db_dir)
+        self._pkg_sto.insert_pkg(_new_installed_pkg('foo', files=['lib/', 'lib/a']))
+        self._pkg_sto.insert_pkg(_new_installed_pkg('bar', files=['lib/', 'lib/b']))
+
+    def tearDown(self):
+        shutil.rmtree(self._db_dir)
+
+    def test_get_owners(self):
+        self.assertEqual({'foo', 'bar'}, self._pkg_sto.get_owners('lib/'))
+        self.assertEqual({'foo'}, self._pkg_sto.get_owners('lib/a'))
+        self.assertEqual(set(), self._pkg_sto.get_owners('lib/c'))
+
+    def test_index_is_persisted(self):
+        pkg_sto = storage.DefaultInstalledPkgStorage(self._db_dir)
+        with patch.object(pkg_sto, '_build_owner_index') as build_owner_index:
+            self.assertEqual({'bar'}, pkg_sto.get_owners('lib/b'))
+            build_owner_index.assert_not_called()
+
+    def test_index_is_rebuilt_when_missing(self):
+        os.remove(
+            os.path.join(
+                self._db_dir, storage.DefaultInstalledPkgStorage.OWNERS_FILENAME
+            )
+        )
+        pkg_sto = storage.DefaultInstalledPkgStorage(self._db_dir)
+
+        self.assertEqual({'bar'}, pkg_sto.get_owners('lib/b'))
+
+    def test_index_is_updated_on_update_and_delete(self):
+        self._pkg_sto.update_pkg(_new_installed_pkg('foo', files=['lib/', 'lib/c']))
+        self._pkg_sto.delete_pkg('bar')
+
+        self.assertEqual({'foo'}, self._pkg_sto.get_owners('lib/'))
+        self.assertEqual(set(), self._pkg_sto.get_owners('lib/a'))
+        self.assertEqual({'foo'}, self._pkg_sto.get_owners('lib/c'))
+
+    def test_get_conflicts(self):
+        conflicts = self._pkg_sto.get_conflicts('baz', ['lib/', 'lib/a', 'lib/d'])
+
+        self.assertEqual({'lib/a': {'foo'}}, conflicts)
+        self.assertEqual({}, self._pkg_sto.get_conflicts('foo', ['lib/', 'lib/a']))
+
+    def test_get_exclusive_paths(self):
+        paths = self._pkg_sto.get_exclusive_paths('foo', ['lib/', 'lib/a'])
+
+        self.assertEqual(['lib/a'], paths)
+
+
+class TestDefaultInstalledPkgStorageTransaction(unittest.TestCase):
+    def setUp(self):
+        self._db_dir = tempfile.mkdtemp()
+        self._pkg_sto = storage.DefaultInstalledPkgStorage(self._db_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self._db_dir)
+
+    def _new_pkg_sto(self):
+        return storage.DefaultInstalledPkgStorage(self._db_dir)
+
+    def test_writes_are_done_on_commit(self):
+        self._pkg_sto.begin()
+        self._pkg_sto.insert_pkg(_new_installed_pkg('foo', files=['a']))
+        self._pkg_sto.insert_pkg(_new_installed_pkg('bar'))
+        self.assertEqual([], self._new_pkg_sto().keys())
+
+        calls = []
+        with patch('os.fsync', side_effect=lambda fd: calls.append('fsync')), patch(
+            'os.remove', side_effect=lambda path: calls.append(path)
+        ):
+            self._pkg_sto.commit()
+
+        # journal, db dir, 2 manifests, 2 package files, db dir, manifests dir
+        self.assertEqual(['fsync'] * 8, calls[:-1])
+        self.assertEqual(os.path.join(self._db_dir, '.journal'), calls[-1])
+        os.remove(calls[-1])
+        self.assertEqual(['bar', 'foo'], sorted(self._new_pkg_sto()))
+        self.assertEqual(['a'], list(self._new_pkg_sto()['foo'].pkg_info['files']))
+
+    def test_rollback(self):
+        self._pkg_sto.insert_pkg(_new_installed_pkg('foo'))
+        self._pkg_sto.begin()
+        self._pkg_sto.delete_pkg('foo')
+        self._pkg_sto.insert_pkg(_new_installed_pkg('bar', files=['a']))
+
+        self._pkg_sto.rollback()
+
+        self.assertEqual(['foo'], self._pkg_sto.keys())
+        self.assertEqual(set(), self._pkg_sto.get_owners('a'))
+        self.assertEqual(['foo'], self._new_pkg_sto().keys())
+
+    def test_interrupted_commit_is_applied_on_load(self):
+        self._pkg_sto.insert_pkg(_new_installed_pkg('foo'))
+        self._pkg_sto.begin()
+        self._pkg_sto.delete_pkg('foo')
+        self._pkg_sto.insert_pkg(_new_installed_pkg('bar', files=['a']))
+        with patch.object(self._pkg_sto, '_apply_journal', side_effect=OSError()):
+            self.assertRaises(OSError, self._pkg_sto.commit)
+
+        pkg_sto = self._new_pkg_sto()
+
+        self.assertEqual(['bar'], pkg_sto.keys())
+        self.assertEqual({'bar'}, pkg_sto.get_owners('a'))
+        self.assertNotIn(pkg_sto.JOURNAL_FILENAME, os.listdir(self._db_dir))
+
+    def test_begin_twice_raise_error(self):
+        self._pkg_sto.begin()
+        self.assertRaises(storage.StorageError, self._pkg_sto.begin)
+
+
+class TestSqliteInstalledPkgStorage(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._filename = os.path.join(self._tmp_dir, 'installed.sqlite')
+        self._pkg_sto = storage.SqliteInstalledPkgStorage(self._filename)
+
+    def tearDown(self):
+        self._pkg_sto.close()
+        shutil.rmtree(self._tmp_dir)
+
+    def _reopen(self):
+        self._pkg_sto.close()
+        self._pkg_sto = storage.SqliteInstalledPkgStorage(self._filename)
+
+    def test_pkgs_are_persisted(self):
+        self._pkg_sto.insert_pkg(_new_installed_pkg('foo', ['bar'], ['a', 'a/b']))
+        self._reopen()
+
+        pkg_info = self._pkg_sto['foo'].pkg_info
+        self.assertEqual(['bar'], pkg_info['depends'])
+        self.assertEqual(['a', 'a/b'], pkg_info['files'])
+        self.assertTrue(pkg_info['explicit_install'])
+
+    def test_update_and_delete(self):
+        self._pkg_sto.insert_pkg(_new_installed_pkg('foo', ['bar']))
+        self._pkg_sto.insert_pkg(_new_installed_pkg('bar'))
+        self._pkg_sto.update_pkg(_new_installed_pkg('foo', files=['c']))
+        self._pkg_sto.delete_pkg('bar')
+        self._reopen()
+
+        self.assertEqual(['foo'], self._pkg_sto.keys())
+        self.assertEqual([], self._pkg_sto['foo'].pkg_info['depends'])
+        self.assertEqual(['c'], self._pkg_sto['foo'].pkg_info['files'])
+
+    def test_get_requisites(self):
+        self._pkg_sto.insert_pkg(_new_installed_pkg('foo', ['bar']))
+        self._pkg_sto.insert_pkg(_new_installed_pkg('bar'))
+
+        self.assertEqual({'foo'}, self._pkg_sto.get_requisites('bar'))
+
+    def test_get_owners(self):
+        self._pkg_sto.insert_pkg(_new_installed_pkg('foo', files=['lib/', 'lib/a']))
+        self._pkg_sto.insert_pkg(_new_installed_pkg('bar', files=['lib/']))
+
+        self.assertEqual({'foo', 'bar'}, self._pkg_sto.get_owners('lib/'))
+        self.assertEqual({'foo'}, self._pkg_sto.get_owners('lib/a'))
+
+    def test_transaction_is_rolled_back_on_error(self):
+        self._pkg_sto.insert_pkg(_new_installed_pkg('foo'))
+        try:
+            with self._pkg_sto.transaction():
+                self._pkg_sto.insert_pkg(_new_installed_pkg('bar'))
+                self._pkg_sto.delete_pkg('foo')
+                raise Exception()
+        except Exception:
+            pass
+
+        self.assertEqual(['foo'], self._pkg_sto.keys())
+        self._reopen()
+        self.assertEqual(['foo'], self._pkg_sto.keys())
+
+    def test_migration_from_json_storage(self):
+        json_db_dir = os.path.join(self._tmp_dir, 'installed')
+        os.mkdir(json_db_dir)
+        json_pkg_sto = storage.DefaultInstalledPkgStorage(json_db_dir)
+        json_pkg_sto.insert_pkg(_new_installed_pkg('foo', files=['a']))
+        filename = os.path.join(self._tmp_dir, 'migrated.sqlite')
+
+        pkg_sto = storage.new_sqlite_installed_pkg_storage(filename, json_db_dir)
+        try:
+            self.assertEqual(['a'], pkg_sto['foo'].pkg_info['files'])
+        finally:
+            pkg_sto.close()
+
 
 class TestBasePkgStorage(unittest.TestCase):
     def _new_pkg(self, depends=[]):
@@ -261,3 +737,41 @@ class TestBasePkgStorage(unittest.TestCase):
         self.assertEqual(
             ['b'], sorted(pkg_sto.get_dependencies('a', filter_fun=filter_fun))
         )
+
+    def test_dependencies_with_cycle_reachable_from_pkg(self):
+        pkgs = {
+            'a': self._new_pkg(['b']),
+            'b': self._new_pkg(['c']),
+            'c': self._new_pkg(['b', 'd']),
+            'd': self._new_pkg(),
+        }
+        pkg_sto = storage.BasePkgStorage()
+        pkg_sto._pkgs = pkgs
+        self.assertEqual(['b', 'c', 'd'], sorted(pkg_sto.get_dependencies('a')))
+        self.assertEqual(['b', 'c', 'd'], sorted(pkg_sto.get_dependencies('c')))
+        self.assertEqual([], sorted(pkg_sto.get_dependencies('d')))
+
+    def test_dependencies_are_cached_until_invalidated(self):
+        pkgs = {'a': self._new_pkg(['b']), 'b': self._new_pkg()}
+        pkg_sto = storage.BasePkgStorage()
+        pkg_sto._pkgs = pkgs
+        pkg_sto.get_dependencies('a')
+        pkgs['b'] = self._new_pkg(['c'])
+
+        self.assertEqual(['b'], sorted(pkg_sto.get_dependencies('a')))
+
+        pkg_sto._invalidate_dependencies()
+
+        self.assertEqual(
+            ['b', 'c'], sorted(pkg_sto.get_dependencies('a', ignore_missing=True))
+        )
+
+    def test_check_dependencies_log_cycles_and_missing(self):
+        pkgs = {'a': self._new_pkg(['b']), 'b': self._new_pkg(['a', 'c'])}
+        pkg_sto = storage.BasePkgStorage()
+        pkg_sto._pkgs = pkgs
+
+        with self.assertLogs(storage.logger, 'WARNING') as cm:
+            pkg_sto._check_dependencies()
+
+        self.assertEqual(2, len(cm.output))
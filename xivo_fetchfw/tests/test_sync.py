@@ -0,0 +1,123 @@
+# Copyright 2026 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import xivo_fetchfw.sync as sync
+from xivo_fetchfw.download import NotModifiedError
+
+BASE_URL = 'http://example.org/catalog/'
+
+
+class _FakeDownloader:
+    def __init__(self, files, etag='"1"'):
+        self.files = files
+        self.etag = etag
+        self.urls = []
+
+    def _index(self):
+        files = {
+            filename: {
+                'size': len(content),
+                'sha256': hashlib.sha256(content).hexdigest(),
+            }
+            for filename, content in self.files.items()
+        }
+        return json.dumps({'version': 1, 'files': files}).encode('ascii')
+
+    def download(self, url):
+        if not isinstance(url, str):
+            if url.get_header('If-none-match') == self.etag:
+                raise NotModifiedError(url.full_url)
+            url = url.full_url
+        self.urls.append(url)
+        if url == BASE_URL + 'index':
+            fobj = io.BytesIO(self._index())
+            fobj.headers = {'ETag': self.etag}
+        else:
+            fobj = io.BytesIO(self.files[url[len(BASE_URL) :]])
+        return fobj
+
+
+class TestSyncCatalog(unittest.TestCase):
+    def setUp(self):
+        self._db_dir = tempfile.mkdtemp()
+        self._downloader = _FakeDownloader({'a.db': b'[pkg_a]\n', 'b.db': b'[pkg_b]\n'})
+
+    def tearDown(self):
+        shutil.rmtree(self._db_dir)
+
+    def _sync(self):
+        self._downloader.urls = []
+        return sync.sync_catalog([BASE_URL], self._db_dir, self._downloader)
+
+    def _listdir(self):
+        return sorted(f for f in os.listdir(self._db_dir) if not f.startswith('.'))
+
+    def test_first_sync_download_all_files(self):
+        self.assertEqual((['a.db', 'b.db'], []), self._sync())
+        self.assertEqual(['a.db', 'b.db'], self._listdir())
+        with open(os.path.join(self._db_dir, 'a.db'), 'rb') as fobj:
+            self.assertEqual(b'[pkg_a]\n', fobj.read())
+
+    def test_sync_not_modified_download_nothing(self):
+        self._sync()
+
+        self.assertEqual(([], []), self._sync())
+        self.assertEqual([], self._downloader.urls)
+
+    def test_sync_download_only_changed_files(self):
+        self._sync()
+        self._downloader.etag = '"2"'
+        self._downloader.files['a.db'] = b'[pkg_a2]\n'
+        del self._downloader.files['b.db']
+
+        self.assertEqual((['a.db'], ['b.db']), self._sync())
+        self.assertEqual([BASE_URL + 'index', BASE_URL + 'a.db'], self._downloader.urls)
+        self.assertEqual(['a.db'], self._listdir())
+
+    def test_sync_restore_modified_local_file(self):
+        self._sync()
+        os.remove(os.path.join(self._db_dir, 'b.db'))
+
+        self.assertEqual((['b.db'], []), self._sync())
+
+    def test_sync_keep_other_files(self):
+        with open(os.path.join(self._db_dir, 'local.db'), 'w') as fobj:
+            fobj.write('[pkg_local]\n')
+
+        self._sync()
+
+        self.assertEqual(['a.db', 'b.db', 'local.db'], self._listdir())
+
+    def test_sync_remove_files_of_removed_repository(self):
+        self._sync()
+        with open(os.path.join(self._db_dir, 'local.db'), 'w') as fobj:
+            fobj.write('[pkg_local]\n')
+
+        result = sync.sync_catalog([], self._db_dir, self._downloader)
+
+        self.assertEqual(([], ['a.db', 'b.db']), result)
+        self.assertEqual(['local.db'], self._listdir())
+
+    def test_corrupted_file_leave_catalog_unchanged(self):
+        self._sync()
+        self._downloader.etag = '"2"'
+        self._downloader.files['a.db'] = b'[pkg_a2]\n'
+        self._downloader.files['b.db'] = b'[pkg_b2]\n'
+        index = self._downloader._index()
+        self._downloader._index = lambda: index
+        self._downloader.files['b.db'] = b'[pkg_b3]\n'
+
+        self.assertRaises(sync.SyncError, self._sync)
+        with open(os.path.join(self._db_dir, 'a.db'), 'rb') as fobj:
+            self.assertEqual(b'[pkg_a]\n', fobj.read())
+        self.assertFalse(
+            [f for f in os.listdir(self._db_dir) if f.startswith('.sync-')]
+        )
@@ -1,4 +1,4 @@
-# Copyright 2013-2023 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2013-2026 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import os
@@ -80,6 +80,20 @@ class TestApplySubs(unittest.TestCase):
         self.assertEqual(r'\$', result)
 
 
+class TestSubsTemplate(unittest.TestCase):
+    def test_names(self):
+        template = util.SubsTemplate(r'$foo ${bar}baz \$qux')
+        self.assertEqual({'foo', 'bar'}, template.names)
+
+    def test_render_many_times(self):
+        template = util.SubsTemplate('$foo/${bar}.txt')
+        self.assertEqual('a/b.txt', template.render({'foo': 'a', 'bar': 'b'}))
+        self.assertEqual('c/d.txt', template.render({'foo': 'c', 'bar': 'd'}))
+
+    def test_zero_length_variable_raise_error_on_compile(self):
+        self.assertRaises(ValueError, util.SubsTemplate, 'a$.')
+
+
 class TestCmpVersion(unittest.TestCase):
     TESTS = [
         ('1', '1', 0),
@@ -1,12 +1,14 @@
-# Copyright 2010-2023 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2010-2026 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import errno
+import functools
 import logging
 import operator
 import os
 import re
-import shutil
+
+from xivo_fetchfw import fastcopy
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +20,66 @@ class FetchfwError(Exception):
 _APPLY_SUBS_REGEX = re.compile(r'(?<!\\)\$(?:{(\w*)}|(\w*))')
 
 
+class SubsTemplate:
+    r"""A string with variable substitutions, parsed once so that it can be
+    rendered many times with different variables.
+
+    >>> template = SubsTemplate('${FOO}bar')
+    >>> template.names
+    frozenset({'FOO'})
+    >>> template.render({'FOO': 'foo'})
+    'foobar'
+
+    Raise a ValueError if the substitution string is invalid, like
+    using zero-length substitution variables ("a$." for example).
+
+    """
+
+    def __init__(self, string):
+        # parts is a list of literal strings, with a None placeholder for each
+        # variable, and vars a list of (index in parts, variable name)
+        self._parts = []
+        self._vars = []
+        pos = 0
+        for m in _APPLY_SUBS_REGEX.finditer(string):
+            var_name = m.group(1)
+            if var_name is None:
+                var_name = m.group(2)
+            if not var_name:
+                raise ValueError(f"invalid zero-length variable: {string}")
+            self._add_literal(string[pos : m.start()])
+            self._vars.append((len(self._parts), var_name))
+            self._parts.append(None)
+            pos = m.end()
+        self._add_literal(string[pos:])
+        self.names = frozenset(var_name for _, var_name in self._vars)
+
+    def _add_literal(self, literal):
+        if literal:
+            self._parts.append(literal.replace(r'\$', '$'))
+
+    def render(self, variables):
+        """Return the string with variable substitution applied.
+
+        Raise a KeyError if a substitution is not defined in variables.
+
+        """
+        if not self._vars:
+            return ''.join(self._parts)
+        parts = list(self._parts)
+        for index, var_name in self._vars:
+            try:
+                parts[index] = variables[var_name]
+            except KeyError:
+                raise KeyError(f"undefined substitution '{var_name}'")
+        return ''.join(parts)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_subs(string):
+    return SubsTemplate(string)
+
+
 def apply_subs(string, variables):
     r"""Apply and return string with variable substitution applied.
 
@@ -38,24 +100,7 @@ def apply_subs(string, variables):
     using zero-length substitution variables ("a$." for example).
 
     """
-
-    def aux(m):
-        var_name = m.group(1)
-        if var_name is None:
-            var_name = m.group(2)
-        if not var_name:
-            raise ValueError(f"invalid zero-length variable: {string}")
-        try:
-            var_value = variables[var_name]
-        except KeyError:
-            raise KeyError(f"undefined substitution '{var_name}'")
-        else:
-            # This treat a special case where var_value has the string
-            # "\$" in it, we don't want it to get unescaped at the end
-            return var_value.replace(r'\$', r'\\$')
-
-    interm = _APPLY_SUBS_REGEX.sub(aux, string)
-    return interm.replace(r'\$', '$')
+    return _compile_subs(string).render(variables)
 
 
 def _split_version(raw_version):
@@ -248,9 +293,7 @@ def install_paths(src_directory, dst_directory):
                     raise
             yield path + '/'
         else:
-            # Do not use shutil.copy since dst must not be a directory
-            shutil.copyfile(src_abs_path, dst_abs_path)
-            shutil.copymode(src_abs_path, dst_abs_path)
+            fastcopy.copy_file(src_abs_path, dst_abs_path)
             yield path
 
 